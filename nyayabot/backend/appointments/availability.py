@@ -0,0 +1,288 @@
+"""
+Slot availability engine.
+
+Each day is represented as an integer bitmap with one bit per
+``APPOINTMENT_SLOT_MINUTES`` slot (bit 0 is the slot starting at 00:00).
+Weekly templates, date overrides, holidays, breaks and blocking
+appointments are combined with plain bitwise arithmetic, and the free
+bitmaps are cached per lawyer and ISO week.
+
+Pending appointments stop blocking as soon as their booking hold lapses,
+whether or not ``release_expired_holds`` has run yet; a cached week holding
+a live hold expires with it.
+
+Weekly templates are ``LawyerAvailability`` rows without a ``special_date``.
+Rows with a ``special_date`` replace the template for that date, and any
+``is_holiday`` row closes the date entirely. Lawyers without any weekly rows
+fall back to the hours declared on their ``LawyerProfile``.
+"""
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Min, Q
+from django.utils import timezone
+
+from .models import Appointment, BookedSlot, LawyerAvailability
+
+SLOT_MINUTES = settings.APPOINTMENT_SLOT_MINUTES
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+FULL_DAY = (1 << SLOTS_PER_DAY) - 1
+
+# Appointments in these states occupy the lawyer's calendar
+BLOCKING_STATUSES = ('pending', 'confirmed')
+
+WEEKDAY_NAMES = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+
+
+def _minutes(value):
+    return value.hour * 60 + value.minute
+
+
+def window_mask(start, end):
+    """Slots lying entirely inside ``[start, end)``"""
+    first = -(-_minutes(start) // SLOT_MINUTES)
+    last = _minutes(end) // SLOT_MINUTES if end != time(0) else SLOTS_PER_DAY
+    if last <= first:
+        return 0
+    return ((1 << (last - first)) - 1) << first
+
+
+def busy_mask(start_minutes, duration_minutes):
+    """Slots touched by ``[start, start + duration)``, clipped to the day"""
+    first = start_minutes // SLOT_MINUTES
+    last = min(-(-(start_minutes + duration_minutes) // SLOT_MINUTES), SLOTS_PER_DAY)
+    if last <= first:
+        return 0
+    return ((1 << (last - first)) - 1) << first
+
+
+def availability_mask(row):
+    """Open slots of one ``LawyerAvailability`` row, with its break removed"""
+    mask = window_mask(row.start_time, row.end_time)
+    if row.break_start_time and row.break_end_time:
+        mask &= ~busy_mask(_minutes(row.break_start_time),
+                           _minutes(row.break_end_time) - _minutes(row.break_start_time))
+    return mask
+
+
+def build_day_bitmaps(weekly, overrides, busy, start, days):
+    """Combine schedule data into free-slot bitmaps for ``days`` consecutive dates.
+
+    ``weekly`` maps weekday -> open mask, ``overrides`` maps date -> open mask
+    (0 for holidays) and ``busy`` maps date -> occupied mask.
+    """
+    bitmaps = []
+    for offset in range(days):
+        day = start + timedelta(days=offset)
+        open_mask = overrides[day] if day in overrides else weekly.get(day.weekday(), 0)
+        bitmaps.append(open_mask & ~busy.get(day, 0))
+    return bitmaps
+
+
+def schedule_from_rows(rows):
+    """Split ``LawyerAvailability`` rows of one lawyer into ``(weekly, overrides)`` masks.
+
+    ``weekly`` is None when the lawyer has no weekly rows at all.
+    """
+    weekly = None
+    override_rows = {}
+    for row in rows:
+        if row.special_date is not None:
+            override_rows.setdefault(row.special_date, []).append(row)
+            continue
+        weekly = weekly if weekly is not None else {}
+        if row.is_available and not row.is_holiday:
+            weekly[row.weekday] = weekly.get(row.weekday, 0) | availability_mask(row)
+
+    overrides = {}
+    for day, day_rows in override_rows.items():
+        if any(row.is_holiday for row in day_rows):
+            overrides[day] = 0
+        else:
+            mask = 0
+            for row in day_rows:
+                if row.is_available:
+                    mask |= availability_mask(row)
+            overrides[day] = mask
+    return weekly, overrides
+
+
+def add_busy(busy, confirmed_date, confirmed_time, requested_date, requested_time, duration):
+    """Mark one blocking appointment (a ``BUSY_FIELDS`` row) in a date -> mask dict"""
+    day, at = (confirmed_date, confirmed_time) if confirmed_date and confirmed_time else (requested_date, requested_time)
+    busy[day] = busy.get(day, 0) | busy_mask(_minutes(at), duration)
+
+
+BUSY_FIELDS = ('confirmed_date', 'confirmed_time', 'requested_date', 'requested_time', 'duration_minutes')
+
+
+def blocking_appointments(start, end, now=None):
+    """Appointments occupying a lawyer's calendar between ``start`` and ``end``"""
+    lapsed = BookedSlot.objects.filter(hold_expires_at__lte=now or timezone.now()).values('appointment_id')
+    return Appointment.objects.filter(status__in=BLOCKING_STATUSES).filter(
+        Q(confirmed_date__range=(start, end)) |
+        Q(confirmed_date__isnull=True, requested_date__range=(start, end))
+    ).exclude(status='pending', id__in=lapsed).order_by()
+
+
+def availability_rows(start, end):
+    return LawyerAvailability.objects.filter(Q(special_date__isnull=True) | Q(special_date__range=(start, end)))
+
+
+def load_schedule(lawyer_id, start, end, include_busy=True, now=None):
+    """Fetch the weekly template, overrides and busy slots of a lawyer for ``[start, end]``.
+
+    Also returns when the first live booking hold among the busy appointments
+    lapses (None without one): the busy slots are only valid until then.
+    """
+    weekly, overrides = schedule_from_rows(availability_rows(start, end).filter(lawyer_id=lawyer_id))
+    if weekly is None:
+        weekly = profile_weekly_template(lawyer_id)
+
+    busy, hold_until = {}, None
+    if include_busy:
+        rows = blocking_appointments(start, end, now).filter(lawyer_id=lawyer_id).annotate(
+            hold=Min('booked_slots__hold_expires_at')
+        ).values_list(*BUSY_FIELDS, 'hold')
+        for *row, hold in rows:
+            add_busy(busy, *row)
+            if hold is not None and (hold_until is None or hold < hold_until):
+                hold_until = hold
+    return weekly, overrides, busy, hold_until
+
+
+def declared_hours_template(available_days, start, end):
+    """Weekly template from the ``available_*`` fields of a lawyer profile"""
+    if not (start and end):
+        return {}
+    mask = window_mask(start, end)
+    days = {day.lower() for day in available_days or []}
+    return {weekday: mask for weekday, name in enumerate(WEEKDAY_NAMES) if name in days}
+
+
+def profile_weekly_template(lawyer_id):
+    """Weekly template derived from the hours declared on the lawyer profile"""
+    from lawyers.models import LawyerProfile
+
+    profile = LawyerProfile.objects.filter(user_id=lawyer_id).order_by().values(
+        'available_days', 'available_time_start', 'available_time_end'
+    ).first()
+    if not profile:
+        return {}
+    return declared_hours_template(
+        profile['available_days'], profile['available_time_start'], profile['available_time_end']
+    )
+
+
+def _generation_key(lawyer_id):
+    return f'availability:generation:{lawyer_id}'
+
+
+def _week_key(lawyer_id, generation, monday):
+    return f'availability:{lawyer_id}:{generation}:{monday.isoformat()}'
+
+
+def free_bitmaps(lawyer_id, start, days):
+    """Free-slot bitmaps for ``days`` dates from ``start``, served from the per-week cache"""
+    first_monday = start - timedelta(days=start.weekday())
+    last_day = start + timedelta(days=days - 1)
+    mondays = [first_monday + timedelta(weeks=week) for week in range((last_day - first_monday).days // 7 + 1)]
+
+    generation = cache.get_or_set(_generation_key(lawyer_id), 0, None)
+    keys = {monday: _week_key(lawyer_id, generation, monday) for monday in mondays}
+    cached = cache.get_many(keys.values())
+    missing = [monday for monday in mondays if keys[monday] not in cached]
+
+    weeks = {monday: cached[keys[monday]] for monday in mondays if keys[monday] in cached}
+    if missing:
+        week_start, week_end = missing[0], missing[-1] + timedelta(days=6)
+        now = timezone.now()
+        weekly, overrides, busy, hold_until = load_schedule(lawyer_id, week_start, week_end, now=now)
+        fresh = {}
+        for monday in missing:
+            weeks[monday] = build_day_bitmaps(weekly, overrides, busy, monday, 7)
+            fresh[keys[monday]] = weeks[monday]
+        timeout = settings.AVAILABILITY_CACHE_TIMEOUT
+        if hold_until is not None:
+            timeout = min(timeout, max(int((hold_until - now).total_seconds()), 1))
+        cache.set_many(fresh, timeout)
+
+    offset = (start - first_monday).days
+    flat = [bitmap for monday in mondays for bitmap in weeks[monday]]
+    return flat[offset:offset + days]
+
+
+def open_bitmap(lawyer_id, day):
+    """Working-hours bitmap of one day, ignoring existing bookings"""
+    weekly, overrides, _, _ = load_schedule(lawyer_id, day, day, include_busy=False)
+    return build_day_bitmaps(weekly, overrides, {}, day, 1)[0]
+
+
+def invalidate_week(lawyer_id, day):
+    """Drop the cached week containing ``day`` (after a booking or cancellation)"""
+    generation = cache.get(_generation_key(lawyer_id))
+    if generation is not None:
+        cache.delete(_week_key(lawyer_id, generation, day - timedelta(days=day.weekday())))
+
+
+def invalidate_lawyer(lawyer_id):
+    """Drop every cached week of a lawyer (after a schedule change)"""
+    try:
+        cache.incr(_generation_key(lawyer_id))
+    except ValueError:
+        pass
+
+
+def bookable_starts(bitmap, duration_minutes):
+    """Bitmap of slots where an appointment of ``duration_minutes`` fits entirely"""
+    runs = bitmap
+    for shift in range(1, -(-duration_minutes // SLOT_MINUTES)):
+        runs &= bitmap >> shift
+    return runs
+
+
+def slot_range(at, duration_minutes):
+    """Indices of the slots occupied by an appointment starting at ``at``"""
+    first = _minutes(at) // SLOT_MINUTES
+    return range(first, min(-(-(_minutes(at) + duration_minutes) // SLOT_MINUTES), SLOTS_PER_DAY))
+
+
+def slot_time(index):
+    minutes = index * SLOT_MINUTES
+    return time(minutes // 60, minutes % 60)
+
+
+def iter_slots(bitmap):
+    while bitmap:
+        lowest = bitmap & -bitmap
+        yield lowest.bit_length() - 1
+        bitmap ^= lowest
+
+
+def available_slots(lawyer_id, start, days, duration_minutes=60, now=None):
+    """Return ``[(date, [time, ...]), ...]`` of bookable start times"""
+    now = now or timezone.localtime()
+    result = []
+    for offset, bitmap in enumerate(free_bitmaps(lawyer_id, start, days)):
+        day = start + timedelta(days=offset)
+        if day < now.date():
+            bitmap = 0
+        elif day == now.date():
+            # Only slots that start after the current moment
+            bitmap &= FULL_DAY & ~((1 << (-(-_minutes(now) // SLOT_MINUTES))) - 1)
+        starts = bookable_starts(bitmap, duration_minutes)
+        result.append((day, [slot_time(index) for index in iter_slots(starts)]))
+    return result
+
+
+def next_available_slots(lawyer_id, count, duration_minutes=60, horizon_days=14, now=None):
+    """The next ``count`` bookable slots as ``datetime`` objects in the local timezone"""
+    now = now or timezone.localtime()
+    slots = []
+    for day, times in available_slots(lawyer_id, now.date(), horizon_days, duration_minutes, now):
+        for at in times:
+            slots.append(timezone.make_aware(datetime.combine(day, at)))
+            if len(slots) == count:
+                return slots
+    return slots
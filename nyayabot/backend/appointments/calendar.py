@@ -0,0 +1,120 @@
+"""
+iCalendar (RFC 5545) feeds of a lawyer's confirmed appointments.
+
+Calendar apps poll feeds every few minutes, so a poll is answered from a
+single aggregate query: the feed's ETag is derived from the number of
+appointments in the feed and their latest ``updated_at``, and matching
+``If-None-Match`` requests get a 304 without rendering anything. When the
+feed did change it is rendered straight from a server-side cursor and
+streamed in chunks, so large calendars are never built in memory.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db.models import Count, Max, Q
+from django.utils import timezone
+
+from .models import Appointment, CalendarFeedToken
+
+EVENT_FIELDS = (
+    'id', 'title', 'description', 'confirmed_date', 'confirmed_time', 'duration_minutes',
+    'meeting_type', 'meeting_link', 'meeting_location', 'updated_at',
+    'user__username', 'user__first_name', 'user__last_name',
+)
+
+
+def feed_window(prefix=''):
+    """Confirmed appointments from ``CALENDAR_FEED_PAST_DAYS`` ago onwards are published"""
+    since = timezone.localdate() - timedelta(days=settings.CALENDAR_FEED_PAST_DAYS)
+    return Q(**{
+        f'{prefix}status': 'confirmed',
+        f'{prefix}confirmed_date__gte': since,
+        f'{prefix}confirmed_time__isnull': False,
+    })
+
+
+def feed_state(token):
+    """Return ``(lawyer_id, etag)`` for a feed token in one query, or None for an unknown token"""
+    appointment = 'lawyer__appointments_as_lawyer'
+    in_feed = feed_window(f'{appointment}__')
+    states = CalendarFeedToken.objects.filter(token=token).order_by().values('lawyer_id').annotate(
+        count=Count(appointment, filter=in_feed),
+        last_updated=Max(f'{appointment}__updated_at', filter=in_feed),
+    )
+    state = next(iter(states), None)
+    if state is None:
+        return None
+    last_updated = state['last_updated'].timestamp() if state['last_updated'] else 0
+    return state['lawyer_id'], f'"{state["count"]}-{last_updated:.6f}"'
+
+
+def escape(value):
+    return (value or '').replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\r\n', '\\n').replace('\n', '\\n')
+
+
+def fold(line):
+    """Split a content line into 75-octet pieces as required by RFC 5545"""
+    encoded = line.encode()
+    if len(encoded) <= 75:
+        return line + '\r\n'
+    pieces = []
+    while encoded:
+        limit = 75 if not pieces else 74
+        # Never cut a multi-byte character in half
+        while limit < len(encoded) and (encoded[limit] & 0xC0) == 0x80:
+            limit -= 1
+        pieces.append(encoded[:limit].decode())
+        encoded = encoded[limit:]
+    return '\r\n '.join(pieces) + '\r\n'
+
+
+def _utc(value):
+    return value.astimezone(dt_timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def render_event(row):
+    start = timezone.make_aware(datetime.combine(row['confirmed_date'], row['confirmed_time']))
+    client = f"{row['user__first_name']} {row['user__last_name']}".strip() or row['user__username']
+    description = '\n'.join(filter(None, [f'Client: {client}', row['description'], row['meeting_link']]))
+    lines = [
+        'BEGIN:VEVENT',
+        f"UID:appointment-{row['id']}@nyayabot",
+        f"DTSTAMP:{_utc(row['updated_at'])}",
+        f"LAST-MODIFIED:{_utc(row['updated_at'])}",
+        f'DTSTART:{_utc(start)}',
+        f"DTEND:{_utc(start + timedelta(minutes=row['duration_minutes']))}",
+        f"SUMMARY:{escape(row['title'])}",
+        f'DESCRIPTION:{escape(description)}',
+        'STATUS:CONFIRMED',
+    ]
+    location = row['meeting_location'] or row['meeting_link']
+    if location:
+        lines.append(f'LOCATION:{escape(location)}')
+    lines.append('END:VEVENT')
+    return ''.join(fold(line) for line in lines)
+
+
+def iter_calendar(lawyer_id, chunk_size=None):
+    """Yield the feed of a lawyer as text chunks of about ``chunk_size`` events"""
+    chunk_size = chunk_size or settings.CALENDAR_FEED_CHUNK_SIZE
+    yield ''.join(fold(line) for line in [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//NyayaBot//Appointments//EN',
+        'CALSCALE:GREGORIAN',
+        'METHOD:PUBLISH',
+        'X-WR-CALNAME:NyayaBot appointments',
+        f'X-WR-TIMEZONE:{settings.TIME_ZONE}',
+    ])
+    rows = Appointment.objects.filter(feed_window(), lawyer_id=lawyer_id).order_by(
+        'confirmed_date', 'confirmed_time'
+    ).values(*EVENT_FIELDS).iterator(chunk_size=chunk_size)
+
+    chunk = []
+    for row in rows:
+        chunk.append(render_event(row))
+        if len(chunk) == chunk_size:
+            yield ''.join(chunk)
+            chunk = []
+    chunk.append('END:VCALENDAR\r\n')
+    yield ''.join(chunk)
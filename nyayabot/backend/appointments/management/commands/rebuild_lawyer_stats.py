@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from appointments.stats import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the per-lawyer daily appointment statistics from the full appointment history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        rows = rebuild(batch_size=options['batch_size'])
+        self.stdout.write(f'Rebuilt {rows} daily statistics row(s)')
@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from appointments.reminders import dispatch_reminders
+
+
+class Command(BaseCommand):
+    help = 'Send reminder emails for upcoming confirmed appointments'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep running, dispatching every --interval seconds')
+        parser.add_argument('--interval', type=int, default=60)
+        parser.add_argument('--batch-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        while True:
+            sent = dispatch_reminders(batch_size=options['batch_size'])
+            self.stdout.write(f'Sent {sent} reminder(s)')
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from appointments.sweeper import sweep_appointments
+
+
+class Command(BaseCommand):
+    help = 'Cancel stale pending appointments and mark missed confirmed ones as no-shows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep running, sweeping every --interval seconds')
+        parser.add_argument('--interval', type=int, default=300)
+        parser.add_argument('--batch-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        while True:
+            swept = sweep_appointments(batch_size=options['batch_size'])
+            self.stdout.write(f"Cancelled {swept['cancelled']}, marked {swept['no_show']} as no-show")
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
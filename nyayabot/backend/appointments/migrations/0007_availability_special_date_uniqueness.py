@@ -0,0 +1,25 @@
+# Generated by Django 4.2.7 on 2026-10-19 05:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0006_lawyer_daily_stats'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='lawyeravailability',
+            unique_together=set(),
+        ),
+        migrations.AddConstraint(
+            model_name='lawyeravailability',
+            constraint=models.UniqueConstraint(condition=models.Q(('special_date__isnull', True)), fields=('lawyer', 'weekday', 'start_time'), name='unique_weekly_availability'),
+        ),
+        migrations.AddConstraint(
+            model_name='lawyeravailability',
+            constraint=models.UniqueConstraint(condition=models.Q(('special_date__isnull', False)), fields=('lawyer', 'special_date', 'start_time'), name='unique_special_date_availability'),
+        ),
+    ]
@@ -1,7 +1,55 @@
+import secrets
+from datetime import datetime
 from django.db import models
+from django.db.models import ExpressionWrapper, Q
 from django.conf import settings
 from django.utils import timezone
 
+def generate_feed_token():
+    return secrets.token_urlsafe(32)
+
+def _compare_start(lookup, moment):
+    """Q comparing an appointment's start with ``moment`` in the local timezone.
+    
+    Dates and times are stored as local wall-clock values, so ``moment`` is
+    converted to ``TIME_ZONE`` before being split into a date and a time.
+    The confirmed schedule is used when set, the requested one otherwise.
+    """
+    local = timezone.localtime(moment)
+    
+    def compare(date_field, time_field):
+        return Q(**{f'{date_field}__{lookup}': local.date()}) | Q(**{date_field: local.date(), f'{time_field}__{lookup}': local.time()})
+    
+    confirmed = Q(confirmed_date__isnull=False, confirmed_time__isnull=False)
+    unconfirmed = Q(confirmed_date__isnull=True) | Q(confirmed_time__isnull=True)
+    return (confirmed & compare('confirmed_date', 'confirmed_time')) | (unconfirmed & compare('requested_date', 'requested_time'))
+
+class AppointmentQuerySet(models.QuerySet):
+    ACTIVE_STATUSES = ('pending', 'confirmed')
+    
+    def starting_after(self, moment):
+        return self.filter(_compare_start('gt', moment))
+    
+    def starting_before(self, moment):
+        return self.filter(_compare_start('lt', moment))
+    
+    def upcoming(self, now=None):
+        return self.starting_after(now or timezone.now())
+    
+    def overdue(self, now=None):
+        """Pending or confirmed appointments whose start has passed"""
+        return self.filter(status__in=self.ACTIVE_STATUSES).starting_before(now or timezone.now())
+    
+    def with_states(self, now=None):
+        """Annotate ``upcoming`` and ``overdue`` booleans, usable in filters and ordering"""
+        now = now or timezone.now()
+        return self.annotate(
+            upcoming=ExpressionWrapper(_compare_start('gt', now), output_field=models.BooleanField()),
+            overdue=ExpressionWrapper(
+                Q(status__in=self.ACTIVE_STATUSES) & _compare_start('lt', now), output_field=models.BooleanField()
+            ),
+        )
+
 class Appointment(models.Model):
     STATUS_CHOICES = [
         ('pending', 'Pending Approval'),
@@ -63,6 +111,8 @@ class Appointment(models.Model):
     # Reminders and notifications
     reminder_sent_to_user = models.BooleanField(default=False)
     reminder_sent_to_lawyer = models.BooleanField(default=False)
+    reminder_claim = models.CharField(max_length=32, blank=True, null=True)  # dispatcher currently sending
+    reminder_claimed_at = models.DateTimeField(blank=True, null=True)
     
     # Additional information
     documents_shared = models.ManyToManyField('documents.Document', blank=True, related_name='related_appointments')
@@ -77,25 +127,31 @@ class Appointment(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = AppointmentQuerySet.as_manager()
+    
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'confirmed_date', 'confirmed_time'], name='appointment_schedule_idx'),
+        ]
     
     def __str__(self):
         return f"Appointment: {self.user.username} with {self.lawyer.username} - {self.title}"
     
     @property
-    def is_upcoming(self):
+    def scheduled_start(self):
+        """Aware start of the confirmed schedule, or of the requested one while unconfirmed"""
         if self.confirmed_date and self.confirmed_time:
-            appointment_datetime = timezone.datetime.combine(self.confirmed_date, self.confirmed_time)
-            return appointment_datetime > timezone.now()
-        return False
+            return timezone.make_aware(datetime.combine(self.confirmed_date, self.confirmed_time))
+        return timezone.make_aware(datetime.combine(self.requested_date, self.requested_time))
+    
+    @property
+    def is_upcoming(self):
+        return self.scheduled_start > timezone.now()
     
     @property
     def is_overdue(self):
-        if self.confirmed_date and self.confirmed_time:
-            appointment_datetime = timezone.datetime.combine(self.confirmed_date, self.confirmed_time)
-            return appointment_datetime < timezone.now() and self.status in ['pending', 'confirmed']
-        return False
+        return self.status in AppointmentQuerySet.ACTIVE_STATUSES and self.scheduled_start < timezone.now()
 
 class AppointmentFeedback(models.Model):
     """Feedback after appointment completion"""
@@ -148,7 +204,17 @@ class LawyerAvailability(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
-        unique_together = ['lawyer', 'weekday', 'start_time']
+        constraints = [
+            # Weekly hours repeat on their weekday; special dates (and holidays) are unique per date
+            models.UniqueConstraint(
+                fields=['lawyer', 'weekday', 'start_time'], condition=Q(special_date__isnull=True),
+                name='unique_weekly_availability',
+            ),
+            models.UniqueConstraint(
+                fields=['lawyer', 'special_date', 'start_time'], condition=Q(special_date__isnull=False),
+                name='unique_special_date_availability',
+            ),
+        ]
     
     def __str__(self):
         return f"{self.lawyer.username} - {self.get_weekday_display()} {self.start_time}-{self.end_time}"
@@ -178,3 +244,65 @@ class AppointmentRescheduleRequest(models.Model):
     
     def __str__(self):
         return f"Reschedule request for {self.appointment.title}"
+
+class BookedSlot(models.Model):
+    """One occupied scheduling slot of a lawyer.
+    
+    The unique constraint on (lawyer, date, slot) is what makes double booking
+    impossible, whatever the database backend. Slots of pending appointments
+    carry a hold that expires unless the lawyer confirms in time.
+    """
+    lawyer = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='booked_slots')
+    appointment = models.ForeignKey(Appointment, on_delete=models.CASCADE, related_name='booked_slots')
+    date = models.DateField()
+    slot = models.PositiveSmallIntegerField()  # index of the APPOINTMENT_SLOT_MINUTES slot within the day
+    hold_expires_at = models.DateTimeField(blank=True, null=True)
+    
+    class Meta:
+        unique_together = ['lawyer', 'date', 'slot']
+    
+    def __str__(self):
+        return f"{self.lawyer.username} - {self.date} slot {self.slot}"
+
+class CalendarFeedToken(models.Model):
+    """Secret that lets a lawyer's calendar app poll their iCalendar feed without logging in"""
+    lawyer = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='calendar_feed')
+    token = models.CharField(max_length=64, unique=True, default=generate_feed_token)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def regenerate(self):
+        self.token = generate_feed_token()
+        self.created_at = timezone.now()
+        self.save(update_fields=['token', 'created_at'])
+    
+    def __str__(self):
+        return f"Calendar feed for {self.lawyer.username}"
+
+class LawyerDailyStats(models.Model):
+    """Per-lawyer, per-day rollup of appointment outcomes read by the lawyer dashboard.
+    
+    Status counters count the appointments scheduled on ``date`` that are
+    currently in that status. Rows are maintained incrementally by
+    ``appointments.stats`` and can be rebuilt with ``rebuild_lawyer_stats``.
+    """
+    lawyer = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='daily_stats')
+    date = models.DateField()
+    
+    # Signed so that deltas applied before a backfill can never violate a constraint
+    pending = models.IntegerField(default=0)
+    confirmed = models.IntegerField(default=0)
+    completed = models.IntegerField(default=0)
+    cancelled = models.IntegerField(default=0)
+    rescheduled = models.IntegerField(default=0)
+    no_show = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)  # fees of completed, paid appointments
+    
+    feedback_count = models.IntegerField(default=0)
+    rating_sum = models.IntegerField(default=0)
+    
+    class Meta:
+        unique_together = ['lawyer', 'date']
+    
+    def __str__(self):
+        return f"{self.lawyer.username} - {self.date}"
@@ -0,0 +1,98 @@
+"""
+Batched appointment reminder dispatch.
+
+Due appointments are found with a window query on the
+(status, confirmed_date, confirmed_time) index. Each dispatcher claims a
+batch with a conditional UPDATE before sending, so concurrent dispatchers
+never pick up the same rows; a claim left behind by a crashed dispatcher
+becomes claimable again after ``APPOINTMENT_REMINDER_CLAIM_TIMEOUT``.
+"""
+import uuid
+from datetime import datetime
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Appointment
+
+
+def due_reminders(now, lead):
+    """Confirmed appointments starting within ``(now, now + lead]`` still missing a reminder"""
+    start, end = timezone.localtime(now), timezone.localtime(now + lead)
+    in_window = Q(confirmed_date__gt=start.date(), confirmed_date__lt=end.date())
+    if start.date() == end.date():
+        in_window = Q(confirmed_date=start.date(), confirmed_time__gt=start.time(), confirmed_time__lte=end.time())
+    else:
+        in_window |= Q(confirmed_date=start.date(), confirmed_time__gt=start.time())
+        in_window |= Q(confirmed_date=end.date(), confirmed_time__lte=end.time())
+    return Appointment.objects.filter(in_window, status='confirmed').filter(
+        Q(reminder_sent_to_user=False) | Q(reminder_sent_to_lawyer=False)
+    )
+
+
+def _wants_email(user):
+    profile = getattr(user, 'profile', None)
+    return bool(user.email) and (profile is None or profile.email_notifications)
+
+
+def _reminder(appointment, recipient, other):
+    when = datetime.combine(appointment.confirmed_date, appointment.confirmed_time)
+    return EmailMessage(
+        subject=f'Reminder: {appointment.title} on {when:%d %b %Y at %H:%M}',
+        body=(
+            f'Hello {recipient.get_full_name() or recipient.username},\n\n'
+            f'This is a reminder of your {appointment.get_meeting_type_display().lower()} '
+            f'with {other.get_full_name() or other.username} on {when:%A, %d %B %Y at %H:%M}.\n'
+            f'{appointment.meeting_link or appointment.meeting_location or ""}\n\n'
+            'NyayaBot'
+        ),
+        to=[recipient.email],
+    )
+
+
+def claim_batch(now, lead, batch_size):
+    """Atomically claim up to ``batch_size`` due appointments for this dispatcher"""
+    token = uuid.uuid4().hex
+    claimable = Q(reminder_claim__isnull=True) | Q(reminder_claimed_at__lt=now - settings.APPOINTMENT_REMINDER_CLAIM_TIMEOUT)
+    candidates = list(due_reminders(now, lead).filter(claimable).order_by().values_list('id', flat=True)[:batch_size])
+    if not candidates:
+        return []
+    # Only rows still unclaimed at UPDATE time are ours, even if another dispatcher saw the same candidates
+    Appointment.objects.filter(claimable, id__in=candidates).update(reminder_claim=token, reminder_claimed_at=now)
+    return list(
+        Appointment.objects.filter(reminder_claim=token)
+        .select_related('user__profile', 'lawyer__profile').order_by()
+    )
+
+
+def dispatch_reminders(now=None, lead=None, batch_size=None, connection=None):
+    """Send every due reminder in batches over one email connection; returns the number of emails sent"""
+    now = now or timezone.now()
+    lead = lead or settings.APPOINTMENT_REMINDER_LEAD
+    batch_size = batch_size or settings.APPOINTMENT_REMINDER_BATCH_SIZE
+    connection = connection or get_connection()
+    sent = 0
+
+    with connection:
+        while True:
+            batch = claim_batch(now, lead, batch_size)
+            if not batch:
+                return sent
+
+            messages = []
+            for appointment in batch:
+                if not appointment.reminder_sent_to_user and _wants_email(appointment.user):
+                    messages.append(_reminder(appointment, appointment.user, appointment.lawyer))
+                if not appointment.reminder_sent_to_lawyer and _wants_email(appointment.lawyer):
+                    messages.append(_reminder(appointment, appointment.lawyer, appointment.user))
+                appointment.reminder_sent_to_user = True
+                appointment.reminder_sent_to_lawyer = True
+                appointment.reminder_claim = None
+                appointment.reminder_claimed_at = None
+
+            sent += connection.send_messages(messages) or 0
+            Appointment.objects.bulk_update(
+                batch, ['reminder_sent_to_user', 'reminder_sent_to_lawyer', 'reminder_claim', 'reminder_claimed_at']
+            )
@@ -0,0 +1,236 @@
+"""
+"First available lawyer" search.
+
+Answering "who is free soonest?" lawyer by lawyer doesn't scale, so the
+search works on a precomputed availability matrix that is transposed
+relative to the per-lawyer engine in :mod:`appointments.availability`:
+every approved lawyer gets a bit index, and each ``(day, slot)`` cell holds
+one integer with the bits of all lawyers free in that slot. Filtering by
+specialization or language is a precomputed lawyer mask, and a slot of
+``k`` consecutive cells is checked for every lawyer at once with ``k``
+bitwise ANDs.
+
+The matrix is rebuilt at most every ``FIRST_AVAILABLE_MATRIX_TTL`` seconds
+with three queries. Once it is older than that, requests keep using it while
+a single background thread builds the next one and swaps it in; only a
+request the current matrix doesn't cover (or the very first) waits for a
+build. Hits are re-checked against the per-lawyer cache before being
+returned, so bookings made since the last rebuild are never offered.
+"""
+import threading
+import time as clock
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from . import availability
+from .availability import SLOTS_PER_DAY, SLOT_MINUTES
+
+
+class AvailabilityMatrix:
+    """Free slots of every approved lawyer over ``days`` dates from ``start``"""
+
+    def __init__(self, start, days, lawyers, day_bitmaps):
+        """``lawyers`` is a list of profile value dicts, ``day_bitmaps`` their free bitmaps per day"""
+        self.start = start
+        self.days = days
+        self.built_at = clock.monotonic()
+        self.lawyer_ids = [lawyer['user_id'] for lawyer in lawyers]
+        self.profile_ids = [lawyer['id'] for lawyer in lawyers]
+        self.everyone = (1 << len(lawyers)) - 1
+
+        self.specializations = {}
+        self.languages = {}
+        for index, lawyer in enumerate(lawyers):
+            bit = 1 << index
+            for value in {str(value).strip().lower() for value in lawyer['specializations'] or []}:
+                self.specializations[value] = self.specializations.get(value, 0) | bit
+            for value in {str(value).strip().lower() for value in lawyer['languages_spoken'] or []}:
+                self.languages[value] = self.languages.get(value, 0) | bit
+
+        # Lawyers tend to share schedules, so group identical day bitmaps first and
+        # set the column bits once per distinct bitmap rather than once per lawyer
+        self.columns = []
+        for offset in range(days):
+            groups = {}
+            for index, bitmaps in enumerate(day_bitmaps):
+                if bitmaps[offset]:
+                    groups.setdefault(bitmaps[offset], []).append(index)
+            columns = [0] * SLOTS_PER_DAY
+            for bitmap, indexes in groups.items():
+                members = 0
+                for index in indexes:
+                    members |= 1 << index
+                for slot in availability.iter_slots(bitmap):
+                    columns[slot] |= members
+            self.columns.append(columns)
+
+    def covers(self, first_day, last_day):
+        return self.start <= first_day and last_day < self.start + timedelta(days=self.days)
+
+    def candidates(self, specialization=None, language=None):
+        mask = self.everyone
+        if specialization:
+            mask &= self.specializations.get(specialization.strip().lower(), 0)
+        if language:
+            mask &= self.languages.get(language.strip().lower(), 0)
+        return mask
+
+    def earliest(self, candidates, after, before, duration_minutes, accept=None):
+        """Yield ``(start, lawyer_index)`` in time order, each lawyer at most once.
+
+        ``after`` and ``before`` are naive local datetimes bounding the start time.
+        Hits rejected by ``accept(start, index)`` are skipped and the lawyer stays
+        a candidate for later slots.
+        """
+        width = -(-duration_minutes // SLOT_MINUTES)
+        day = after.date()
+        while candidates and day <= before.date():
+            columns = self.columns[(day - self.start).days]
+            first = -(-(after.hour * 60 + after.minute) // SLOT_MINUTES) if day == after.date() else 0
+            last = SLOTS_PER_DAY - width
+            if day == before.date():
+                last = min(last, (before.hour * 60 + before.minute) // SLOT_MINUTES)
+            for slot in range(first, last + 1):
+                hits = candidates
+                for column in columns[slot:slot + width]:
+                    hits &= column
+                    if not hits:
+                        break
+                if hits:
+                    start = datetime.combine(day, availability.slot_time(slot))
+                    for index in availability.iter_slots(hits):
+                        if accept is None or accept(start, index):
+                            candidates &= ~(1 << index)
+                            yield start, index
+                    if not candidates:
+                        return
+            day += timedelta(days=1)
+
+
+def build_matrix(start, days):
+    """Load every approved lawyer's schedule for ``days`` dates from ``start`` in three queries"""
+    from lawyers.models import LawyerProfile
+
+    end = start + timedelta(days=days - 1)
+    lawyers = list(LawyerProfile.objects.filter(status='approved').order_by('user_id').values(
+        'id', 'user_id', 'specializations', 'languages_spoken',
+        'available_days', 'available_time_start', 'available_time_end'
+    ))
+
+    rows = {}
+    for row in availability.availability_rows(start, end).order_by():
+        rows.setdefault(row.lawyer_id, []).append(row)
+    busy = {}
+    for lawyer_id, *fields in availability.blocking_appointments(start, end).values_list(
+        'lawyer_id', *availability.BUSY_FIELDS
+    ):
+        availability.add_busy(busy.setdefault(lawyer_id, {}), *fields)
+
+    day_bitmaps = []
+    for lawyer in lawyers:
+        weekly, overrides = availability.schedule_from_rows(rows.get(lawyer['user_id'], ()))
+        if weekly is None:
+            weekly = availability.declared_hours_template(
+                lawyer['available_days'], lawyer['available_time_start'], lawyer['available_time_end']
+            )
+        day_bitmaps.append(availability.build_day_bitmaps(
+            weekly, overrides, busy.get(lawyer['user_id'], {}), start, days
+        ))
+    return AvailabilityMatrix(start, days, lawyers, day_bitmaps)
+
+
+_matrix = None
+_matrix_lock = threading.Lock()  # serializes builds that requests wait for
+_refresh_lock = threading.Lock()
+_refreshing = False
+_generation = 0  # bumped by reset_matrix so an older background build isn't swapped in
+
+
+def get_matrix(first_day, last_day):
+    """The shared matrix; a stale one is returned while a fresh one is built in the background"""
+    global _matrix
+    days = max(settings.FIRST_AVAILABLE_HORIZON_DAYS, (last_day - first_day).days + 1)
+    matrix = _matrix
+    if matrix is None or not matrix.covers(first_day, last_day):
+        with _matrix_lock:
+            matrix = _matrix
+            if matrix is None or not matrix.covers(first_day, last_day):
+                matrix = _matrix = build_matrix(first_day, days)
+        return matrix
+    if clock.monotonic() - matrix.built_at > settings.FIRST_AVAILABLE_MATRIX_TTL and _claim_refresh():
+        threading.Thread(
+            target=_refresh_in_thread, args=(first_day, days, _generation), name='first-available-matrix', daemon=True
+        ).start()
+    return matrix
+
+
+def _claim_refresh():
+    global _refreshing
+    with _refresh_lock:
+        if _refreshing:
+            return False
+        _refreshing = True
+        return True
+
+
+def _refresh(first_day, days, generation):
+    """Build a matrix and swap it in, unless the matrix was reset meanwhile"""
+    global _matrix, _refreshing
+    try:
+        matrix = build_matrix(first_day, days)
+        with _matrix_lock:
+            if generation == _generation:
+                _matrix = matrix
+    finally:
+        with _refresh_lock:
+            _refreshing = False
+
+
+def _refresh_in_thread(first_day, days, generation):
+    try:
+        _refresh(first_day, days, generation)
+    finally:
+        connection.close()
+
+
+def reset_matrix():
+    global _matrix, _generation
+    with _matrix_lock:
+        _matrix = None
+        _generation += 1
+
+
+def _still_free(lawyer_id, start, duration_minutes):
+    [bitmap] = availability.free_bitmaps(lawyer_id, start.date(), 1)
+    first = (start.hour * 60 + start.minute) // SLOT_MINUTES
+    return bool(availability.bookable_starts(bitmap, duration_minutes) >> first & 1)
+
+
+def first_available(specialization=None, language=None, after=None, before=None, duration_minutes=60, limit=10):
+    """Earliest bookable slots across approved lawyers, one per lawyer.
+
+    Returns ``[(start, lawyer_id, lawyer_profile_id), ...]`` ordered by start,
+    with aware local datetimes. The search window defaults to the next
+    ``FIRST_AVAILABLE_HORIZON_DAYS`` days.
+    """
+    now = timezone.localtime()
+    after = max(timezone.localtime(after), now) if after else now
+    horizon = after + timedelta(days=settings.FIRST_AVAILABLE_HORIZON_DAYS)
+    before = min(timezone.localtime(before), horizon) if before else horizon
+    after, before = after.replace(tzinfo=None, second=0, microsecond=0), before.replace(tzinfo=None)
+    if before < after:
+        return []
+
+    matrix = get_matrix(after.date(), before.date())
+    results = []
+    candidates = matrix.candidates(specialization, language)
+    # The matrix may predate recent bookings; the per-lawyer cache is authoritative
+    accept = lambda start, index: _still_free(matrix.lawyer_ids[index], start, duration_minutes)
+    for start, index in matrix.earliest(candidates, after, before, duration_minutes, accept):
+        results.append((timezone.make_aware(start), matrix.lawyer_ids[index], matrix.profile_ids[index]))
+        if len(results) == limit:
+            break
+    return results
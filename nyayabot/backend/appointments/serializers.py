@@ -0,0 +1,66 @@
+from django.conf import settings
+from rest_framework import serializers
+from authentication.models import User
+from .models import Appointment, AppointmentRescheduleRequest
+
+
+class AvailabilityQuerySerializer(serializers.Serializer):
+    start = serializers.DateField(required=False)
+    days = serializers.IntegerField(min_value=1, max_value=62, default=7)
+    duration = serializers.IntegerField(min_value=settings.APPOINTMENT_SLOT_MINUTES, max_value=8 * 60, default=60)
+
+
+class DashboardQuerySerializer(serializers.Serializer):
+    days = serializers.IntegerField(min_value=1, max_value=366, default=30)
+
+
+class FirstAvailableQuerySerializer(serializers.Serializer):
+    specialization = serializers.CharField(required=False)
+    language = serializers.CharField(required=False)
+    after = serializers.DateTimeField(required=False)
+    before = serializers.DateTimeField(required=False)
+    duration = serializers.IntegerField(min_value=settings.APPOINTMENT_SLOT_MINUTES, max_value=8 * 60, default=60)
+    limit = serializers.IntegerField(min_value=1, max_value=50, default=10)
+
+
+class AppointmentSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Appointment
+        fields = ('id', 'user', 'lawyer', 'title', 'description', 'appointment_type', 'meeting_type',
+                 'requested_date', 'requested_time', 'confirmed_date', 'confirmed_time', 'duration_minutes',
+                 'status', 'priority', 'meeting_link', 'meeting_location', 'consultation_fee', 'is_paid',
+                 'cancellation_reason', 'cancelled_at', 'created_at', 'updated_at')
+        read_only_fields = fields
+
+
+class AppointmentBookingSerializer(serializers.ModelSerializer):
+    lawyer = serializers.PrimaryKeyRelatedField(queryset=User.objects.filter(user_type='lawyer'))
+    date = serializers.DateField(source='requested_date')
+    time = serializers.TimeField(source='requested_time')
+    duration_minutes = serializers.IntegerField(
+        min_value=settings.APPOINTMENT_SLOT_MINUTES, max_value=8 * 60, default=60
+    )
+    
+    class Meta:
+        model = Appointment
+        fields = ('lawyer', 'date', 'time', 'duration_minutes', 'title', 'description',
+                 'appointment_type', 'meeting_type', 'priority')
+
+
+class RescheduleRequestSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = AppointmentRescheduleRequest
+        fields = ('id', 'appointment', 'requested_by', 'new_requested_date', 'new_requested_time', 'reason',
+                 'status', 'response_message', 'responded_by', 'responded_at', 'created_at')
+        read_only_fields = fields
+
+
+class RescheduleCreateSerializer(serializers.Serializer):
+    date = serializers.DateField()
+    time = serializers.TimeField()
+    reason = serializers.CharField()
+
+
+class HolidaySerializer(serializers.Serializer):
+    date = serializers.DateField()
+    reason = serializers.CharField(required=False, allow_blank=True, default='')
@@ -0,0 +1,238 @@
+"""
+Appointment booking.
+
+Every appointment owns one ``BookedSlot`` row per occupied slot, and the
+unique (lawyer, date, slot) constraint rejects any overlapping booking
+atomically, so concurrent requests for the same slot can never both win.
+Pending requests hold their slots for ``APPOINTMENT_HOLD_MINUTES``; expired
+holds are released lazily by the next booking on that lawyer-day.
+
+Rescheduling swaps an appointment's slots inside one transaction with the
+appointment row locked: the old slots are deleted and the new ones inserted
+under the same unique constraint, so a reschedule and a concurrent booking
+can never both get the new time, and a failed reschedule keeps the old one.
+"""
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import availability, stats
+from .models import Appointment, AppointmentRescheduleRequest, BookedSlot, LawyerAvailability
+
+
+class SlotUnavailable(Exception):
+    """The requested time is outside working hours or already taken"""
+
+
+def release_expired_holds(lawyer_id, day, now=None):
+    """Cancel pending appointments whose hold on ``day`` has lapsed and free their slots"""
+    now = now or timezone.now()
+    expired = BookedSlot.objects.filter(lawyer_id=lawyer_id, date=day, hold_expires_at__lt=now)
+    # Write first: on SQLite this takes the write lock up front instead of upgrading a read lock
+    held = Appointment.objects.filter(id__in=expired.values('appointment_id'))
+    cancelled = held.filter(status='pending').update(
+        status='cancelled', cancellation_reason='Booking hold expired', cancelled_at=now, updated_at=now
+    )
+    if cancelled:
+        stats.record_transition(
+            held.filter(status='cancelled', cancelled_at=now).values_list('lawyer_id', 'requested_date'),
+            'pending', 'cancelled'
+        )
+    released = expired.delete()[0]
+    if cancelled or released:
+        availability.invalidate_week(lawyer_id, day)
+    return cancelled
+
+
+def _check_slots(lawyer_id, day, at, duration_minutes, now):
+    """Slots needed for an appointment at ``day``/``at``, raising ``SlotUnavailable`` outside working hours"""
+    slots = availability.slot_range(at, duration_minutes)
+    requested = sum(1 << slot for slot in slots)
+    if not slots or availability.open_bitmap(lawyer_id, day) & requested != requested:
+        raise SlotUnavailable('The lawyer is not available at this time')
+    if timezone.make_aware(datetime.combine(day, at)) <= now:
+        raise SlotUnavailable('Appointments must be booked in the future')
+    return slots
+
+
+def book_appointment(user, lawyer, day, at, duration_minutes=60, **details):
+    """Reserve the slots for a new pending appointment or raise ``SlotUnavailable``"""
+    now = timezone.now()
+    slots = _check_slots(lawyer.id, day, at, duration_minutes, now)
+    hold_expires_at = now + timedelta(minutes=settings.APPOINTMENT_HOLD_MINUTES)
+    
+    with transaction.atomic():
+        release_expired_holds(lawyer.id, day, now)
+        appointment = Appointment.objects.create(
+            user=user, lawyer=lawyer, requested_date=day, requested_time=at,
+            duration_minutes=duration_minutes, status='pending', **details
+        )
+        try:
+            with transaction.atomic():
+                BookedSlot.objects.bulk_create([
+                    BookedSlot(lawyer=lawyer, appointment=appointment, date=day, slot=slot,
+                               hold_expires_at=hold_expires_at)
+                    for slot in slots
+                ])
+        except IntegrityError:
+            raise SlotUnavailable('This slot has already been booked')
+    
+    appointment.hold_expires_at = hold_expires_at
+    return appointment
+
+
+def confirm_appointment(appointment):
+    """Turn a pending hold into a confirmed booking"""
+    with transaction.atomic():
+        # A lapsed hold can't be confirmed even before release_expired_holds frees it
+        held = BookedSlot.objects.filter(appointment=appointment).filter(
+            Q(hold_expires_at__gt=timezone.now()) | Q(hold_expires_at__isnull=True)
+        ).update(hold_expires_at=None)
+        if not held:
+            raise SlotUnavailable('The booking hold has expired')
+        appointment.status = 'confirmed'
+        appointment.confirmed_date = appointment.requested_date
+        appointment.confirmed_time = appointment.requested_time
+        appointment.save()
+    return appointment
+
+
+def cancel_appointment(appointment, cancelled_by, reason=''):
+    with transaction.atomic():
+        BookedSlot.objects.filter(appointment=appointment).delete()
+        appointment.status = 'cancelled'
+        appointment.cancelled_by = cancelled_by
+        appointment.cancelled_at = timezone.now()
+        appointment.cancellation_reason = reason
+        appointment.save()
+    return appointment
+
+
+def reschedule_appointment(appointment, day, at, now=None):
+    """Move a pending or confirmed appointment to ``day``/``at`` or raise ``SlotUnavailable``.
+    
+    Must run inside a transaction; the appointment row is locked for its duration.
+    """
+    now = now or timezone.now()
+    appointment = Appointment.objects.select_for_update().get(pk=appointment.pk)
+    if appointment.status not in ('pending', 'confirmed'):
+        raise SlotUnavailable(f'Appointment is {appointment.status}')
+    slots = _check_slots(appointment.lawyer_id, day, at, appointment.duration_minutes, now)
+    
+    release_expired_holds(appointment.lawyer_id, day, now)
+    BookedSlot.objects.filter(appointment=appointment).delete()
+    hold_expires_at = now + timedelta(minutes=settings.APPOINTMENT_HOLD_MINUTES) if appointment.status == 'pending' else None
+    try:
+        with transaction.atomic():
+            BookedSlot.objects.bulk_create([
+                BookedSlot(lawyer_id=appointment.lawyer_id, appointment=appointment, date=day, slot=slot,
+                           hold_expires_at=hold_expires_at)
+                for slot in slots
+            ])
+    except IntegrityError:
+        raise SlotUnavailable('This slot has already been booked')
+    
+    if appointment.status == 'confirmed':
+        appointment.confirmed_date, appointment.confirmed_time = day, at
+    else:
+        appointment.requested_date, appointment.requested_time = day, at
+    appointment.save()
+    return appointment
+
+
+def approve_reschedule(reschedule_request, responded_by, message=''):
+    """Apply a pending reschedule request atomically; on ``SlotUnavailable`` nothing changes"""
+    with transaction.atomic():
+        reschedule_request = AppointmentRescheduleRequest.objects.select_for_update().get(pk=reschedule_request.pk)
+        if reschedule_request.status != 'pending':
+            raise SlotUnavailable(f'Reschedule request is {reschedule_request.status}')
+        appointment = reschedule_appointment(
+            reschedule_request.appointment, reschedule_request.new_requested_date, reschedule_request.new_requested_time
+        )
+        reschedule_request.status = 'approved'
+        reschedule_request.responded_by = responded_by
+        reschedule_request.responded_at = timezone.now()
+        reschedule_request.response_message = message
+        reschedule_request.save()
+    return reschedule_request, appointment
+
+
+def reject_reschedule(reschedule_request, responded_by, message=''):
+    updated = AppointmentRescheduleRequest.objects.filter(pk=reschedule_request.pk, status='pending').update(
+        status='rejected', responded_by=responded_by, responded_at=timezone.now(), response_message=message
+    )
+    if not updated:
+        raise SlotUnavailable('Reschedule request is no longer pending')
+    reschedule_request.refresh_from_db()
+    return reschedule_request
+
+
+def _earliest_start(free, start, duration_minutes, now):
+    """``(offset, slot)`` of the earliest future start in a list of free bitmaps, or None"""
+    local_now = timezone.localtime(now)
+    for offset, bitmap in enumerate(free):
+        day = start + timedelta(days=offset)
+        if day < local_now.date():
+            continue
+        if day == local_now.date():
+            bitmap &= ~((1 << -(-(local_now.hour * 60 + local_now.minute) // availability.SLOT_MINUTES)) - 1)
+        starts = availability.bookable_starts(bitmap, duration_minutes)
+        if starts:
+            return offset, (starts & -starts).bit_length() - 1
+    return None
+
+
+def reschedule_holiday(lawyer, day, reason='', now=None):
+    """Close ``day`` for the lawyer and move every open appointment on it to the earliest free slot.
+    
+    Returns ``(moved, unplaced)`` lists of appointments. Appointments without a
+    free slot in the following ``FIRST_AVAILABLE_HORIZON_DAYS`` days stay where
+    they are for the lawyer to handle.
+    """
+    now = now or timezone.now()
+    start = day + timedelta(days=1)
+    moved, unplaced, requests = [], [], []
+    with transaction.atomic():
+        # Keyed like the special-date constraint; an override of the day starting at midnight becomes the holiday
+        LawyerAvailability.objects.update_or_create(
+            lawyer=lawyer, special_date=day, start_time=time(0),
+            defaults={'weekday': day.weekday(), 'end_time': time(0), 'is_available': False, 'is_holiday': True},
+        )
+        affected = list(Appointment.objects.select_for_update().filter(
+            lawyer=lawyer, status__in=('pending', 'confirmed')
+        ).filter(
+            Q(confirmed_date=day) | Q(confirmed_date__isnull=True, requested_date=day)
+        ).order_by('confirmed_time', 'requested_time'))
+        # One read of the free bitmaps, updated locally as appointments are placed;
+        # every placement is still enforced by the slot constraint
+        free = availability.free_bitmaps(lawyer.id, start, settings.FIRST_AVAILABLE_HORIZON_DAYS) if affected else []
+        
+        for appointment in affected:
+            old_start = appointment.scheduled_start
+            while True:
+                found = _earliest_start(free, start, appointment.duration_minutes, now)
+                if found is None:
+                    unplaced.append(appointment)
+                    break
+                offset, slot = found
+                new_day, at = start + timedelta(days=offset), availability.slot_time(slot)
+                try:
+                    with transaction.atomic():
+                        appointment = reschedule_appointment(appointment, new_day, at, now)
+                except SlotUnavailable:
+                    # Booked since the bitmaps were cached; try the next start
+                    free[offset] &= ~(1 << slot)
+                    continue
+                free[offset] &= ~sum(1 << index for index in availability.slot_range(at, appointment.duration_minutes))
+                requests.append(AppointmentRescheduleRequest(
+                    appointment=appointment, requested_by=lawyer, new_requested_date=new_day, new_requested_time=at,
+                    reason=reason or f'Lawyer unavailable on {timezone.localtime(old_start):%d %b %Y}',
+                    status='approved', responded_by=lawyer, responded_at=now,
+                ))
+                moved.append(appointment)
+                break
+        AppointmentRescheduleRequest.objects.bulk_create(requests)
+    return moved, unplaced
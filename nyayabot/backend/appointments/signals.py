@@ -0,0 +1,105 @@
+from django.db.models import DEFERRED
+from django.db.models.signals import post_delete, post_init, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from lawyers.cache import invalidate_lawyer_user
+from . import availability, stats
+from .models import Appointment, AppointmentFeedback, LawyerAvailability
+from .stats import scheduled_day as _scheduled_day
+
+
+def _remember(instance, snapshot):
+    instance._original_stats = snapshot
+    instance._original_schedule = snapshot[:2] if snapshot else None
+
+
+def _loaded_snapshot(instance):
+    """``stats.snapshot`` of the instance, or None if a field it needs is deferred"""
+    # Reading a deferred field refreshes the instance, which initialises another one
+    if any(field not in instance.__dict__ for field in stats.SNAPSHOT_FIELDS):
+        return None
+    return stats.snapshot(instance)
+
+
+@receiver(post_init, sender=Appointment)
+def remember_schedule(sender, instance, **kwargs):
+    _remember(instance, _loaded_snapshot(instance))
+
+
+@receiver(pre_save, sender=Appointment)
+@receiver(pre_delete, sender=Appointment)
+def load_unknown_schedule(sender, instance, **kwargs):
+    """Appointments loaded with deferred fields read their stored state before it changes"""
+    if instance._original_stats is None and not instance._state.adding and instance.pk:
+        _remember(instance, stats.stored_snapshot(instance.pk))
+
+
+@receiver(post_save, sender=Appointment)
+def invalidate_appointment_availability(sender, instance, **kwargs):
+    current = (instance.lawyer_id, _scheduled_day(instance))
+    _invalidate(current, instance._original_schedule)
+    instance._original_schedule = current
+
+
+@receiver(post_delete, sender=Appointment)
+def invalidate_deleted_appointment_availability(sender, instance, **kwargs):
+    # The row is gone, so deferred fields can't be loaded any more
+    current = _loaded_snapshot(instance)
+    _invalidate(current and current[:2], instance._original_schedule)
+
+
+def _invalidate(*schedules):
+    schedules = {schedule for schedule in schedules if schedule}
+    for lawyer_id, day in schedules:
+        if lawyer_id and day:
+            availability.invalidate_week(lawyer_id, day)
+    for lawyer_id in {lawyer_id for lawyer_id, _ in schedules if lawyer_id}:
+        invalidate_lawyer_user(lawyer_id)
+
+
+@receiver(post_save, sender=Appointment)
+def update_stats_on_save(sender, instance, created, **kwargs):
+    current = stats.snapshot(instance)
+    if created or current != instance._original_stats:
+        stats.record_change(None if created else instance._original_stats, current)
+    instance._original_stats = current
+
+
+@receiver(post_delete, sender=Appointment)
+def update_stats_on_delete(sender, instance, **kwargs):
+    stats.record_change(instance._original_stats, None)
+
+
+@receiver(post_init, sender=AppointmentFeedback)
+def remember_rating(sender, instance, **kwargs):
+    instance._original_rating = instance.__dict__.get('user_rating', DEFERRED)
+
+
+@receiver(pre_save, sender=AppointmentFeedback)
+@receiver(pre_delete, sender=AppointmentFeedback)
+def load_unknown_rating(sender, instance, **kwargs):
+    if instance._original_rating is DEFERRED and not instance._state.adding and instance.pk:
+        instance._original_rating = AppointmentFeedback.objects.filter(pk=instance.pk).values_list(
+            'user_rating', flat=True
+        ).first()
+
+
+@receiver(post_save, sender=AppointmentFeedback)
+def update_stats_on_feedback(sender, instance, created, **kwargs):
+    old_rating = None if created else instance._original_rating
+    if old_rating != instance.user_rating:
+        stats.record_feedback(instance.appointment_id, old_rating, instance.user_rating)
+    instance._original_rating = instance.user_rating
+
+
+@receiver(post_delete, sender=AppointmentFeedback)
+def update_stats_on_feedback_delete(sender, instance, **kwargs):
+    if instance._original_rating is not None:
+        stats.record_feedback(instance.appointment_id, instance._original_rating, None)
+
+
+@receiver(post_save, sender=LawyerAvailability)
+@receiver(post_delete, sender=LawyerAvailability)
+def invalidate_schedule_availability(sender, instance, **kwargs):
+    availability.invalidate_lawyer(instance.lawyer_id)
+    invalidate_lawyer_user(instance.lawyer_id)
@@ -0,0 +1,178 @@
+"""
+Incrementally maintained lawyer statistics.
+
+Every appointment contributes to the ``LawyerDailyStats`` row of its lawyer
+and scheduled day: one to the counter of its current status, its fee to
+``revenue`` once it is completed and paid, and its feedback rating to the
+rating totals. Saves are turned into the difference between the old and the
+new contribution and applied with ``F()`` increments, so concurrent writers
+never lose updates. Bulk ``update()`` paths call :func:`record_transition`
+themselves because they send no signals.
+
+``LawyerProfile.total_consultations`` is kept equal to the number of
+completed appointments.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import Coalesce
+
+from .models import Appointment, AppointmentFeedback, LawyerDailyStats
+
+STATUS_COUNTERS = ('pending', 'confirmed', 'completed', 'cancelled', 'rescheduled', 'no_show')
+
+
+def scheduled_day(appointment):
+    return appointment.confirmed_date or appointment.requested_date
+
+
+SNAPSHOT_FIELDS = ('lawyer_id', 'confirmed_date', 'requested_date', 'status', 'is_paid', 'consultation_fee')
+
+
+def snapshot(appointment):
+    """The fields of an appointment that its contribution depends on"""
+    return (appointment.lawyer_id, scheduled_day(appointment), appointment.status,
+            appointment.is_paid, appointment.consultation_fee)
+
+
+def stored_snapshot(appointment_id):
+    """``snapshot`` of an appointment as stored, or None if there is no such row"""
+    row = Appointment.objects.filter(pk=appointment_id).values_list(*SNAPSHOT_FIELDS).first()
+    if row is None:
+        return None
+    lawyer_id, confirmed_date, requested_date, *rest = row
+    return (lawyer_id, confirmed_date or requested_date, *rest)
+
+
+def _add(changes, state, sign):
+    lawyer_id, day, status, is_paid, fee = state
+    if not (lawyer_id and day):
+        return
+    deltas = changes[(lawyer_id, day)]
+    if status in STATUS_COUNTERS:
+        deltas[status] += sign
+    if status == 'completed' and is_paid and fee:
+        deltas['revenue'] += sign * fee
+
+
+def apply_changes(changes):
+    """Apply ``{(lawyer_id, day): {field: delta}}`` to the rollups and to ``total_consultations``"""
+    from lawyers.models import LawyerProfile
+
+    consultations = defaultdict(int)
+    for (lawyer_id, day), deltas in changes.items():
+        deltas = {field: delta for field, delta in deltas.items() if delta}
+        if not deltas:
+            continue
+        consultations[lawyer_id] += deltas.get('completed', 0)
+
+        increments = {field: F(field) + delta for field, delta in deltas.items()}
+        row = LawyerDailyStats.objects.filter(lawyer_id=lawyer_id, date=day)
+        if not row.update(**increments):
+            try:
+                with transaction.atomic():
+                    LawyerDailyStats.objects.create(lawyer_id=lawyer_id, date=day, **deltas)
+            except IntegrityError:
+                # Created concurrently since the update above
+                row.update(**increments)
+
+    for lawyer_id, delta in consultations.items():
+        if delta:
+            LawyerProfile.objects.filter(user_id=lawyer_id, total_consultations__gte=-delta).update(
+                total_consultations=F('total_consultations') + delta
+            )
+
+
+def record_change(before, after):
+    """Move an appointment's contribution from snapshot ``before`` to ``after`` (either may be None)"""
+    changes = defaultdict(lambda: defaultdict(int))
+    if before:
+        _add(changes, before, -1)
+    if after:
+        _add(changes, after, 1)
+    apply_changes(changes)
+
+
+def record_transition(rows, from_status, to_status):
+    """Account for a bulk status change of ``(lawyer_id, day)`` rows between unpaid-revenue statuses"""
+    changes = defaultdict(lambda: defaultdict(int))
+    for lawyer_id, day in rows:
+        changes[(lawyer_id, day)][from_status] -= 1
+        changes[(lawyer_id, day)][to_status] += 1
+    apply_changes(changes)
+
+
+def record_feedback(appointment_id, old_rating, new_rating):
+    lawyer_id, confirmed_date, requested_date = Appointment.objects.filter(pk=appointment_id).values_list(
+        'lawyer_id', 'confirmed_date', 'requested_date'
+    ).get()
+    apply_changes({(lawyer_id, confirmed_date or requested_date): {
+        'feedback_count': (new_rating is not None) - (old_rating is not None),
+        'rating_sum': (new_rating or 0) - (old_rating or 0),
+    }})
+
+
+def dashboard(lawyer_id, start, end):
+    """All-time totals and the daily series between ``start`` and ``end`` from the rollups only"""
+    rows = LawyerDailyStats.objects.filter(lawyer_id=lawyer_id)
+    totals = rows.aggregate(**{field: Sum(field) for field in STATUS_COUNTERS + ('revenue', 'feedback_count', 'rating_sum')})
+    totals = {field: value or 0 for field, value in totals.items()}
+    attended = totals['completed'] + totals['no_show']
+    totals['no_show_rate'] = round(totals['no_show'] / attended, 4) if attended else None
+    totals['average_rating'] = round(totals['rating_sum'] / totals['feedback_count'], 2) if totals['feedback_count'] else None
+
+    daily = {row['date']: row for row in rows.filter(date__range=(start, end)).values(
+        'date', *STATUS_COUNTERS, 'revenue', 'feedback_count'
+    )}
+    empty = dict.fromkeys(STATUS_COUNTERS + ('revenue', 'feedback_count'), 0)
+    series = []
+    for offset in range((end - start).days + 1):
+        day = start + timedelta(days=offset)
+        series.append({**empty, **daily.get(day, {}), 'date': day})
+    return totals, series
+
+
+def rebuild(batch_size=1000):
+    """Recompute every rollup and ``total_consultations`` from the appointment history"""
+    from lawyers.models import LawyerProfile
+
+    rows = {}
+    appointments = Appointment.objects.order_by().annotate(
+        day=Coalesce('confirmed_date', 'requested_date')
+    ).values('lawyer_id', 'day').annotate(
+        revenue=Sum('consultation_fee', filter=Q(status='completed', is_paid=True)),
+        **{status: Count('id', filter=Q(status=status)) for status in STATUS_COUNTERS},
+    )
+    for row in appointments.iterator():
+        key = (row.pop('lawyer_id'), row.pop('day'))
+        rows[key] = dict(row, revenue=row['revenue'] or 0)
+    feedback = AppointmentFeedback.objects.order_by().filter(user_rating__isnull=False).annotate(
+        day=Coalesce('appointment__confirmed_date', 'appointment__requested_date')
+    ).values('appointment__lawyer_id', 'day').annotate(feedback_count=Count('id'), rating_sum=Sum('user_rating'))
+    for row in feedback.iterator():
+        key = (row['appointment__lawyer_id'], row['day'])
+        rows.setdefault(key, {}).update(feedback_count=row['feedback_count'], rating_sum=row['rating_sum'])
+
+    with transaction.atomic():
+        LawyerDailyStats.objects.all().delete()
+        LawyerDailyStats.objects.bulk_create(
+            (LawyerDailyStats(lawyer_id=lawyer_id, date=date, **values) for (lawyer_id, date), values in rows.items()),
+            batch_size=batch_size,
+        )
+        completed = defaultdict(int)
+        for (lawyer_id, _), values in rows.items():
+            completed[lawyer_id] += values.get('completed', 0)
+        LawyerProfile.objects.update(total_consultations=0)
+        for count, lawyer_ids in _group_by_value(completed).items():
+            LawyerProfile.objects.filter(user_id__in=lawyer_ids).update(total_consultations=count)
+    return len(rows)
+
+
+def _group_by_value(counts):
+    groups = defaultdict(list)
+    for key, count in counts.items():
+        if count:
+            groups[count].append(key)
+    return groups
@@ -0,0 +1,66 @@
+"""
+Periodic sweep of stale appointments.
+
+Pending requests nobody confirmed before their start time are cancelled,
+and confirmed appointments still open ``APPOINTMENT_NO_SHOW_AFTER`` past
+their start are marked ``no_show``. Both transitions are bulk UPDATEs over
+batches of ids selected with the queryset's time-window filters, guarded by
+the same filters so rows changed concurrently are left alone. Swept
+appointments release their ``BookedSlot`` rows, and since ``update()`` sends
+no signals the lawyer statistics are adjusted here and the affected
+availability weeks and lawyer pages are invalidated.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from lawyers.cache import invalidate_lawyer_user
+from . import availability, stats
+from .models import Appointment, BookedSlot
+
+
+def _sweep(stale, batch_size, from_status, **changes):
+    swept = 0
+    while True:
+        rows = list(stale.order_by().values_list('id', 'lawyer_id', 'confirmed_date', 'requested_date')[:batch_size])
+        if not rows:
+            return swept
+        ids = [row[0] for row in rows]
+        with transaction.atomic():
+            updated = stale.filter(id__in=ids).update(**changes)
+            if updated:
+                # Only the rows this sweep changed, not ones another writer got to first
+                changed = Appointment.objects.filter(
+                    id__in=ids, status=changes['status'], updated_at=changes['updated_at']
+                ).order_by()
+                BookedSlot.objects.filter(appointment_id__in=changed.values('id')).delete()
+                stats.record_transition(
+                    changed.annotate(day=Coalesce('confirmed_date', 'requested_date')).values_list('lawyer_id', 'day'),
+                    from_status, changes['status']
+                )
+        swept += updated
+        
+        for lawyer_id, day in {(lawyer_id, confirmed or requested) for _, lawyer_id, confirmed, requested in rows}:
+            availability.invalidate_week(lawyer_id, day)
+        invalidate_lawyer_user(*{row[1] for row in rows})
+
+
+def sweep_appointments(now=None, batch_size=None):
+    """Cancel unconfirmed and mark no-show appointments whose time has passed.
+    
+    Returns ``{'cancelled': count, 'no_show': count}``.
+    """
+    now = now or timezone.now()
+    batch_size = batch_size or settings.APPOINTMENT_SWEEP_BATCH_SIZE
+    return {
+        'cancelled': _sweep(
+            Appointment.objects.filter(status='pending').starting_before(now), batch_size, 'pending',
+            status='cancelled', cancellation_reason='Not confirmed before the scheduled time',
+            cancelled_at=now, updated_at=now,
+        ),
+        'no_show': _sweep(
+            Appointment.objects.filter(status='confirmed').starting_before(now - settings.APPOINTMENT_NO_SHOW_AFTER),
+            batch_size, 'confirmed', status='no_show', updated_at=now,
+        ),
+    }
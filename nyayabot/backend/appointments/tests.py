@@ -1,3 +1,814 @@
-from django.test import TestCase
+import io
+import os
+import time as clock
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from concurrent.futures import ThreadPoolExecutor
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail import get_connection
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import QuerySet
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+from authentication.models import User
+from rest_framework.test import APIClient
+from authentication.models import UserProfile
+from lawyers.models import LawyerProfile
+from . import availability, reminders, search, services, sweeper
+from .models import (
+    Appointment, AppointmentFeedback, AppointmentRescheduleRequest, BookedSlot, CalendarFeedToken, LawyerAvailability,
+    LawyerDailyStats
+)
+
+BENCHMARKS = skipUnless(os.environ.get('NYAYABOT_BENCHMARKS'), 'set NYAYABOT_BENCHMARKS=1 to run benchmarks')
+
+# A Monday well in the future, so "now" never trims slots
+MONDAY = date(2030, 1, 7)
+
+
+def slots(*values):
+    return [time.fromisoformat(value) for value in values]
+
+
+class AvailabilityEngineTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.lawyer = User.objects.create_user(username='lawyer', user_type='lawyer')
+        self.client_user = User.objects.create_user(username='client')
+        LawyerAvailability.objects.create(
+            lawyer=self.lawyer, weekday=0, start_time=time(9), end_time=time(13),
+            break_start_time=time(11), break_end_time=time(11, 30)
+        )
+        LawyerAvailability.objects.create(lawyer=self.lawyer, weekday=1, start_time=time(10), end_time=time(11))
+
+    def book(self, day, at, duration=60, status='confirmed'):
+        return Appointment.objects.create(
+            user=self.client_user, lawyer=self.lawyer, title='Consultation', description='Rent dispute',
+            requested_date=day, requested_time=at, confirmed_date=day, confirmed_time=at,
+            duration_minutes=duration, status=status
+        )
+
+    def day_slots(self, day, duration=60):
+        [(_, times)] = availability.available_slots(self.lawyer.id, day, 1, duration)
+        return times
+
+    def test_weekly_template_with_break(self):
+        self.assertEqual(self.day_slots(MONDAY), slots('09:00', '09:15', '09:30', '09:45', '10:00', '11:30', '11:45', '12:00'))
+        self.assertEqual(self.day_slots(MONDAY + timedelta(days=1)), slots('10:00'))
+        self.assertEqual(self.day_slots(MONDAY + timedelta(days=2)), [])
+
+    def test_bookings_block_overlapping_slots_and_invalidate_cache(self):
+        self.day_slots(MONDAY)
+        self.book(MONDAY, time(9, 30), duration=45)
+        self.book(MONDAY, time(12), duration=30, status='cancelled')
+
+        self.assertEqual(self.day_slots(MONDAY, duration=30), slots('09:00', '10:15', '10:30', '11:30', '11:45', '12:00', '12:15', '12:30'))
+
+        appointment = Appointment.objects.get(status='confirmed')
+        appointment.confirmed_date = MONDAY + timedelta(days=7)
+        appointment.save()
+        self.assertIn(time(9, 30), self.day_slots(MONDAY, duration=30))
+        self.assertNotIn(time(9, 30), self.day_slots(MONDAY + timedelta(days=7), duration=30))
+
+    def test_special_dates_override_template_and_holidays_close_the_day(self):
+        holiday = MONDAY + timedelta(days=7)
+        LawyerAvailability.objects.create(
+            lawyer=self.lawyer, weekday=2, start_time=time(14), end_time=time(15), special_date=MONDAY + timedelta(days=2)
+        )
+        LawyerAvailability.objects.create(
+            lawyer=self.lawyer, weekday=0, start_time=time(0), end_time=time(0), special_date=holiday, is_holiday=True
+        )
+
+        self.assertEqual(self.day_slots(MONDAY + timedelta(days=2)), slots('14:00'))
+        self.assertEqual(self.day_slots(holiday), [])
+        self.assertTrue(self.day_slots(MONDAY + timedelta(days=14)))
+
+    def test_profile_hours_are_used_without_weekly_rows(self):
+        from lawyers.models import LawyerProfile
+
+        other = User.objects.create_user(username='declared', user_type='lawyer')
+        LawyerProfile.objects.create(
+            user=other, bar_council_id='BCI-declared', bar_council_certificate='c', years_of_experience=1,
+            education='LLB', office_address='Delhi', bio='Advocate', available_days=['Monday'],
+            available_time_start=time(17), available_time_end=time(18, 30)
+        )
+        [(_, times)] = availability.available_slots(other.id, MONDAY, 1, 60)
+        self.assertEqual(times, slots('17:00', '17:15', '17:30'))
+
+    def test_past_slots_are_not_offered(self):
+        now = timezone.make_aware(datetime.combine(MONDAY, time(10, 5)))
+        [(_, times)] = availability.available_slots(self.lawyer.id, MONDAY, 1, 60, now=now)
+        self.assertEqual(times[0], time(11, 30))
+
+    def test_availability_endpoint(self):
+        response = self.client.get(
+            reverse('appointments:lawyer-availability', args=[self.lawyer.id]),
+            {'start': MONDAY.isoformat(), 'days': 2, 'duration': 60}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['days'][1], {'date': '2030-01-08', 'slots': ['10:00']})
+
+        response = self.client.get(reverse('appointments:lawyer-availability', args=[self.lawyer.id]), {'days': 400})
+        self.assertEqual(response.status_code, 400)
+
+    def test_cached_weeks_need_no_queries(self):
+        availability.available_slots(self.lawyer.id, MONDAY, 30)
+        with self.assertNumQueries(0):
+            availability.available_slots(self.lawyer.id, MONDAY, 30)
+
+    @BENCHMARKS
+    def test_benchmark_thirty_days_under_a_millisecond(self):
+        availability.available_slots(self.lawyer.id, MONDAY, 30)
+        runs = 1000
+        started = clock.perf_counter()
+        for _ in range(runs):
+            availability.available_slots(self.lawyer.id, MONDAY, 30)
+        per_call = (clock.perf_counter() - started) / runs
+        print(f'\n30-day availability (cached): {per_call * 1e6:.0f} us per call')
+        self.assertLess(per_call, 0.001)
+
+
+class BookingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.lawyer = User.objects.create_user(username='lawyer', user_type='lawyer')
+        self.client_user = User.objects.create_user(username='client')
+        LawyerAvailability.objects.create(lawyer=self.lawyer, weekday=0, start_time=time(9), end_time=time(17))
+        self.api = APIClient()
+        self.api.force_authenticate(self.client_user)
+
+    def request_booking(self, at, duration=60, client=None):
+        return (client or self.api).post(reverse('appointments:appointments'), {
+            'lawyer': self.lawyer.id, 'date': MONDAY.isoformat(), 'time': at, 'duration_minutes': duration,
+            'title': 'Consultation', 'description': 'Tenancy notice',
+        }, format='json')
+
+    def test_overlapping_requests_conflict(self):
+        self.assertEqual(self.request_booking('10:00').status_code, 201)
+        self.assertEqual(self.request_booking('10:45').status_code, 409)
+        self.assertEqual(self.request_booking('11:00').status_code, 201)
+        self.assertEqual(self.request_booking('08:30').status_code, 409)
+        self.assertEqual(BookedSlot.objects.count(), 8)
+        self.assertNotIn(time(10), availability.available_slots(self.lawyer.id, MONDAY, 1)[0][1])
+
+    def test_expired_hold_is_released_for_the_next_booking(self):
+        first = self.request_booking('10:00').data['appointment']['id']
+        BookedSlot.objects.update(hold_expires_at=timezone.now() - timedelta(minutes=1))
+
+        self.assertEqual(self.request_booking('10:00').status_code, 201)
+        self.assertEqual(Appointment.objects.get(id=first).status, 'cancelled')
+
+        lawyer_client = APIClient()
+        lawyer_client.force_authenticate(self.lawyer)
+        response = lawyer_client.post(reverse('appointments:confirm', args=[first]))
+        self.assertEqual(response.status_code, 400)
+
+    def test_lapsed_hold_stops_blocking_before_it_is_released(self):
+        first = self.request_booking('10:00').data['appointment']['id']
+        self.assertNotIn(time(10), availability.available_slots(self.lawyer.id, MONDAY, 1)[0][1])
+        # Cached only until the hold lapses
+        *_, hold_until = availability.load_schedule(self.lawyer.id, MONDAY, MONDAY)
+        self.assertEqual(hold_until, BookedSlot.objects.get(slot=40).hold_expires_at)
+
+        BookedSlot.objects.update(hold_expires_at=timezone.now() - timedelta(minutes=1))
+        availability.invalidate_lawyer(self.lawyer.id)
+        self.assertIn(time(10), availability.available_slots(self.lawyer.id, MONDAY, 1)[0][1])
+
+        lawyer_client = APIClient()
+        lawyer_client.force_authenticate(self.lawyer)
+        response = lawyer_client.post(reverse('appointments:confirm', args=[first]))
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Appointment.objects.get(id=first).status, 'pending')
+
+    def test_confirm_and_cancel(self):
+        appointment_id = self.request_booking('10:00').data['appointment']['id']
+        lawyer_client = APIClient()
+        lawyer_client.force_authenticate(self.lawyer)
+
+        response = lawyer_client.post(reverse('appointments:confirm', args=[appointment_id]))
+        self.assertEqual(response.data['appointment']['status'], 'confirmed')
+        self.assertFalse(BookedSlot.objects.filter(hold_expires_at__isnull=False).exists())
+
+        response = self.api.post(reverse('appointments:cancel', args=[appointment_id]), {'reason': 'Settled'})
+        self.assertEqual(response.data['appointment']['status'], 'cancelled')
+        self.assertFalse(BookedSlot.objects.exists())
+        self.assertIn(time(10), availability.available_slots(self.lawyer.id, MONDAY, 1)[0][1])
+
+
+class BookingContentionTests(TransactionTestCase):
+    """Many threads race for a handful of slots; none may be double booked"""
+
+    def setUp(self):
+        cache.clear()
+        self.lawyer = User.objects.create_user(username='lawyer', user_type='lawyer')
+        LawyerAvailability.objects.create(lawyer=self.lawyer, weekday=0, start_time=time(9), end_time=time(11))
+
+    def attempt(self, client):
+        # Each client wants one of 8 overlapping 30-minute windows inside 09:00-11:00
+        index = client.pk % 8
+        at = time(9 + index * 15 // 60, index * 15 % 60)
+        try:
+            services.book_appointment(client, self.lawyer, MONDAY, at, 30, title='Urgent', description='Bail hearing')
+            return True
+        except services.SlotUnavailable:
+            return False
+        finally:
+            connection.close()
+
+    def race(self, attempts, workers):
+        clients = [User.objects.create_user(username=f'client{i}') for i in range(attempts)]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(self.attempt, clients))
+
+        booked = Appointment.objects.filter(status='pending')
+        self.assertEqual(booked.count(), sum(results))
+        self.assertEqual(BookedSlot.objects.count(), 2 * booked.count())
+        occupied = [slot for appointment in booked for slot in availability.slot_range(appointment.requested_time, 30)]
+        self.assertEqual(len(occupied), len(set(occupied)))
+        self.assertGreaterEqual(booked.count(), 3)
+        return sum(results)
+
+    def test_concurrent_bookings_never_overlap(self):
+        self.race(attempts=40, workers=8)
+
+    @BENCHMARKS
+    def test_benchmark_two_hundred_contended_bookings(self):
+        started = clock.perf_counter()
+        booked = self.race(attempts=200, workers=32)
+        elapsed = clock.perf_counter() - started
+        print(f'\n200 contended booking attempts: {booked} booked, {200 / elapsed:.0f} attempts/s')
+
+
+class ReminderDispatchTests(TestCase):
+    def setUp(self):
+        self.now = timezone.make_aware(datetime(2030, 1, 7, 22, 0))
+        self.lawyer = User.objects.create_user(username='lawyer', email='lawyer@example.com', user_type='lawyer')
+        self.client_user = User.objects.create_user(username='client', email='client@example.com')
+
+    def appointment(self, day, at, **kwargs):
+        values = dict(
+            user=self.client_user, lawyer=self.lawyer, title='Consultation', description='Cheque bounce',
+            requested_date=day, requested_time=at, confirmed_date=day, confirmed_time=at, status='confirmed'
+        )
+        values.update(kwargs)
+        return Appointment.objects.create(**values)
+
+    def test_only_due_appointments_are_reminded_once(self):
+        tomorrow = date(2030, 1, 8)
+        due = [self.appointment(tomorrow, time(10)), self.appointment(date(2030, 1, 7), time(23))]
+        self.appointment(tomorrow, time(23))  # beyond the 24h window
+        self.appointment(date(2030, 1, 7), time(21))  # already started
+        self.appointment(tomorrow, time(11), status='pending')
+
+        self.assertEqual(reminders.dispatch_reminders(now=self.now), 4)
+        self.assertEqual(len(mail.outbox), 4)
+        self.assertEqual(
+            set(Appointment.objects.filter(reminder_sent_to_user=True, reminder_sent_to_lawyer=True)),
+            set(due)
+        )
+
+        self.assertEqual(reminders.dispatch_reminders(now=self.now), 0)
+        self.assertEqual(len(mail.outbox), 4)
+
+    def test_sends_in_batches_over_one_console_connection(self):
+        for hour in range(9, 18):
+            self.appointment(date(2030, 1, 8), time(hour))
+        UserProfile.objects.create(user=self.lawyer, email_notifications=False)
+        stream = io.StringIO()
+        connection = get_connection('django.core.mail.backends.console.EmailBackend', stream=stream)
+
+        # per batch of three: candidates, claim, load, bulk_update; then one empty candidate query
+        with self.assertNumQueries(3 * 4 + 1):
+            sent = reminders.dispatch_reminders(now=self.now, batch_size=3, connection=connection)
+
+        self.assertEqual(sent, 9)
+        self.assertEqual(stream.getvalue().count('To: client@example.com'), 9)
+        self.assertFalse(Appointment.objects.filter(reminder_sent_to_lawyer=False).exists())
+
+    def test_concurrent_dispatchers_do_not_double_send(self):
+        for hour in range(9, 13):
+            self.appointment(date(2030, 1, 8), time(hour))
+
+        claimed_elsewhere = reminders.claim_batch(self.now, timedelta(hours=24), 2)
+        self.assertEqual(reminders.dispatch_reminders(now=self.now), 4)
+        self.assertEqual(
+            Appointment.objects.filter(id__in=[a.id for a in claimed_elsewhere], reminder_sent_to_user=False).count(), 2
+        )
+
+        # A crashed dispatcher's claim is taken over once it times out
+        later = self.now + timedelta(minutes=11)
+        self.assertEqual(reminders.dispatch_reminders(now=later), 4)
+        self.assertFalse(Appointment.objects.filter(reminder_sent_to_user=False).exists())
+
+    @BENCHMARKS
+    def test_benchmark_dispatch_over_a_million_appointments(self):
+        total = int(os.environ.get('NYAYABOT_BENCHMARK_APPOINTMENTS', 1_000_000))
+        base = date(2029, 1, 1)
+        batch = []
+        for i in range(total):
+            day = base + timedelta(days=i % 730)
+            batch.append(Appointment(
+                user=self.client_user, lawyer=self.lawyer, title='Bulk', description='', status='confirmed',
+                requested_date=day, requested_time=time(9 + i % 8), confirmed_date=day, confirmed_time=time(9 + i % 8),
+                reminder_sent_to_user=day < date(2030, 1, 7), reminder_sent_to_lawyer=day < date(2030, 1, 7),
+            ))
+            if len(batch) == 10000:
+                Appointment.objects.bulk_create(batch)
+                batch = []
+        Appointment.objects.bulk_create(batch)
+
+        started = clock.perf_counter()
+        sent = reminders.dispatch_reminders(now=self.now)
+        elapsed = clock.perf_counter() - started
+        print(f'\nReminder dispatch over {total} appointments: {sent} emails in {elapsed * 1000:.0f} ms')
+
+        # Only 2030-01-08 falls in the window; every appointment on it gets two reminders
+        due = len(range((date(2030, 1, 8) - base).days, total, 730))
+        self.assertEqual(sent, 2 * due)
+        # The window query reads only the due rows, so the table size shouldn't show
+        self.assertLess(elapsed, 0.5 + due * 0.002)
+
+
+class FirstAvailableSearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        search.reset_matrix()
+        self.addCleanup(search.reset_matrix)
+        self.client_user = User.objects.create_user(username='client')
+
+    def lawyer(self, username, start_hour, specializations=('criminal',), languages=('Hindi',), status='approved'):
+        user = User.objects.create_user(username=username, user_type='lawyer', first_name=username.title())
+        LawyerProfile.objects.create(
+            user=user, bar_council_id=f'BCI-{username}', bar_council_certificate='certificates/sample',
+            years_of_experience=5, education='LLB', office_address='Delhi', bio='Advocate', status=status,
+            specializations=list(specializations), languages_spoken=list(languages)
+        )
+        for weekday in range(5):
+            LawyerAvailability.objects.create(lawyer=user, weekday=weekday, start_time=time(start_hour), end_time=time(17))
+        return user
+
+    def search(self, **params):
+        params.setdefault('after', timezone.make_aware(datetime.combine(MONDAY, time(8))))
+        return [(start.time(), lawyer_id) for start, lawyer_id, _ in search.first_available(**params)]
+
+    def test_earliest_slot_per_matching_lawyer(self):
+        early = self.lawyer('early', 9)
+        late = self.lawyer('late', 11, languages=('English', 'Hindi'))
+        self.lawyer('family', 8, specializations=('family',))
+        self.lawyer('pending', 8, status='pending')
+
+        self.assertEqual(self.search(specialization='Criminal'), [(time(9), early.id), (time(11), late.id)])
+        self.assertEqual(self.search(specialization='criminal', language='english'), [(time(11), late.id)])
+        self.assertEqual(self.search(specialization='tax'), [])
+        self.assertEqual(self.search(specialization='criminal', limit=1), [(time(9), early.id)])
+
+    def test_bookings_after_the_matrix_was_built_are_respected(self):
+        early = self.lawyer('early', 9)
+        self.search()
+        Appointment.objects.create(
+            user=self.client_user, lawyer=early, title='Consultation', description='Bail',
+            requested_date=MONDAY, requested_time=time(9), duration_minutes=90, status='pending'
+        )
+        self.assertEqual(self.search(), [(time(10, 30), early.id)])
+
+    def test_stale_matrix_is_served_while_one_rebuild_runs(self):
+        early = self.lawyer('early', 9)
+        self.assertEqual(self.search(), [(time(9), early.id)])
+        stale = search._matrix
+        late = self.lawyer('late', 8)
+
+        with self.settings(FIRST_AVAILABLE_MATRIX_TTL=-1), mock.patch.object(search.threading, 'Thread') as thread:
+            self.assertEqual(self.search(), [(time(9), early.id)])
+            self.assertEqual(self.search(), [(time(9), early.id)])
+        thread.assert_called_once()
+        self.assertIs(search._matrix, stale)
+
+        # The rebuild, run here rather than on its thread, swaps in a matrix that knows the new lawyer
+        search._refresh(*thread.call_args.kwargs['args'])
+        self.assertEqual(self.search(), [(time(8), late.id), (time(9), early.id)])
+
+        # A rebuild that finishes after a reset is dropped
+        search.reset_matrix()
+        search._refresh(*thread.call_args.kwargs['args'])
+        self.assertIsNone(search._matrix)
+
+    def test_endpoint(self):
+        early = self.lawyer('early', 9)
+        response = self.client.get(reverse('appointments:first-available'), {
+            'specialization': 'criminal', 'after': f'{MONDAY}T08:00:00+05:30', 'duration': 30,
+        })
+        self.assertEqual(response.status_code, 200)
+        [result] = response.data['results']
+        self.assertEqual(result['lawyer_id'], early.id)
+        self.assertEqual(result['name'], 'Early')
+        self.assertEqual(result['start'], f'{MONDAY}T09:00:00+05:30')
+        self.assertEqual(result['end'], f'{MONDAY}T09:30:00+05:30')
+
+    @BENCHMARKS
+    def test_benchmark_ten_thousand_lawyers_under_100ms(self):
+        total = 10_000
+        users = User.objects.bulk_create([
+            User(username=f'bench{i}', user_type='lawyer', password='!') for i in range(total)
+        ])
+        specializations = ['criminal', 'family', 'civil', 'tax', 'corporate']
+        languages = ['Hindi', 'English', 'Marathi', 'Tamil']
+        LawyerProfile.objects.bulk_create([
+            LawyerProfile(
+                user=user, bar_council_id=f'BCI-{i}', bar_council_certificate='certificates/sample',
+                years_of_experience=5, education='LLB', office_address='Delhi', bio='Advocate', status='approved',
+                specializations=[specializations[i % 5]], languages_spoken=[languages[i % 4], 'English']
+            )
+            for i, user in enumerate(users)
+        ])
+        LawyerAvailability.objects.bulk_create([
+            LawyerAvailability(lawyer=user, weekday=weekday, start_time=time(8 + i % 4), end_time=time(17 + i % 3),
+                               break_start_time=time(13), break_end_time=time(14))
+            for i, user in enumerate(users) for weekday in range(6) if (i + weekday) % 7
+        ])
+        # Busy calendars: most lawyers are booked solid on the first day
+        Appointment.objects.bulk_create([
+            Appointment(user=self.client_user, lawyer=user, title='Booked', description='', status='confirmed',
+                        requested_date=MONDAY, requested_time=time(8), duration_minutes=12 * 60)
+            for i, user in enumerate(users) if i % 50
+        ])
+
+        started = clock.perf_counter()
+        search.get_matrix(MONDAY, MONDAY + timedelta(days=14))
+        print(f'\nFirst-available matrix for {total} lawyers built in {(clock.perf_counter() - started) * 1000:.0f} ms')
+
+        queries = [
+            {'specialization': specialization, 'language': language, 'limit': 10}
+            for specialization in specializations for language in languages
+        ]
+        for params in queries:
+            self.search(**params)  # warm the per-lawyer verification cache
+        started = clock.perf_counter()
+        for params in queries:
+            self.assertEqual(len(self.search(**params)), 10)
+        per_query = (clock.perf_counter() - started) / len(queries)
+        print(f'First-available search over {total} lawyers: {per_query * 1000:.2f} ms per query')
+        self.assertLess(per_query, 0.1)
+
+
+class CalendarFeedTests(TestCase):
+    def setUp(self):
+        self.lawyer = User.objects.create_user(username='lawyer', user_type='lawyer')
+        self.client_user = User.objects.create_user(username='client', first_name='Asha', last_name='Rao')
+        self.feed = CalendarFeedToken.objects.create(lawyer=self.lawyer)
+        self.url = reverse('appointments:calendar-feed', args=[self.feed.token])
+
+    def appointment(self, day, at, status='confirmed', **kwargs):
+        return Appointment.objects.create(
+            user=self.client_user, lawyer=self.lawyer, title='Consultation', description='Property, partition; Pune',
+            requested_date=day, requested_time=at, confirmed_date=day, confirmed_time=at, status=status, **kwargs
+        )
+
+    def body(self, response):
+        return b''.join(response.streaming_content).decode()
+
+    def test_feed_streams_confirmed_appointments(self):
+        self.appointment(MONDAY, time(10), meeting_link='https://meet.example.com/' + 'x' * 80)
+        self.appointment(MONDAY, time(12), status='pending')
+
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url)
+            body = self.body(response)
+
+        self.assertEqual(response['Content-Type'], 'text/calendar; charset=utf-8')
+        self.assertTrue(body.startswith('BEGIN:VCALENDAR\r\n') and body.endswith('END:VCALENDAR\r\n'))
+        self.assertEqual(body.count('BEGIN:VEVENT'), 1)
+        self.assertIn('DTSTART:20300107T043000Z', body)
+        self.assertIn('DTEND:20300107T053000Z', body)
+        self.assertIn('Client: Asha Rao\\nProperty\\, partition\\; Pune', body)
+        self.assertTrue(all(len(line.encode()) <= 75 for line in body.split('\r\n')))
+
+    def test_unchanged_feed_is_answered_with_304_from_one_query(self):
+        appointment = self.appointment(MONDAY, time(10))
+        etag = self.client.get(self.url)['ETag']
+
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        appointment.meeting_location = 'Court room 4'
+        appointment.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('LOCATION:Court room 4', self.body(response))
+
+        appointment.delete()
+        self.assertNotEqual(self.client.get(self.url)['ETag'], response['ETag'])
+
+    def test_token_is_required_and_can_be_rotated(self):
+        self.assertEqual(self.client.get(reverse('appointments:calendar-feed', args=['wrong'])).status_code, 404)
+
+        client = APIClient()
+        client.force_authenticate(self.lawyer)
+        self.assertTrue(client.get(reverse('appointments:calendar-feed-token')).data['url'].endswith(self.url))
+        rotated = client.post(reverse('appointments:calendar-feed-token')).data['url']
+        self.assertNotIn(self.feed.token, rotated)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+        client.force_authenticate(self.client_user)
+        self.assertEqual(client.get(reverse('appointments:calendar-feed-token')).status_code, 403)
+
+
+class AppointmentSweepTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.lawyer = User.objects.create_user(username='lawyer', user_type='lawyer')
+        self.client_user = User.objects.create_user(username='client')
+        # 04:00 UTC is 09:30 in Asia/Kolkata
+        self.now = datetime(2030, 1, 7, 4, 0, tzinfo=dt_timezone.utc)
+
+    def appointment(self, day, at, status='confirmed'):
+        confirmed = {'confirmed_date': day, 'confirmed_time': at} if status != 'pending' else {}
+        return Appointment.objects.create(
+            user=self.client_user, lawyer=self.lawyer, title='Consultation', description='Lease',
+            requested_date=day, requested_time=at, status=status, **confirmed
+        )
+
+    def test_states_are_computed_in_local_time(self):
+        past = self.appointment(MONDAY, time(9))
+        future = self.appointment(MONDAY, time(10))
+        pending = self.appointment(MONDAY, time(8), status='pending')
+        self.appointment(MONDAY, time(7), status='completed')
+
+        self.assertEqual(set(Appointment.objects.overdue(self.now)), {past, pending})
+        self.assertEqual(list(Appointment.objects.upcoming(self.now)), [future])
+        states = {a.id: (a.upcoming, a.overdue) for a in Appointment.objects.with_states(self.now)}
+        self.assertEqual(states[past.id], (False, True))
+        self.assertEqual(states[future.id], (True, False))
+        self.assertEqual(Appointment.objects.with_states(self.now).filter(overdue=True).count(), 2)
+
+        self.assertEqual(future.scheduled_start, self.now + timedelta(minutes=30))
+        self.assertTrue(future.is_upcoming)
+
+    def test_sweeper_cancels_unconfirmed_and_marks_no_shows_in_bulk(self):
+        stale_pending = [self.appointment(MONDAY, time(hour), status='pending') for hour in (6, 7, 8, 9)]
+        BookedSlot.objects.create(lawyer=self.lawyer, appointment=stale_pending[0], date=MONDAY, slot=24)
+        fresh_pending = self.appointment(MONDAY, time(11), status='pending')
+        missed = self.appointment(MONDAY - timedelta(days=2), time(9))
+        recent = self.appointment(MONDAY, time(9))
+
+        # per batch of three: select ids, savepoint, update, delete slots, select swept rows,
+        # stats update, release, page invalidation; plus one empty select per transition
+        with self.assertNumQueries(8 * 3 + 2):
+            swept = sweeper.sweep_appointments(now=self.now, batch_size=3)
+
+        self.assertEqual(swept, {'cancelled': 4, 'no_show': 1})
+        self.assertEqual(Appointment.objects.filter(status='cancelled').count(), 4)
+        self.assertFalse(BookedSlot.objects.exists())
+        for appointment, status in [(fresh_pending, 'pending'), (missed, 'no_show'), (recent, 'confirmed')]:
+            appointment.refresh_from_db()
+            self.assertEqual(appointment.status, status)
+        self.assertEqual(sweeper.sweep_appointments(now=self.now), {'cancelled': 0, 'no_show': 0})
+
+    def test_sweep_leaves_the_slots_of_rows_changed_concurrently(self):
+        raced = self.appointment(MONDAY, time(8), status='pending')
+        swept = self.appointment(MONDAY, time(9), status='pending')
+        for appointment, slot in ((raced, 32), (swept, 36)):
+            BookedSlot.objects.create(lawyer=self.lawyer, appointment=appointment, date=MONDAY, slot=slot)
+        update = QuerySet.update
+
+        def confirm_first(queryset, **changes):
+            if changes.get('status') == 'cancelled':
+                # The lawyer confirms one of them between the sweep's select and its update
+                update(Appointment.objects.filter(pk=raced.pk), status='confirmed', confirmed_date=MONDAY,
+                       confirmed_time=time(8), updated_at=self.now)
+            return update(queryset, **changes)
+
+        with mock.patch.object(QuerySet, 'update', confirm_first):
+            self.assertEqual(sweeper.sweep_appointments(now=self.now)['cancelled'], 1)
+        self.assertEqual(list(BookedSlot.objects.values_list('appointment_id', flat=True)), [raced.pk])
+
+    def test_list_filters_by_state(self):
+        self.appointment(timezone.localdate() - timedelta(days=1), time(9))
+        upcoming = self.appointment(timezone.localdate() + timedelta(days=1), time(9))
+        client = APIClient()
+        client.force_authenticate(self.client_user)
+
+        response = client.get(reverse('appointments:appointments'), {'state': 'upcoming'})
+        self.assertEqual([row['id'] for row in response.data['results']], [upcoming.id])
+        response = client.get(reverse('appointments:appointments'), {'state': 'overdue'})
+        self.assertEqual(len(response.data['results']), 1)
+
+
+class LawyerStatsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.lawyer = User.objects.create_user(username='lawyer', user_type='lawyer')
+        self.profile = LawyerProfile.objects.create(
+            user=self.lawyer, bar_council_id='BCI-stats', bar_council_certificate='certificates/sample',
+            years_of_experience=5, education='LLB', office_address='Delhi', bio='Advocate', status='approved'
+        )
+        self.client_user = User.objects.create_user(username='client')
+
+    def appointment(self, day, status='pending', **kwargs):
+        return Appointment.objects.create(
+            user=self.client_user, lawyer=self.lawyer, title='Consultation', description='Lease',
+            requested_date=day, requested_time=time(10), status=status, **kwargs
+        )
+
+    def rollup(self, day):
+        return LawyerDailyStats.objects.filter(lawyer=self.lawyer, date=day).values(
+            'pending', 'confirmed', 'completed', 'cancelled', 'no_show', 'revenue', 'feedback_count', 'rating_sum'
+        ).get()
+
+    def test_rollups_follow_status_transitions_and_feedback(self):
+        appointment = self.appointment(MONDAY, consultation_fee=Decimal('1500.00'))
+        self.assertEqual(self.rollup(MONDAY)['pending'], 1)
+
+        appointment.status, appointment.confirmed_date, appointment.confirmed_time = 'confirmed', MONDAY, time(10)
+        appointment.save()
+        appointment.status, appointment.is_paid = 'completed', True
+        appointment.save()
+        AppointmentFeedback.objects.create(appointment=appointment, user_rating=4)
+        self.appointment(MONDAY, status='no_show')
+        self.appointment(MONDAY).delete()
+
+        self.assertEqual(self.rollup(MONDAY), {
+            'pending': 0, 'confirmed': 0, 'completed': 1, 'cancelled': 0, 'no_show': 1,
+            'revenue': Decimal('1500.00'), 'feedback_count': 1, 'rating_sum': 4,
+        })
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.total_consultations, 1)
+
+        # Moving a completed appointment to another day moves its contribution with it
+        appointment.confirmed_date = MONDAY + timedelta(days=1)
+        appointment.save()
+        self.assertEqual(self.rollup(MONDAY)['completed'], 0)
+        self.assertEqual(self.rollup(MONDAY + timedelta(days=1))['revenue'], Decimal('1500.00'))
+
+    def test_bulk_transitions_are_counted(self):
+        for _ in range(3):
+            self.appointment(MONDAY)
+        sweeper.sweep_appointments(now=timezone.make_aware(datetime.combine(MONDAY, time(12))))
+        self.assertEqual(self.rollup(MONDAY)['pending'], 0)
+        self.assertEqual(self.rollup(MONDAY)['cancelled'], 3)
+
+    def test_rebuild_matches_incremental_rollups(self):
+        completed = self.appointment(MONDAY, status='completed', is_paid=True, consultation_fee=Decimal('800'),
+                                     confirmed_date=MONDAY, confirmed_time=time(10))
+        AppointmentFeedback.objects.create(appointment=completed, user_rating=5)
+        self.appointment(MONDAY, status='cancelled')
+        self.appointment(MONDAY + timedelta(days=3), status='confirmed')
+        incremental = list(LawyerDailyStats.objects.order_by('date').values())
+
+        LawyerDailyStats.objects.update(completed=99)
+        LawyerProfile.objects.update(total_consultations=42)
+        call_command('rebuild_lawyer_stats', stdout=io.StringIO())
+
+        self.assertEqual(
+            [dict(row, id=None) for row in LawyerDailyStats.objects.order_by('date').values()],
+            [dict(row, id=None) for row in incremental]
+        )
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.total_consultations, 1)
+
+    def test_appointments_with_deferred_fields(self):
+        first = self.appointment(MONDAY, consultation_fee=Decimal('700'))
+        self.appointment(MONDAY)
+        feedback = AppointmentFeedback.objects.create(appointment=first, user_rating=3)
+        self.assertEqual(len(Appointment.objects.only('id', 'title')), 2)
+
+        appointment = Appointment.objects.defer('status', 'requested_date').get(pk=first.pk)
+        appointment.status, appointment.is_paid = 'completed', True
+        appointment.save()
+        feedback = AppointmentFeedback.objects.only('id').get(pk=feedback.pk)
+        feedback.user_rating = 5
+        feedback.save()
+        self.assertEqual(self.rollup(MONDAY), {
+            'pending': 1, 'confirmed': 0, 'completed': 1, 'cancelled': 0, 'no_show': 0,
+            'revenue': Decimal('700'), 'feedback_count': 1, 'rating_sum': 5,
+        })
+
+        Appointment.objects.only('id').get(pk=first.pk).delete()
+        self.assertEqual((self.rollup(MONDAY)['completed'], self.rollup(MONDAY)['revenue']), (0, 0))
+
+    def test_dashboard_reads_only_rollups(self):
+        today = timezone.localdate()
+        for rating in (4, 5, 5):
+            appointment = self.appointment(today, status='completed', is_paid=True, consultation_fee=Decimal('500'))
+            AppointmentFeedback.objects.create(appointment=appointment, user_rating=rating)
+        self.appointment(today, status='no_show')
+        client = APIClient()
+        client.force_authenticate(self.lawyer)
+
+        with self.assertNumQueries(2):
+            response = client.get(reverse('appointments:dashboard'), {'days': 7})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['total_consultations'], 3)
+        self.assertEqual(response.data['totals']['revenue'], Decimal('1500'))
+        self.assertEqual(response.data['totals']['no_show_rate'], 0.25)
+        self.assertEqual(response.data['totals']['average_rating'], 4.67)
+        self.assertEqual(len(response.data['daily']), 7)
+        self.assertEqual(response.data['daily'][-1]['completed'], 3)
+
+        client.force_authenticate(self.client_user)
+        self.assertEqual(client.get(reverse('appointments:dashboard')).status_code, 403)
+
+
+class RescheduleTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.lawyer = User.objects.create_user(username='lawyer', user_type='lawyer')
+        self.client_user = User.objects.create_user(username='client')
+        for weekday in range(5):
+            LawyerAvailability.objects.create(lawyer=self.lawyer, weekday=weekday, start_time=time(9), end_time=time(12))
+        self.user_api = APIClient()
+        self.user_api.force_authenticate(self.client_user)
+        self.lawyer_api = APIClient()
+        self.lawyer_api.force_authenticate(self.lawyer)
+
+    def booked(self, day, at, confirm=True):
+        appointment = services.book_appointment(self.client_user, self.lawyer, day, at, title='Consultation',
+                                                description='Will')
+        return services.confirm_appointment(appointment) if confirm else appointment
+
+    def propose(self, appointment, day, at, api=None):
+        return (api or self.user_api).post(reverse('appointments:reschedule', args=[appointment.id]), {
+            'date': day.isoformat(), 'time': at, 'reason': 'Travelling',
+        })
+
+    def test_approved_request_moves_slots_atomically(self):
+        appointment = self.booked(MONDAY, time(9))
+        availability.available_slots(self.lawyer.id, MONDAY, 7)  # warm the cache
+        request_id = self.propose(appointment, MONDAY + timedelta(days=1), '10:00').data['id']
+
+        self.assertEqual(self.user_api.post(reverse('appointments:approve-reschedule', args=[request_id])).status_code, 403)
+        response = self.lawyer_api.post(reverse('appointments:approve-reschedule', args=[request_id]))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['appointment']['confirmed_date'], (MONDAY + timedelta(days=1)).isoformat())
+        self.assertEqual(set(BookedSlot.objects.values_list('date', flat=True)), {MONDAY + timedelta(days=1)})
+        self.assertIn(time(9), availability.available_slots(self.lawyer.id, MONDAY, 1)[0][1])
+        self.assertNotIn(time(10), availability.available_slots(self.lawyer.id, MONDAY + timedelta(days=1), 1)[0][1])
+        self.assertEqual(self.lawyer_api.post(reverse('appointments:approve-reschedule', args=[request_id])).status_code, 409)
+
+    def test_taken_slot_keeps_the_old_time(self):
+        appointment = self.booked(MONDAY, time(9))
+        self.booked(MONDAY, time(11))
+        request_id = self.propose(appointment, MONDAY, '10:30').data['id']
+
+        response = self.lawyer_api.post(reverse('appointments:approve-reschedule', args=[request_id]))
+
+        self.assertEqual(response.status_code, 409)
+        appointment.refresh_from_db()
+        self.assertEqual(appointment.confirmed_time, time(9))
+        self.assertEqual(BookedSlot.objects.filter(appointment=appointment).count(), 4)
+        self.assertEqual(AppointmentRescheduleRequest.objects.get(id=request_id).status, 'pending')
+
+        response = self.lawyer_api.post(reverse('appointments:reject-reschedule', args=[request_id]), {'message': 'Busy'})
+        self.assertEqual(response.data['reschedule_request']['status'], 'rejected')
+
+    def test_overlapping_its_own_slots_is_allowed(self):
+        appointment = self.booked(MONDAY, time(9), confirm=False)
+        request_id = self.propose(appointment, MONDAY, '09:30', api=self.lawyer_api).data['id']
+        response = self.user_api.post(reverse('appointments:approve-reschedule', args=[request_id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['appointment']['requested_time'], '09:30:00')
+        self.assertTrue(BookedSlot.objects.filter(hold_expires_at__isnull=False).exists())
+
+    def test_holiday_moves_the_days_appointments_to_the_earliest_free_slots(self):
+        nine, ten = self.booked(MONDAY, time(9)), self.booked(MONDAY, time(10))
+        self.booked(MONDAY + timedelta(days=1), time(9))
+        cancelled = self.booked(MONDAY, time(11))
+        services.cancel_appointment(cancelled, self.client_user)
+
+        response = self.lawyer_api.post(reverse('appointments:holidays'), {'date': MONDAY.isoformat()})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(row['confirmed_date'], row['confirmed_time']) for row in response.data['rescheduled']],
+            [((MONDAY + timedelta(days=1)).isoformat(), '10:00:00'), ((MONDAY + timedelta(days=1)).isoformat(), '11:00:00')]
+        )
+        self.assertEqual(availability.available_slots(self.lawyer.id, MONDAY, 1)[0][1], [])
+        self.assertEqual(AppointmentRescheduleRequest.objects.filter(status='approved').count(), 2)
+        self.assertFalse(BookedSlot.objects.filter(date=MONDAY).exists())
+        for appointment in (nine, ten):
+            appointment.refresh_from_db()
+            self.assertEqual(appointment.status, 'confirmed')
+
+    def test_holiday_over_a_special_date_starting_at_midnight(self):
+        LawyerAvailability.objects.create(
+            lawyer=self.lawyer, weekday=0, special_date=MONDAY, start_time=time(0), end_time=time(6)
+        )
+        response = self.lawyer_api.post(reverse('appointments:holidays'), {'date': MONDAY.isoformat()})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(LawyerAvailability.objects.get(lawyer=self.lawyer, special_date=MONDAY).is_holiday)
+        self.assertEqual(availability.available_slots(self.lawyer.id, MONDAY, 1)[0][1], [])
+
+    def test_holidays_on_the_same_weekday(self):
+        for day in (MONDAY, MONDAY + timedelta(days=7), MONDAY):
+            response = self.lawyer_api.post(reverse('appointments:holidays'), {'date': day.isoformat()})
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(LawyerAvailability.objects.filter(lawyer=self.lawyer, is_holiday=True).count(), 2)
+        self.assertEqual(availability.available_slots(self.lawyer.id, MONDAY + timedelta(days=7), 1)[0][1], [])
+        self.assertTrue(availability.available_slots(self.lawyer.id, MONDAY + timedelta(days=14), 1)[0][1])
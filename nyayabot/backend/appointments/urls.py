@@ -1,8 +1,24 @@
 from django.urls import path
+from .views import (
+    AppointmentListCreateView, appointment_documents_bundle, approve_reschedule, calendar_feed, calendar_feed_token, cancel_appointment,
+    confirm_appointment, first_available_lawyers, lawyer_availability, lawyer_dashboard, mark_holiday,
+    reject_reschedule, request_reschedule
+)
 
 app_name = 'appointments'
 
 urlpatterns = [
-    # Appointment URLs will be implemented
-    # path('', appointment_views, name='appointments'),
-]
\ No newline at end of file
+    path('', AppointmentListCreateView.as_view(), name='appointments'),
+    path('<int:pk>/confirm/', confirm_appointment, name='confirm'),
+    path('<int:pk>/cancel/', cancel_appointment, name='cancel'),
+    path('<int:pk>/documents.zip', appointment_documents_bundle, name='documents-bundle'),
+    path('<int:pk>/reschedule/', request_reschedule, name='reschedule'),
+    path('reschedule-requests/<int:pk>/approve/', approve_reschedule, name='approve-reschedule'),
+    path('reschedule-requests/<int:pk>/reject/', reject_reschedule, name='reject-reschedule'),
+    path('holidays/', mark_holiday, name='holidays'),
+    path('dashboard/', lawyer_dashboard, name='dashboard'),
+    path('first-available/', first_available_lawyers, name='first-available'),
+    path('calendar/', calendar_feed_token, name='calendar-feed-token'),
+    path('calendar/<str:token>.ics', calendar_feed, name='calendar-feed'),
+    path('lawyers/<int:lawyer_id>/availability/', lawyer_availability, name='lawyer-availability'),
+]
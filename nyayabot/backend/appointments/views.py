@@ -1,3 +1,296 @@
-from django.shortcuts import render
+from datetime import timedelta
+from django.db.models import Q
+from django.http import Http404, StreamingHttpResponse
+from django.shortcuts import get_object_or_404, render
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.views.decorators.http import require_GET
+from rest_framework import generics, permissions, status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.response import Response
+from documents import access, bundles
+from lawyers.models import LawyerProfile
+from . import availability, calendar, search, services, stats
+from .models import Appointment, AppointmentRescheduleRequest, CalendarFeedToken
+from .serializers import (
+    AppointmentBookingSerializer, AppointmentSerializer, AvailabilityQuerySerializer, DashboardQuerySerializer,
+    FirstAvailableQuerySerializer, HolidaySerializer, RescheduleCreateSerializer, RescheduleRequestSerializer
+)
 
 # Create your views here.
+
+@api_view(['GET'])
+@permission_classes([permissions.AllowAny])
+def lawyer_availability(request, lawyer_id):
+    """Bookable start times for a lawyer over a date range"""
+    query = AvailabilityQuerySerializer(data=request.query_params)
+    query.is_valid(raise_exception=True)
+    start = query.validated_data.get('start') or timezone.localdate()
+    duration = query.validated_data['duration']
+    
+    days = availability.available_slots(lawyer_id, start, query.validated_data['days'], duration)
+    return Response({
+        'lawyer_id': lawyer_id,
+        'duration_minutes': duration,
+        'slot_minutes': availability.SLOT_MINUTES,
+        'days': [
+            {'date': day.isoformat(), 'slots': [at.isoformat(timespec='minutes') for at in times]}
+            for day, times in days
+        ]
+    })
+
+@api_view(['GET'])
+@permission_classes([permissions.AllowAny])
+def first_available_lawyers(request):
+    """Earliest bookable slots across all approved lawyers matching a specialization and language"""
+    query = FirstAvailableQuerySerializer(data=request.query_params)
+    query.is_valid(raise_exception=True)
+    params = query.validated_data
+    
+    results = search.first_available(
+        specialization=params.get('specialization'), language=params.get('language'),
+        after=params.get('after'), before=params.get('before'),
+        duration_minutes=params['duration'], limit=params['limit']
+    )
+    profiles = LawyerProfile.objects.select_related('user').in_bulk([profile_id for _, _, profile_id in results])
+    return Response({
+        'duration_minutes': params['duration'],
+        'results': [
+            {
+                'lawyer_id': lawyer_id,
+                'lawyer_profile_id': profile_id,
+                'name': profiles[profile_id].user.get_full_name() or profiles[profile_id].user.username,
+                'specializations': profiles[profile_id].specializations,
+                'consultation_fee': profiles[profile_id].consultation_fee,
+                'start': start.isoformat(),
+                'end': (start + timedelta(minutes=params['duration'])).isoformat(),
+            }
+            for start, lawyer_id, profile_id in results if profile_id in profiles
+        ]
+    })
+
+class AppointmentListCreateView(generics.ListCreateAPIView):
+    """List the current user's appointments or book a new one"""
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get_serializer_class(self):
+        return AppointmentBookingSerializer if self.request.method == 'POST' else AppointmentSerializer
+    
+    def get_queryset(self):
+        user = self.request.user
+        queryset = Appointment.objects.filter(Q(user=user) | Q(lawyer=user))
+        state = self.request.query_params.get('state')
+        if state == 'upcoming':
+            queryset = queryset.upcoming().order_by('requested_date', 'requested_time')
+        elif state == 'overdue':
+            queryset = queryset.overdue()
+        return queryset
+    
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        details = dict(serializer.validated_data)
+        lawyer = details.pop('lawyer')
+        day = details.pop('requested_date')
+        at = details.pop('requested_time')
+        
+        try:
+            appointment = services.book_appointment(request.user, lawyer, day, at, **details)
+        except services.SlotUnavailable as e:
+            return Response({'error': str(e)}, status=status.HTTP_409_CONFLICT)
+        
+        return Response({
+            'appointment': AppointmentSerializer(appointment).data,
+            'hold_expires_at': appointment.hold_expires_at,
+            'message': 'Appointment requested successfully'
+        }, status=status.HTTP_201_CREATED)
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def confirm_appointment(request, pk):
+    """Lawyer confirms a pending appointment while its hold is still valid"""
+    appointment = get_object_or_404(Appointment, pk=pk, lawyer=request.user)
+    if appointment.status != 'pending':
+        return Response({'error': f'Appointment is {appointment.status}'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        services.confirm_appointment(appointment)
+    except services.SlotUnavailable as e:
+        return Response({'error': str(e)}, status=status.HTTP_409_CONFLICT)
+    return Response({'appointment': AppointmentSerializer(appointment).data, 'message': 'Appointment confirmed'})
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def cancel_appointment(request, pk):
+    """Either party cancels an upcoming appointment, freeing its slots"""
+    appointment = get_object_or_404(Appointment, Q(user=request.user) | Q(lawyer=request.user), pk=pk)
+    if appointment.status not in ('pending', 'confirmed'):
+        return Response({'error': f'Appointment is {appointment.status}'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    services.cancel_appointment(appointment, request.user, request.data.get('reason', ''))
+    return Response({'appointment': AppointmentSerializer(appointment).data, 'message': 'Appointment cancelled'})
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def appointment_documents_bundle(request, pk):
+    """Stream a ZIP of the appointment's shared documents the user may read; supports one byte range"""
+    appointment = get_object_or_404(Appointment, Q(user=request.user) | Q(lawyer=request.user), pk=pk)
+    # Access is checked once, for the whole set, in the query
+    documents = list(appointment.documents_shared.filter(access.readable_by(request.user)).only(
+        'id', 'title', 'file', 'file_size', 'file_type', 'crc32', 'created_at'
+    ).order_by('id'))
+    if not documents:
+        return Response({'error': 'No documents were shared for this appointment'}, status=status.HTTP_404_NOT_FOUND)
+    
+    bundle = bundles.Bundle(documents)
+    requested = request.headers.get('Range')
+    if requested and request.headers.get('If-Range', bundle.etag) != bundle.etag:
+        # The documents changed since the partial download began
+        requested = None
+    try:
+        byte_range = bundles.parse_range(requested, bundle.length)
+    except ValueError:
+        response = Response({'error': 'Range not satisfiable'}, status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        response['Content-Range'] = f'bytes */{bundle.length}'
+        return response
+    
+    start, end = byte_range or (0, bundle.length)
+    response = StreamingHttpResponse(bundle.iter_bytes(start, end), content_type='application/zip',
+                                     status=206 if byte_range else 200)
+    response['Content-Length'] = end - start
+    if byte_range:
+        response['Content-Range'] = f'bytes {start}-{end - 1}/{bundle.length}'
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = bundle.etag
+    response['Cache-Control'] = 'private, no-store'
+    response['Content-Disposition'] = f'attachment; filename="appointment-{appointment.pk}-documents.zip"'
+    return response
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def request_reschedule(request, pk):
+    """Either party proposes a new time; the other party approves or rejects it"""
+    appointment = get_object_or_404(Appointment, Q(user=request.user) | Q(lawyer=request.user), pk=pk)
+    if appointment.status not in ('pending', 'confirmed'):
+        return Response({'error': f'Appointment is {appointment.status}'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    serializer = RescheduleCreateSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    reschedule_request = AppointmentRescheduleRequest.objects.create(
+        appointment=appointment, requested_by=request.user, reason=serializer.validated_data['reason'],
+        new_requested_date=serializer.validated_data['date'], new_requested_time=serializer.validated_data['time'],
+    )
+    return Response(RescheduleRequestSerializer(reschedule_request).data, status=status.HTTP_201_CREATED)
+
+def _reschedule_request_for_responder(request, pk):
+    """A reschedule request the current user may answer: they are a party but not the requester"""
+    reschedule_request = get_object_or_404(
+        AppointmentRescheduleRequest.objects.select_related('appointment'),
+        Q(appointment__user=request.user) | Q(appointment__lawyer=request.user), pk=pk
+    )
+    if reschedule_request.requested_by_id == request.user.id:
+        return None
+    return reschedule_request
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def approve_reschedule(request, pk):
+    """Move the appointment to the requested time, revalidating the slot atomically"""
+    reschedule_request = _reschedule_request_for_responder(request, pk)
+    if reschedule_request is None:
+        return Response({'error': 'You cannot answer your own reschedule request'}, status=status.HTTP_403_FORBIDDEN)
+    
+    try:
+        reschedule_request, appointment = services.approve_reschedule(
+            reschedule_request, request.user, request.data.get('message', '')
+        )
+    except services.SlotUnavailable as e:
+        return Response({'error': str(e)}, status=status.HTTP_409_CONFLICT)
+    return Response({
+        'reschedule_request': RescheduleRequestSerializer(reschedule_request).data,
+        'appointment': AppointmentSerializer(appointment).data,
+        'message': 'Appointment rescheduled'
+    })
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def reject_reschedule(request, pk):
+    """Decline a reschedule request, keeping the current time"""
+    reschedule_request = _reschedule_request_for_responder(request, pk)
+    if reschedule_request is None:
+        return Response({'error': 'You cannot answer your own reschedule request'}, status=status.HTTP_403_FORBIDDEN)
+    
+    try:
+        reschedule_request = services.reject_reschedule(reschedule_request, request.user, request.data.get('message', ''))
+    except services.SlotUnavailable as e:
+        return Response({'error': str(e)}, status=status.HTTP_409_CONFLICT)
+    return Response({'reschedule_request': RescheduleRequestSerializer(reschedule_request).data})
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def mark_holiday(request):
+    """Lawyer closes a day; its appointments move to the earliest free slots"""
+    if request.user.user_type != 'lawyer':
+        return Response({'error': 'Only lawyers can mark holidays'}, status=status.HTTP_403_FORBIDDEN)
+    
+    serializer = HolidaySerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    moved, unplaced = services.reschedule_holiday(
+        request.user, serializer.validated_data['date'], serializer.validated_data['reason']
+    )
+    return Response({
+        'rescheduled': AppointmentSerializer(moved, many=True).data,
+        'unplaced': AppointmentSerializer(unplaced, many=True).data,
+    })
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def lawyer_dashboard(request):
+    """Appointment totals and a daily series for the lawyer, read from the precomputed rollups"""
+    if request.user.user_type != 'lawyer':
+        return Response({'error': 'Only lawyers have a dashboard'}, status=status.HTTP_403_FORBIDDEN)
+    
+    query = DashboardQuerySerializer(data=request.query_params)
+    query.is_valid(raise_exception=True)
+    end = timezone.localdate()
+    start = end - timedelta(days=query.validated_data['days'] - 1)
+    totals, daily = stats.dashboard(request.user.id, start, end)
+    return Response({
+        'total_consultations': totals['completed'],
+        'totals': totals,
+        'daily': daily,
+    })
+
+@api_view(['GET', 'POST'])
+@permission_classes([permissions.IsAuthenticated])
+def calendar_feed_token(request):
+    """Get the lawyer's private calendar feed URL, or rotate it with POST"""
+    if request.user.user_type != 'lawyer':
+        return Response({'error': 'Only lawyers have calendar feeds'}, status=status.HTTP_403_FORBIDDEN)
+    
+    feed, created = CalendarFeedToken.objects.get_or_create(lawyer=request.user)
+    if request.method == 'POST' and not created:
+        feed.regenerate()
+    return Response({
+        'url': request.build_absolute_uri(reverse('appointments:calendar-feed', args=[feed.token])),
+        'created_at': feed.created_at,
+    })
+
+@require_GET
+def calendar_feed(request, token):
+    """Token-protected iCalendar feed of a lawyer's confirmed appointments"""
+    state = calendar.feed_state(token)
+    if state is None:
+        raise Http404
+    lawyer_id, etag = state
+    
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return not_modified
+    
+    response = StreamingHttpResponse(calendar.iter_calendar(lawyer_id), content_type='text/calendar; charset=utf-8')
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    response['Content-Disposition'] = 'inline; filename="nyayabot.ics"'
+    return response
@@ -0,0 +1,54 @@
+"""
+Token authentication served from the cache.
+
+DRF's ``TokenAuthentication`` looks the token and its user up on every
+request, and serializers then load the user's profile on top. Here the token
+is cached with its user and profile for ``AUTH_TOKEN_CACHE_TIMEOUT`` seconds,
+so an authenticated request costs no queries while the entry lives.
+
+Entries are deleted whenever they could grant something the database no
+longer does or show stale details: when a token is deleted (logout, password
+changes), and when a user or profile is saved, which covers deactivation.
+Writes that skip ``save()`` (``update()``, ``bulk_update()``) must call
+``invalidate_user_tokens`` themselves. Without a shared cache (Redis) the
+deletion only reaches the current process and the others catch up within the
+timeout.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+
+def token_cache_key(key):
+    return f'auth-token:{key}'
+
+
+def invalidate_tokens(*keys):
+    cache.delete_many([token_cache_key(key) for key in keys])
+
+
+def invalidate_user_tokens(*user_ids):
+    """Drop the cached tokens of users identified by their ids"""
+    invalidate_tokens(*Token.objects.filter(user_id__in=user_ids).values_list('key', flat=True))
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """``TokenAuthentication`` reading the token, user and profile from the cache"""
+
+    def authenticate_credentials(self, key):
+        cache_key = token_cache_key(key)
+        token = cache.get(cache_key)
+        if token is None:
+            model = self.get_model()
+            try:
+                # A missing profile is cached as missing too, so reading it never queries
+                token = model.objects.select_related('user__profile').get(key=key)
+            except model.DoesNotExist:
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+            if not token.user.is_active:
+                raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+            cache.set(cache_key, token, settings.AUTH_TOKEN_CACHE_TIMEOUT)
+        return (token.user, token)
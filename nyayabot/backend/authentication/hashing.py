@@ -0,0 +1,64 @@
+"""
+Password hashing within its own concurrency budget.
+
+A PBKDF2 hash costs a few hundred milliseconds of CPU. Left on the request
+threads, a burst of logins (or a credential-stuffing run) hashes on every
+thread at once and starves every other endpoint of CPU. Here every hash runs
+on a process-wide pool of ``PASSWORD_HASHING_WORKERS`` threads (``hashlib``
+releases the GIL while it hashes), so hashing never takes more than that many
+cores. At most ``PASSWORD_HASHING_QUEUE`` more hashes wait for a worker;
+beyond that the request is refused with a 503 straight away instead of
+queueing behind the burst.
+
+The pool is reached through ``PBKDF2PasswordHasher``, which replaces Django's
+in ``PASSWORD_HASHERS``, so it covers logins (including the dummy hash run
+for unknown usernames), registrations and password changes alike. Abusive
+clients are turned away before any of this by the login throttles (see
+:mod:`authentication.throttling`).
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import hashers
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+_lock = threading.Lock()
+_pool = None
+
+
+class HashingBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Too many sign-ins in progress, please try again shortly.'
+    default_code = 'hashing_busy'
+
+
+def _executor():
+    global _pool
+    with _lock:
+        if _pool is None:
+            workers = settings.PASSWORD_HASHING_WORKERS
+            _pool = (
+                ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hashing'),
+                threading.BoundedSemaphore(workers + settings.PASSWORD_HASHING_QUEUE),
+            )
+        return _pool
+
+
+def run(function, *args):
+    """Run ``function(*args)`` on the hashing pool and return its result, or raise ``HashingBusy``"""
+    executor, slots = _executor()
+    if not slots.acquire(blocking=False):
+        raise HashingBusy()
+    try:
+        return executor.submit(function, *args).result()
+    finally:
+        slots.release()
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    """Django's PBKDF2 hasher, hashing on the pool; ``verify`` goes through ``encode`` too"""
+
+    def encode(self, password, salt, iterations=None):
+        return run(super().encode, password, salt, iterations)
@@ -1,6 +1,7 @@
 from rest_framework import serializers
 from django.contrib.auth import authenticate
 from django.contrib.auth.password_validation import validate_password
+from nyayabot_backend.storage import image_derivatives
 from .models import User, UserProfile
 
 class UserRegistrationSerializer(serializers.ModelSerializer):
@@ -49,13 +50,34 @@ class UserProfileSerializer(serializers.ModelSerializer):
 
 class UserSerializer(serializers.ModelSerializer):
     profile = UserProfileSerializer(read_only=True)
+    profile_picture_urls = serializers.SerializerMethodField()
     
     class Meta:
         model = User
         fields = ('id', 'username', 'email', 'first_name', 'last_name', 'user_type', 
-                 'phone_number', 'profile_picture', 'date_of_birth', 'address', 'city', 
+                 'phone_number', 'profile_picture', 'profile_picture_urls', 'date_of_birth', 'address', 'city', 
                  'state', 'pincode', 'is_verified', 'created_at', 'profile')
         read_only_fields = ('id', 'is_verified', 'created_at')
+    
+    def get_profile_picture_urls(self, obj):
+        return image_derivatives(obj.profile_picture)
+
+class UserSummarySerializer(serializers.ModelSerializer):
+    """Compact user representation for nesting in other resources.
+    
+    Built from the user row alone (no profile, no contact details), so a
+    queryset only needs ``select_related('user')`` and the output is safe to
+    embed in cached payloads.
+    """
+    profile_picture_urls = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = User
+        fields = ('id', 'username', 'first_name', 'last_name', 'user_type', 'is_verified', 'profile_picture_urls')
+        read_only_fields = fields
+    
+    def get_profile_picture_urls(self, obj):
+        return image_derivatives(obj.profile_picture)
 
 class ChangePasswordSerializer(serializers.Serializer):
     old_password = serializers.CharField(required=True)
@@ -0,0 +1,25 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .authentication import invalidate_tokens, invalidate_user_tokens
+from .models import User, UserProfile
+
+
+# Cached tokens (see authentication/authentication.py)
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    invalidate_tokens(instance.key)
+
+
+@receiver(post_save, sender=User)
+def invalidate_saved_user_tokens(sender, instance, created, **kwargs):
+    # Also how deactivation reaches the cache
+    if not created:
+        invalidate_user_tokens(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=UserProfile)
+def invalidate_changed_profile_tokens(sender, instance, **kwargs):
+    invalidate_user_tokens(instance.user_id)
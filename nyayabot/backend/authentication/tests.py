@@ -1,3 +1,233 @@
-from django.test import TestCase
+import os
+import threading
+import time as clock
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock, skipUnless
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from rest_framework.throttling import SimpleRateThrottle
+from . import hashing
+from .models import User, UserProfile
 
 # Create your tests here.
+
+BENCHMARKS = skipUnless(os.environ.get('NYAYABOT_BENCHMARKS'), 'set NYAYABOT_BENCHMARKS=1 to run benchmarks')
+
+
+class CachedTokenAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='asha', password='Old-passw0rd!', user_type='user')
+        UserProfile.objects.create(user=self.user, bio='Tenant')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def get_user(self):
+        return self.client.get(reverse('authentication:user-details'))
+
+    def test_cached_token_costs_no_queries(self):
+        self.assertEqual(self.get_user().status_code, 200)
+        with self.assertNumQueries(0):
+            response = self.get_user()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['profile']['bio'], 'Tenant')
+
+    def test_missing_profile_is_cached(self):
+        self.user.profile.delete()
+        self.get_user()
+        with self.assertNumQueries(0):
+            response = self.get_user()
+        self.assertIsNone(response.data['profile'])
+
+    def test_logout_revokes_cached_token(self):
+        self.get_user()
+        self.assertEqual(self.client.post(reverse('authentication:logout')).status_code, 200)
+        self.assertEqual(self.get_user().status_code, 401)
+
+    def test_password_change_revokes_cached_token(self):
+        self.get_user()
+        response = self.client.post(reverse('authentication:change-password'), {
+            'old_password': 'Old-passw0rd!',
+            'new_password': 'New-passw0rd!',
+            'new_password_confirm': 'New-passw0rd!',
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_user().status_code, 401)
+
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {response.data['token']}")
+        self.assertEqual(self.get_user().status_code, 200)
+
+    def test_deactivation_revokes_cached_token(self):
+        self.get_user()
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.get_user().status_code, 401)
+
+    def test_profile_edits_are_not_served_stale(self):
+        self.get_user()
+        response = self.client.patch(reverse('authentication:profile'), {'city': 'Pune'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_user().data['city'], 'Pune')
+
+        profile = UserProfile.objects.get(user=self.user)
+        profile.bio = 'Landlord'
+        profile.save()
+        self.assertEqual(self.get_user().data['profile']['bio'], 'Landlord')
+
+
+class LoginThrottleTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        User.objects.create_user(username='asha', password='Right-passw0rd!')
+        self.client = APIClient()
+        rates = mock.patch.dict(SimpleRateThrottle.THROTTLE_RATES, {
+            'login': '3/minute', 'login-username': '2/minute', 'registration': '1/hour',
+        })
+        rates.start()
+        self.addCleanup(rates.stop)
+
+    def login(self, username, password='Wrong-passw0rd!', address='10.0.0.1'):
+        return self.client.post(
+            reverse('authentication:login'), {'username': username, 'password': password}, REMOTE_ADDR=address
+        )
+
+    def test_username_is_throttled_across_addresses(self):
+        self.assertEqual(self.login('asha', address='10.0.0.1').status_code, 400)
+        self.assertEqual(self.login('Asha', address='10.0.0.2').status_code, 400)
+
+        with mock.patch.object(hashing, 'run', wraps=hashing.run) as run:
+            response = self.login('asha', password='Right-passw0rd!', address='10.0.0.3')
+        self.assertEqual(response.status_code, 429)
+        run.assert_not_called()
+
+    def test_address_is_throttled_across_usernames(self):
+        for username in ('asha', 'bilal', 'chitra'):
+            self.assertEqual(self.login(username).status_code, 400)
+        self.assertEqual(self.login('dev').status_code, 429)
+        self.assertEqual(self.login('dev', address='10.0.0.2').status_code, 400)
+
+    def test_forwarded_for_header_is_not_trusted(self):
+        for username in ('asha', 'bilal', 'chitra'):
+            response = self.client.post(reverse('authentication:login'), {
+                'username': username, 'password': 'Wrong-passw0rd!',
+            }, REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR=f'203.0.113.{len(username)}')
+            self.assertEqual(response.status_code, 400)
+        response = self.client.post(reverse('authentication:login'), {
+            'username': 'dev', 'password': 'Wrong-passw0rd!',
+        }, REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR='203.0.113.99')
+        self.assertEqual(response.status_code, 429)
+
+    def test_registration_is_throttled_by_address(self):
+        data = {'username': 'bilal', 'email': 'bilal@example.com', 'password': 'Long-passw0rd!',
+                'password_confirm': 'Long-passw0rd!'}
+        self.assertEqual(self.client.post(reverse('authentication:register'), data).status_code, 201)
+        data['username'] = 'chitra'
+        self.assertEqual(self.client.post(reverse('authentication:register'), data).status_code, 429)
+        self.assertFalse(User.objects.filter(username='chitra').exists())
+
+
+class PasswordHashingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def test_passwords_are_hashed_on_the_pool(self):
+        threads, run = [], hashing.run
+
+        def record(function, *args):
+            threads.append(threading.current_thread().name)
+            return function(*args)
+
+        with mock.patch.object(hashing, 'run', wraps=lambda function, *args: run(record, function, *args)):
+            response = self.client.post(reverse('authentication:register'), {
+                'username': 'asha', 'email': 'asha@example.com',
+                'password': 'Long-passw0rd!', 'password_confirm': 'Long-passw0rd!',
+            })
+            self.assertEqual(response.status_code, 201)
+            response = self.client.post(reverse('authentication:login'), {
+                'username': 'asha', 'password': 'Long-passw0rd!',
+            })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(threads), 2)
+        self.assertTrue(all(name.startswith('password-hashing') for name in threads))
+        self.assertTrue(User.objects.get(username='asha').password.startswith('pbkdf2_sha256$'))
+
+    def test_exhausted_budget_is_refused(self):
+        User.objects.create_user(username='asha', password='Long-passw0rd!')
+        with mock.patch.object(hashing, '_pool', (ThreadPoolExecutor(max_workers=1), threading.BoundedSemaphore(0))):
+            response = self.client.post(reverse('authentication:login'), {
+                'username': 'asha', 'password': 'Long-passw0rd!',
+            })
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.data['detail'].code, 'hashing_busy')
+
+
+class LoginFloodTests(TransactionTestCase):
+    """Other endpoints keep answering while logins flood in from many addresses"""
+    flooders = 16
+    samples = 200
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='asha', user_type='user')
+        self.token = Token.objects.create(user=self.user)
+        for i in range(self.flooders):
+            User.objects.create_user(username=f'target{i}', password='Right-passw0rd!')
+
+    def flood(self, index, stop):
+        # A distributed attack: every attempt from a fresh address, so only the hashing budget applies
+        client, attempt, outcomes = APIClient(), 0, []
+        try:
+            while not stop.is_set():
+                attempt += 1
+                response = client.post(reverse('authentication:login'), {
+                    'username': f'target{index}' if attempt % 2 else f'unknown{index}-{attempt}',
+                    'password': 'Wrong-passw0rd!',
+                }, REMOTE_ADDR=f'10.{index}.{attempt // 250}.{attempt % 250}')
+                outcomes.append(response.status_code)
+        finally:
+            connection.close()
+        return outcomes
+
+    def latencies(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        timings = []
+        for _ in range(self.samples):
+            started = clock.perf_counter()
+            self.assertEqual(client.get(reverse('authentication:user-details')).status_code, 200)
+            timings.append((clock.perf_counter() - started) * 1000)
+        timings.sort()
+        return timings[len(timings) // 2], timings[int(len(timings) * 0.99) - 1]
+
+    def measure(self, workers, queue):
+        pool = (ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hashing'),
+                threading.BoundedSemaphore(workers + queue))
+        stop = threading.Event()
+        with mock.patch.object(hashing, '_pool', pool), ThreadPoolExecutor(max_workers=self.flooders) as flood:
+            attackers = [flood.submit(self.flood, index, stop) for index in range(self.flooders)]
+            clock.sleep(1)
+            try:
+                median, p99 = self.latencies()
+            finally:
+                stop.set()
+            outcomes = [status for attacker in attackers for status in attacker.result()]
+        pool[0].shutdown()
+        return median, p99, outcomes.count(400), outcomes.count(503)
+
+    @BENCHMARKS
+    def test_login_flood_latency(self):
+        median, p99 = self.latencies()
+        print(f'\nuser details, idle: p50 {median:.1f} ms, p99 {p99:.1f} ms')
+        tails = []
+        for label, workers, queue in (('one hashing worker', 1, 4), ('hashing on every thread', self.flooders, 0)):
+            median, p99, hashed, refused = self.measure(workers, queue)
+            print(f'user details, {self.flooders}-thread login flood, {label}: p50 {median:.1f} ms, '
+                  f'p99 {p99:.1f} ms ({hashed} logins hashed, {refused} refused)')
+            tails.append(p99)
+        self.assertLess(tails[0], tails[1])
@@ -0,0 +1,29 @@
+"""
+Sliding-window throttles for the sign-in endpoints.
+
+DRF's ``SimpleRateThrottle`` keeps the times of the recent requests of each
+key in the cache and refuses a request once the window already holds the
+rate's number of them. Throttles run before the view, so a refused attempt
+never reaches password hashing.
+
+The per-address limit is ``ScopedRateThrottle`` with the view's
+``throttle_scope``; ``UsernameRateThrottle`` adds one per attempted username,
+which catches guesses at one account spread over many addresses. Addresses
+are ``REMOTE_ADDR`` unless ``NUM_PROXIES`` says how many proxies' entries of
+``X-Forwarded-For`` to trust, so a client can't pick its own address.
+"""
+import hashlib
+
+from rest_framework.throttling import SimpleRateThrottle
+
+
+class UsernameRateThrottle(SimpleRateThrottle):
+    scope = 'login-username'
+
+    def get_cache_key(self, request, view):
+        username = request.data.get('username') if hasattr(request.data, 'get') else None
+        if not isinstance(username, str) or not username:
+            return None
+        # Hashed: usernames are client input, and cache keys have a restricted alphabet
+        ident = hashlib.sha256(username.casefold().encode()).hexdigest()
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
@@ -3,7 +3,11 @@ from rest_framework import status, generics, permissions
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.authtoken.models import Token
+from rest_framework.throttling import ScopedRateThrottle
 from django.contrib.auth import logout
+from lawyers.cache import invalidate_lawyer_user
+from .authentication import invalidate_tokens
+from .throttling import UsernameRateThrottle
 from .models import User, UserProfile
 from .serializers import (
     UserRegistrationSerializer, UserLoginSerializer, UserSerializer, 
@@ -17,6 +21,8 @@ class UserRegistrationView(generics.CreateAPIView):
     queryset = User.objects.all()
     serializer_class = UserRegistrationSerializer
     permission_classes = [permissions.AllowAny]
+    throttle_classes = [ScopedRateThrottle]
+    throttle_scope = 'registration'
     
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -34,6 +40,8 @@ class UserLoginView(generics.GenericAPIView):
     """User login endpoint"""
     serializer_class = UserLoginSerializer
     permission_classes = [permissions.AllowAny]
+    throttle_classes = [ScopedRateThrottle, UsernameRateThrottle]
+    throttle_scope = 'login'
     
     def post(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -52,7 +60,9 @@ class UserLoginView(generics.GenericAPIView):
 def logout_view(request):
     """User logout endpoint"""
     try:
-        request.user.auth_token.delete()
+        token = request.user.auth_token
+        token.delete()
+        invalidate_tokens(token.key)
         logout(request)
         return Response({
             'message': 'Logout successful'
@@ -69,6 +79,11 @@ class UserProfileView(generics.RetrieveUpdateAPIView):
     
     def get_object(self):
         return self.request.user
+    
+    def perform_update(self, serializer):
+        user = serializer.save()
+        if user.user_type == 'lawyer':
+            invalidate_lawyer_user(user.id)
 
 class UserProfileDetailView(generics.RetrieveUpdateAPIView):
     """Get and update user profile details"""
@@ -101,7 +116,9 @@ class ChangePasswordView(generics.GenericAPIView):
         user.save()
         
         # Invalidate current token and create a new one
-        user.auth_token.delete()
+        old_token = user.auth_token
+        old_token.delete()
+        invalidate_tokens(old_token.key)
         token = Token.objects.create(user=user)
         
         return Response({
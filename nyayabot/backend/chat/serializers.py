@@ -1,9 +1,9 @@
 from rest_framework import serializers
 from .models import ChatSession, ChatMessage, LawyerUserConversation, LawyerUserMessage, AIResponse
-from authentication.serializers import UserSerializer
+from authentication.serializers import UserSummarySerializer
 
 class ChatSessionSerializer(serializers.ModelSerializer):
-    user = UserSerializer(read_only=True)
+    user = UserSummarySerializer(read_only=True)
     
     class Meta:
         model = ChatSession
@@ -22,8 +22,8 @@ class ChatMessageCreateSerializer(serializers.ModelSerializer):
         fields = ('session', 'message_type', 'content', 'metadata')
 
 class LawyerUserConversationSerializer(serializers.ModelSerializer):
-    user = UserSerializer(read_only=True)
-    lawyer = UserSerializer(read_only=True)
+    user = UserSummarySerializer(read_only=True)
+    lawyer = UserSummarySerializer(read_only=True)
     last_message = serializers.SerializerMethodField()
     unread_count = serializers.SerializerMethodField()
     
@@ -33,19 +33,25 @@ class LawyerUserConversationSerializer(serializers.ModelSerializer):
         read_only_fields = ('user', 'lawyer', 'created_at', 'updated_at')
     
     def get_last_message(self, obj):
-        last_message = obj.messages.last()
+        # Prefetched and annotated by chat.views.conversation_listing in list views
+        if hasattr(obj, 'latest_messages'):
+            last_message = obj.latest_messages[0] if obj.latest_messages else None
+        else:
+            last_message = obj.messages.select_related('sender').last()
         if last_message:
             return LawyerUserMessageSerializer(last_message).data
         return None
     
     def get_unread_count(self, obj):
+        if hasattr(obj, 'unread_messages'):
+            return obj.unread_messages
         request = self.context.get('request')
         if request and request.user:
             return obj.messages.filter(is_read=False).exclude(sender=request.user).count()
         return 0
 
 class LawyerUserMessageSerializer(serializers.ModelSerializer):
-    sender = UserSerializer(read_only=True)
+    sender = UserSummarySerializer(read_only=True)
     
     class Meta:
         model = LawyerUserMessage
@@ -58,7 +64,7 @@ class LawyerUserMessageCreateSerializer(serializers.ModelSerializer):
         fields = ('conversation', 'content')
 
 class AIResponseSerializer(serializers.ModelSerializer):
-    user = UserSerializer(read_only=True)
+    user = UserSummarySerializer(read_only=True)
     
     class Meta:
         model = AIResponse
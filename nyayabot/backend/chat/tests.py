@@ -1,3 +1,70 @@
 from django.test import TestCase
+from django.urls import reverse
+from rest_framework.test import APIClient
+from authentication.models import User, UserProfile
+from nyayabot_backend.testing import ListQueryCountMixin
+from .models import ChatSession, LawyerUserConversation, LawyerUserMessage
 
 # Create your tests here.
+
+
+class ListQueryCountTests(ListQueryCountMixin, TestCase):
+    """List endpoints run the same queries whatever the number of rows on the page"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='asha', email='asha@example.com', phone_number='9999999999')
+        UserProfile.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def new_lawyer(self):
+        lawyer = User.objects.create_user(username=f'lawyer{User.objects.count()}', user_type='lawyer')
+        UserProfile.objects.create(user=lawyer)
+        return lawyer
+
+    def test_chat_sessions(self):
+        def add_rows(count):
+            ChatSession.objects.bulk_create([ChatSession(user=self.user, title='Rent') for _ in range(count)])
+
+        response = self.assertConstantQueries(reverse('chat:chat-sessions'), add_rows)
+        self.assertEqual(response.data['count'], 17)
+        self.assertEqual(set(response.data['results'][0]['user']), {
+            'id', 'username', 'first_name', 'last_name', 'user_type', 'is_verified', 'profile_picture_urls',
+        })
+
+    def test_conversations(self):
+        def add_rows(count):
+            for _ in range(count):
+                conversation = LawyerUserConversation.objects.create(user=self.user, lawyer=self.new_lawyer())
+                LawyerUserMessage.objects.create(conversation=conversation, sender=self.user, content='Hello')
+                LawyerUserMessage.objects.create(conversation=conversation, sender=conversation.lawyer, content='Hi')
+                LawyerUserMessage.objects.create(
+                    conversation=conversation, sender=conversation.lawyer, content='Read', is_read=True
+                )
+
+        response = self.assertConstantQueries(reverse('chat:conversations'), add_rows)
+        conversation = response.data['results'][0]
+        self.assertEqual(conversation['unread_count'], 1)
+        self.assertEqual(conversation['last_message']['content'], 'Read')
+        self.assertEqual(conversation['last_message']['sender']['user_type'], 'lawyer')
+        self.assertNotIn('email', conversation['user'])
+
+        # The lawyer's view of the same conversation counts the client's message
+        self.client.force_authenticate(User.objects.get(pk=conversation['lawyer']['id']))
+        response = self.client.get(reverse('chat:conversations'))
+        self.assertEqual(response.data['results'][0]['unread_count'], 1)
+
+    def test_conversation_messages(self):
+        lawyer = self.new_lawyer()
+        conversation = LawyerUserConversation.objects.create(user=self.user, lawyer=lawyer)
+
+        def add_rows(count):
+            LawyerUserMessage.objects.bulk_create([
+                LawyerUserMessage(conversation=conversation, sender=sender, content='Update')
+                for sender in [self.user, lawyer] * count
+            ])
+
+        response = self.assertConstantQueries(
+            reverse('chat:conversation-messages', args=[conversation.pk]), add_rows
+        )
+        self.assertNotIn('profile', response.data['results'][0]['sender'])
@@ -3,7 +3,7 @@ from rest_framework import generics, permissions, status, serializers
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from django.utils import timezone
-from django.db.models import Q
+from django.db.models import Count, OuterRef, Prefetch, Q, Subquery
 import openai
 import time
 from django.conf import settings
@@ -24,7 +24,7 @@ class ChatSessionListCreateView(generics.ListCreateAPIView):
     permission_classes = [permissions.IsAuthenticated]
     
     def get_queryset(self):
-        return ChatSession.objects.filter(user=self.request.user)
+        return ChatSession.objects.filter(user=self.request.user).select_related('user')
     
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
@@ -35,7 +35,7 @@ class ChatSessionDetailView(generics.RetrieveUpdateDestroyAPIView):
     permission_classes = [permissions.IsAuthenticated]
     
     def get_queryset(self):
-        return ChatSession.objects.filter(user=self.request.user)
+        return ChatSession.objects.filter(user=self.request.user).select_related('user')
 
 class ChatMessageListView(generics.ListAPIView):
     """Get messages for a chat session"""
@@ -187,6 +187,17 @@ def categorize_legal_query(message):
     return 'general'
 
 # Lawyer-User Conversation Views
+def conversation_listing(queryset, user):
+    """Conversations with their people, latest message and unread count for ``user`` in a fixed number of queries"""
+    latest = LawyerUserMessage.objects.filter(conversation=OuterRef('conversation')).order_by('-created_at', '-id')
+    return queryset.select_related('user', 'lawyer').annotate(
+        unread_messages=Count('messages', filter=Q(messages__is_read=False) & ~Q(messages__sender=user))
+    ).prefetch_related(Prefetch(
+        'messages',
+        queryset=LawyerUserMessage.objects.filter(id=Subquery(latest.values('id')[:1])).select_related('sender'),
+        to_attr='latest_messages',
+    ))
+
 class LawyerUserConversationListView(generics.ListAPIView):
     """List conversations for current user"""
     serializer_class = LawyerUserConversationSerializer
@@ -194,9 +205,9 @@ class LawyerUserConversationListView(generics.ListAPIView):
     
     def get_queryset(self):
         user = self.request.user
-        return LawyerUserConversation.objects.filter(
+        return conversation_listing(LawyerUserConversation.objects.filter(
             Q(user=user) | Q(lawyer=user)
-        ).order_by('-updated_at')
+        ), user).order_by('-updated_at')
 
 class LawyerUserConversationCreateView(generics.CreateAPIView):
     """Start conversation with a lawyer"""
@@ -219,8 +230,8 @@ class LawyerUserMessageListView(generics.ListAPIView):
     def get_queryset(self):
         conversation_id = self.kwargs.get('conversation_id')
         conversation = LawyerUserConversation.objects.get(
-            id=conversation_id,
-            Q(user=self.request.user) | Q(lawyer=self.request.user)
+            Q(user=self.request.user) | Q(lawyer=self.request.user),
+            id=conversation_id
         )
         
         # Mark messages as read
@@ -232,7 +243,7 @@ class LawyerUserMessageListView(generics.ListAPIView):
             read_at=timezone.now()
         )
         
-        return conversation.messages.all()
+        return conversation.messages.select_related('sender')
 
 class LawyerUserMessageCreateView(generics.CreateAPIView):
     """Send message in conversation"""
@@ -0,0 +1,140 @@
+"""
+Who may read a document.
+
+* The owner always can.
+* Everyone can read ``public`` documents.
+* ``shared_with_lawyer`` documents can also be read by the lawyers in
+  ``shared_with_lawyers``, by the recipients of unrevoked ``DocumentShare``
+  rows, and by the lawyer of every appointment the document was shared
+  with (``Appointment.documents_shared``).
+* ``private`` documents are the owner's alone, even if they were shared
+  before.
+
+The rules are materialized in ``DocumentAccess``, one row per document and
+user who may read it, holding the highest permission any source grants:
+``owner``, then the ``DocumentShare`` permission level, with ``view`` for
+the lawyer lists and appointments. Public documents have rows only for their
+owner; everyone else reads them through ``privacy_level``. Checking a
+permission or listing the documents shared with a user is then one lookup
+on an index of the table.
+
+The rows are recomputed by ``refresh`` from the source relations whenever
+one of them changes (see ``documents/signals.py``). Changes that bypass
+signals, such as ``QuerySet.update()`` on ``privacy_level``, must call it
+themselves; ``rebuild`` recomputes every document.
+"""
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+
+from .models import Document, DocumentAccess, DocumentShare
+
+PERMISSION_RANK = {'view': 1, 'comment': 2, 'edit': 3, 'owner': 4}
+REBUILD_BATCH = 500
+
+
+def readable_by(user):
+    """Filter on ``Document`` for the documents ``user`` may read"""
+    granted = DocumentAccess.objects.filter(document_id=OuterRef('pk'), user_id=user.pk)
+    return Q(privacy_level='public') | Q(Exists(granted))
+
+
+def permission_of(user, document):
+    """The highest permission ``user`` has on ``document``, or None if they may not read it"""
+    permission = DocumentAccess.objects.filter(document_id=document.pk, user_id=user.pk).values_list(
+        'permission', flat=True
+    ).first()
+    if permission is None and document.privacy_level == 'public':
+        return 'view'
+    return permission
+
+
+def shared_with(user):
+    """Access rows of the documents other users have shared with ``user``"""
+    return DocumentAccess.objects.filter(user_id=user.pk).exclude(permission='owner')
+
+
+def computed_access(document_ids, exclude_appointment=None):
+    """``{(document_id, user_id): permission}`` of the given documents, from the source relations"""
+    from appointments.models import Appointment
+
+    access = {}
+
+    def grant(document_id, user_id, permission):
+        current = access.get((document_id, user_id))
+        if current is None or PERMISSION_RANK[permission] > PERMISSION_RANK[current]:
+            access[document_id, user_id] = permission
+
+    shared = []
+    for document_id, owner_id, privacy_level in Document.objects.filter(pk__in=document_ids).values_list(
+        'id', 'user_id', 'privacy_level'
+    ):
+        grant(document_id, owner_id, 'owner')
+        if privacy_level == 'shared_with_lawyer':
+            shared.append(document_id)
+    if not shared:
+        return access
+
+    for document_id, user_id in Document.shared_with_lawyers.through.objects.filter(
+        document_id__in=shared
+    ).values_list('document_id', 'user_id'):
+        grant(document_id, user_id, 'view')
+    for document_id, user_id, permission in DocumentShare.objects.filter(
+        document_id__in=shared, is_revoked=False
+    ).values_list('document_id', 'shared_with_id', 'permission_level'):
+        grant(document_id, user_id, permission)
+    appointments = Appointment.documents_shared.through.objects.filter(document_id__in=shared)
+    if exclude_appointment is not None:
+        appointments = appointments.exclude(appointment_id=exclude_appointment)
+    for document_id, user_id in appointments.values_list('document_id', 'appointment__lawyer_id'):
+        grant(document_id, user_id, 'view')
+    return access
+
+
+def refresh(document_ids, revoke_only=False, exclude_appointment=None):
+    """Bring the ``DocumentAccess`` rows of the given documents in line with the source relations.
+
+    With ``revoke_only`` rows are only removed or downgraded. Changes that can
+    only take access away use it, because they may run in the middle of a
+    cascading delete, after the rows of a user being deleted are gone.
+    Returns the number of rows changed.
+    """
+    document_ids = set(document_ids)
+    if not document_ids:
+        return 0
+    with transaction.atomic():
+        wanted = computed_access(document_ids, exclude_appointment)
+        existing = {
+            (document_id, user_id): (pk, permission)
+            for pk, document_id, user_id, permission in DocumentAccess.objects.filter(
+                document_id__in=document_ids
+            ).values_list('id', 'document_id', 'user_id', 'permission')
+        }
+
+        removed = [pk for key, (pk, _) in existing.items() if key not in wanted]
+        changed = {}
+        for key, (pk, permission) in existing.items():
+            if key in wanted and wanted[key] != permission:
+                if revoke_only and PERMISSION_RANK[wanted[key]] > PERMISSION_RANK[permission]:
+                    continue
+                changed.setdefault(wanted[key], []).append(pk)
+        added = [] if revoke_only else [
+            DocumentAccess(document_id=document_id, user_id=user_id, permission=permission)
+            for (document_id, user_id), permission in wanted.items() if (document_id, user_id) not in existing
+        ]
+
+        if removed:
+            DocumentAccess.objects.filter(pk__in=removed).delete()
+        for permission, pks in changed.items():
+            DocumentAccess.objects.filter(pk__in=pks).update(permission=permission)
+        # A concurrent refresh of the same document may have added the row already
+        DocumentAccess.objects.bulk_create(added, ignore_conflicts=True)
+    return len(removed) + sum(len(pks) for pks in changed.values()) + len(added)
+
+
+def rebuild():
+    """Recompute the access rows of every document; returns the number of rows changed"""
+    changed = 0
+    document_ids = list(Document.objects.order_by('id').values_list('id', flat=True))
+    for start in range(0, len(document_ids), REBUILD_BATCH):
+        changed += refresh(document_ids[start:start + REBUILD_BATCH])
+    return changed
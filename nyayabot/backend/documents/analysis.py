@@ -0,0 +1,363 @@
+"""
+Background document analysis pipeline.
+
+Analysing a document takes far longer than a request may, so it runs as an
+``AnalysisJob``: ``enqueue`` records the job and, once the transaction
+commits, hands it to a bounded in-process worker pool
+(``DOCUMENT_ANALYSIS_CONCURRENCY`` threads). With
+``DOCUMENT_ANALYSIS_EAGER`` the job runs in the calling thread instead,
+which is what the tests use.
+
+A job runs the ``STAGES`` in order. The output and duration of each stage are
+saved on the job as soon as it finishes, so a failed job that is retried
+(``DOCUMENT_ANALYSIS_MAX_ATTEMPTS`` attempts, with exponential backoff) resumes
+at the stage that failed. Extraction goes page by page into a spool file in
+``DOCUMENT_ANALYSIS_WORK_DIR`` and checkpoints every
+``DOCUMENT_EXTRACTION_CHECKPOINT_PAGES`` pages, so it even resumes within
+the document. Workers claim jobs with a conditional UPDATE like
+the reminder dispatcher, so a job is never run twice at the same time; a
+claim left behind by a crashed worker expires after
+``DOCUMENT_ANALYSIS_CLAIM_TIMEOUT``. ``process_analysis_jobs`` picks up due
+retries and jobs orphaned by a restart.
+
+The last stage writes ``DocumentAnalysis`` (with ``stage_timings``) and the
+``ai_*`` fields of the document. The analysis belongs to the document's
+blob, so a document whose identical twin was already analysed copies the
+results from it without running any stage. Because of that sharing, what a
+user called the document (title, type) is only shown to the model for
+documents without a blob.
+
+The ``entities`` stage finds dates, amounts, statutory references and parties
+with local rules (:mod:`documents.entities`); only what they miss is asked of
+the model, in the same shapes, and its answer is normalised to them.
+"""
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import openai
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from nyayabot_backend.storage import get_upload_backend
+from . import entities, search, similarity
+from .extraction import count_scripts, detect_language, iter_pages
+from .models import AnalysisJob, Document, DocumentAnalysis
+
+ANALYSIS_FIELDS = (
+    'legal_category', 'key_clauses', 'potential_issues', 'missing_elements', 'recommendations',
+    'parties_involved', 'important_dates', 'monetary_amounts', 'legal_references', 'risk_level', 'risk_factors',
+)
+RISK_LEVELS = ('low', 'medium', 'high')
+
+
+class OpenAIAnalyzer:
+    """Legal analysis of extracted text by the OpenAI chat API"""
+
+    list_fields = (
+        'key_points', 'legal_issues', 'key_clauses', 'potential_issues', 'missing_elements', 'recommendations',
+        'legal_references', 'risk_factors',
+    )
+    # Asked for in the shapes of the entity rules (see documents.entities)
+    entity_fields = {
+        'parties_involved': '"name" and "role" (string or null)',
+        'important_dates': '"text" and "date" (YYYY-MM-DD or null)',
+        'monetary_amounts': '"text" and "rupees" (number or null)',
+    }
+    prompt = (
+        'You are NyayaBot, an assistant that reviews legal documents under Indian law. '
+        'Analyse the document below and answer with a JSON object with the keys '
+        '"summary" (string), {lists}'
+        '"legal_category" (string), "risk_level" ("low", "medium" or "high") and '
+        '"confidence_score" (number between 0 and 1).\n\n'
+        '{details}{text}'
+    )
+
+    def __init__(self):
+        self.model = settings.DOCUMENT_ANALYSIS_MODEL
+
+    def analyze(self, text, known=None, details=None):
+        """``known`` holds the fields already found by the local entity rules, which aren't asked for again;
+        ``details`` are labelled facts about the document given to the model with its text
+        """
+        known = known or {}
+        lists = [f'"{field}" (list of strings), ' for field in self.list_fields if not known.get(field)]
+        lists += [
+            f'"{field}" (list of objects with {keys}), '
+            for field, keys in self.entity_fields.items() if not known.get(field)
+        ]
+        details = ''.join(f'{label}: {value}\n' for label, value in (details or {}).items())
+        response = openai.OpenAI(api_key=settings.OPENAI_API_KEY).chat.completions.create(
+            model=self.model,
+            response_format={'type': 'json_object'},
+            messages=[{'role': 'user', 'content': self.prompt.format(
+                lists=''.join(lists), details=f'{details}\n' if details else '', text=text,
+            )}],
+            temperature=0.2,
+        )
+        return json.loads(response.choices[0].message.content)
+
+
+def get_analyzer():
+    return import_string(settings.DOCUMENT_ANALYZER)()
+
+
+def spool_path(job):
+    """File the extracted text of a job is written to, page by page"""
+    return os.path.join(settings.DOCUMENT_ANALYSIS_WORK_DIR, f'{job.pk}.txt')
+
+
+def read_text(job, limit=None):
+    with open(spool_path(job), encoding='utf-8') as spool:
+        return spool.read(limit)
+
+
+def _checkpoint(job, state):
+    job.checkpoint['extract'] = state
+    AnalysisJob.objects.filter(pk=job.pk).update(checkpoint=job.checkpoint, claimed_at=timezone.now())
+
+
+def extract_stage(job):
+    """Stream the document's text into the job's spool file, resuming from the last checkpoint"""
+    document = job.document
+    state = job.checkpoint.get('extract')
+    try:
+        spooled = os.path.getsize(spool_path(job))
+    except FileNotFoundError:
+        spooled = 0
+    if not state or spooled < state['text_bytes']:
+        # No checkpoint, or the text it counts was lost with the spool file (another host, a cleaned temp dir)
+        state = {'position': 0, 'pages': 0, 'text_bytes': 0, 'word_count': 0, 'scripts': {}}
+    os.makedirs(settings.DOCUMENT_ANALYSIS_WORK_DIR, exist_ok=True)
+    with get_upload_backend().open(document.file.public_id, document.file.version, 'raw') as source, \
+            open(spool_path(job), 'ab') as spool:
+        # Pages written after the checkpoint are extracted again
+        spool.truncate(state['text_bytes'])
+        for position, text in iter_pages(source, document.file_type, state['position']):
+            data = f'{text}\n'.encode()
+            spool.write(data)
+            state['position'] = position
+            state['pages'] += 1
+            state['text_bytes'] += len(data)
+            state['word_count'] += len(text.split())
+            count_scripts(text, state['scripts'])
+            if state['pages'] % settings.DOCUMENT_EXTRACTION_CHECKPOINT_PAGES == 0:
+                spool.flush()
+                _checkpoint(job, state)
+    return {
+        'pages': state['pages'],
+        'word_count': state['word_count'],
+        'language': detect_language(state['scripts']),
+    }
+
+
+def entities_stage(job):
+    return entities.extract(read_text(job))
+
+
+def analyze_stage(job):
+    analyzer = get_analyzer()
+    document, known = job.document, job.results['entities']
+    # A blob's analysis is shared with every uploader of the same bytes, so it can't depend on one user's labels
+    details = None if document.blob_id else {
+        'Document type': document.get_document_type_display(), 'Title': document.title,
+    }
+    result = entities.normalize(analyzer.analyze(read_text(job, settings.DOCUMENT_ANALYSIS_MAX_CHARS), known, details))
+    # The rules win over the model wherever they found something
+    result.update({field: values for field, values in known.items() if values})
+    result['model'] = getattr(analyzer, 'model', type(analyzer).__name__)
+    return result
+
+
+def save_stage(job):
+    document = job.document
+    extracted, result = job.results['extract'], job.results['analyze']
+    text = read_text(job)
+    # The timing of this stage itself can't be known yet and is left out
+    timings = dict(job.timings)
+    risk_level = result.get('risk_level')
+    # Documents with stored blobs share one analysis per content
+    key = {'blob_id': document.blob_id} if document.blob_id else {'document': document}
+    with transaction.atomic():
+        DocumentAnalysis.objects.update_or_create(**key, defaults={
+            'document': document,
+            'extracted_text': text,
+            'word_count': extracted['word_count'],
+            'language_detected': extracted['language'],
+            **{field: result[field] for field in ANALYSIS_FIELDS if result.get(field) is not None},
+            'risk_level': risk_level if risk_level in RISK_LEVELS else None,
+            'processing_time': round(sum(timings.values()), 3),
+            'stage_timings': timings,
+            'ai_model_used': result['model'][:50],
+            'confidence_score': result.get('confidence_score') or 0.0,
+            'summary': result.get('summary', ''),
+            'key_points': result.get('key_points') or [],
+            'legal_issues': result.get('legal_issues') or [],
+        })
+        Document.objects.filter(pk=document.pk).update(
+            is_analyzed=True,
+            ai_summary=result.get('summary', ''),
+            ai_key_points=result.get('key_points') or [],
+            ai_legal_issues=result.get('legal_issues') or [],
+            ai_confidence_score=result.get('confidence_score'),
+            updated_at=timezone.now(),
+        )
+        search.index_document(document.pk, text)
+        similarity.index_document(document.pk, text)
+    return {}
+
+
+STAGES = [
+    ('extract', extract_stage),
+    ('entities', entities_stage),
+    ('analyze', analyze_stage),
+    ('save', save_stage),
+]
+
+
+def enqueue(document):
+    """Queue an analysis of ``document``, reusing its unfinished job if there is one"""
+    job = AnalysisJob.objects.filter(document=document, status__in=('queued', 'running')).first()
+    if job:
+        return job
+    job = AnalysisJob.objects.filter(document=document, status='failed').first()
+    if job:
+        # A manual retry of a failed job keeps its completed stages
+        job.status, job.attempts, job.run_after = 'queued', 0, None
+        job.save(update_fields=['status', 'attempts', 'run_after', 'updated_at'])
+    else:
+        job = AnalysisJob.objects.create(document=document)
+    transaction.on_commit(lambda: dispatch(job.pk))
+    return job
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.DOCUMENT_ANALYSIS_CONCURRENCY, thread_name_prefix='document-analysis'
+            )
+        return _executor
+
+
+def dispatch(job_id):
+    if settings.DOCUMENT_ANALYSIS_EAGER:
+        run_job(job_id)
+    else:
+        get_executor().submit(_run_in_worker, job_id)
+
+
+def _run_in_worker(job_id, now=None):
+    try:
+        return run_job(job_id, now)
+    finally:
+        close_old_connections()
+
+
+def claimable(now):
+    """Queued jobs that are due and running jobs whose worker went away"""
+    return Q(status='queued') & (Q(run_after__isnull=True) | Q(run_after__lte=now)) | Q(
+        status='running', claimed_at__lt=now - settings.DOCUMENT_ANALYSIS_CLAIM_TIMEOUT
+    )
+
+
+def claim(job_id, now=None):
+    """Atomically mark a job as running for this worker; False if it isn't claimable"""
+    now = now or timezone.now()
+    return bool(AnalysisJob.objects.filter(claimable(now), pk=job_id).update(
+        status='running', claimed_at=now, updated_at=now
+    ))
+
+
+def reuse_analysis(job):
+    """Complete a job from the analysis of the document's blob; False if it has none"""
+    document = job.document
+    shared = document.blob_id and DocumentAnalysis.objects.filter(
+        blob_id=document.blob_id, summary__isnull=False
+    ).values('summary', 'key_points', 'legal_issues', 'confidence_score', 'extracted_text').first()
+    if not shared:
+        return False
+    Document.objects.filter(pk=document.pk).update(
+        is_analyzed=True,
+        ai_summary=shared['summary'],
+        ai_key_points=shared['key_points'],
+        ai_legal_issues=shared['legal_issues'],
+        ai_confidence_score=shared['confidence_score'],
+        updated_at=timezone.now(),
+    )
+    text = shared['extracted_text']
+    search.index_document(document.pk, text)
+    similarity.index_document(document.pk, text)
+    job.status, job.reused, job.error, job.finished_at = 'completed', True, '', timezone.now()
+    job.save(update_fields=['status', 'reused', 'error', 'finished_at', 'updated_at'])
+    _remove_spool(job)
+    return True
+
+
+def run_job(job_id, now=None):
+    """Run the remaining stages of a job; returns the job, or None if another worker has it"""
+    if not claim(job_id, now):
+        return None
+    job = AnalysisJob.objects.select_related('document').get(pk=job_id)
+    if 'analyze' not in job.results and reuse_analysis(job):
+        return job
+    if 'extract' in job.results and not os.path.exists(spool_path(job)):
+        # The extracted text was lost (another host, a cleaned temp dir); extract again
+        del job.results['extract']
+        job.checkpoint.pop('extract', None)
+    for name, stage in STAGES:
+        if name in job.results:
+            continue
+        job.stage = name
+        AnalysisJob.objects.filter(pk=job.pk).update(stage=name, claimed_at=timezone.now())
+        started = time.perf_counter()
+        try:
+            output = stage(job)
+        except Exception as e:
+            return _fail(job, e)
+        job.results[name] = output
+        job.timings[name] = round(time.perf_counter() - started, 4)
+        AnalysisJob.objects.filter(pk=job.pk).update(results=job.results, timings=job.timings, updated_at=timezone.now())
+
+    job.status, job.error, job.finished_at, job.checkpoint = 'completed', '', timezone.now(), {}
+    job.save(update_fields=['status', 'error', 'finished_at', 'checkpoint', 'updated_at'])
+    _remove_spool(job)
+    return job
+
+
+def _fail(job, error):
+    job.attempts += 1
+    job.error = f'{job.stage}: {error}'[:2000]
+    if job.attempts < settings.DOCUMENT_ANALYSIS_MAX_ATTEMPTS:
+        job.status = 'queued'
+        job.run_after = timezone.now() + settings.DOCUMENT_ANALYSIS_RETRY_DELAY * 2 ** (job.attempts - 1)
+    else:
+        job.status, job.finished_at = 'failed', timezone.now()
+    job.save(update_fields=['status', 'attempts', 'error', 'run_after', 'finished_at', 'updated_at'])
+    return job
+
+
+def _remove_spool(job):
+    try:
+        os.remove(spool_path(job))
+    except FileNotFoundError:
+        pass
+
+
+def process_due_jobs(now=None, limit=None):
+    """Run every claimable job (due retries, orphaned jobs) on the worker pool and wait for them"""
+    now = now or timezone.now()
+    job_ids = list(AnalysisJob.objects.filter(claimable(now)).order_by('created_at').values_list('id', flat=True)[:limit])
+    if settings.DOCUMENT_ANALYSIS_EAGER:
+        return [run_job(job_id, now) for job_id in job_ids]
+    return list(get_executor().map(_run_in_worker, job_ids, [now] * len(job_ids)))
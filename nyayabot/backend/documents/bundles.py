@@ -0,0 +1,257 @@
+"""
+ZIP archives of stored documents, streamed as they are read from storage.
+
+Entries are stored uncompressed (the documents are PDFs, Word files and
+images, which don't shrink) and their CRC-32 goes in a data descriptor after
+the data, so every header depends only on the names and sizes of the files.
+The length of the archive and the offset of every byte are therefore known
+before anything is read: a ``Bundle`` can announce its length and serve any
+byte range by reading only the files the range overlaps, from the right
+offset. Large archives and files use the ZIP64 extensions.
+
+The CRC-32 of a file is needed by its descriptor and by the central
+directory at the end. It is computed while the file is streamed and kept in
+``Document.crc32``, so a download resumed with a ``Range`` request doesn't
+read the earlier files again. A file whose CRC isn't known yet when it is
+needed is read once to compute it.
+
+Memory use is bounded by ``READ_BLOCK`` and the size of the central
+directory, whatever the size of the files.
+"""
+import hashlib
+import re
+import struct
+import zlib
+
+from django.utils import timezone
+
+from nyayabot_backend.storage import get_upload_backend
+from .models import Document
+
+READ_BLOCK = 64 * 1024
+
+ZIP64_LIMIT = 0xFFFFFFFF
+FLAGS = 0x0808  # sizes and CRC in a data descriptor; UTF-8 names
+UNSAFE_NAME = re.compile(r'[\\/:*?"<>|\x00-\x1f]+')
+
+
+class BundleError(Exception):
+    """A stored file doesn't match the size the archive was laid out with"""
+
+
+def _dos_time(moment):
+    moment = timezone.localtime(moment) if timezone.is_aware(moment) else moment
+    if moment.year < 1980:
+        return 0, (1 << 5) | 1
+    return (
+        (moment.hour << 11) | (moment.minute << 5) | (moment.second // 2),
+        ((moment.year - 1980) << 9) | (moment.month << 5) | moment.day,
+    )
+
+
+def archive_names(documents):
+    """A unique file name per document, from its title and type"""
+    names, taken = [], set()
+    for document in documents:
+        stem = UNSAFE_NAME.sub('_', document.title).strip(' ._') or 'document'
+        extension = f'.{document.file_type}' if document.file_type else ''
+        name, copy = f'{stem}{extension}', 1
+        while name.lower() in taken:
+            copy += 1
+            name = f'{stem} ({copy}){extension}'
+        taken.add(name.lower())
+        names.append(name)
+    return names
+
+
+class _Entry:
+    def __init__(self, document, name, offset):
+        self.document = document
+        self.name = name.encode('utf-8')
+        self.size = document.file_size
+        self.crc = document.crc32
+        self.offset = offset
+        self.zip64 = self.size >= ZIP64_LIMIT
+        self.time, self.date = _dos_time(document.created_at)
+
+    @property
+    def version(self):
+        return 45 if self.zip64 or self.offset >= ZIP64_LIMIT else 20
+
+    def local_header(self):
+        extra = struct.pack('<HHQQ', 1, 16, 0, 0) if self.zip64 else b''
+        size = ZIP64_LIMIT if self.zip64 else 0
+        return struct.pack(
+            '<IHHHHHIIIHH', 0x04034b50, self.version, FLAGS, 0, self.time, self.date, 0, size, size,
+            len(self.name), len(extra),
+        ) + self.name + extra
+
+    @property
+    def header_size(self):
+        return 30 + len(self.name) + (20 if self.zip64 else 0)
+
+    def descriptor(self):
+        if self.zip64:
+            return struct.pack('<IIQQ', 0x08074b50, self.crc, self.size, self.size)
+        return struct.pack('<IIII', 0x08074b50, self.crc, self.size, self.size)
+
+    @property
+    def descriptor_size(self):
+        return 24 if self.zip64 else 16
+
+    def _central_extra(self):
+        values = [self.size, self.size] if self.zip64 else []
+        if self.offset >= ZIP64_LIMIT:
+            values.append(self.offset)
+        if not values:
+            return b''
+        return struct.pack(f'<HH{len(values)}Q', 1, 8 * len(values), *values)
+
+    def central_header(self):
+        extra = self._central_extra()
+        size = ZIP64_LIMIT if self.zip64 else self.size
+        return struct.pack(
+            '<IHHHHHHIIIHHHHHII', 0x02014b50, (3 << 8) | self.version, self.version, FLAGS, 0,
+            self.time, self.date, self.crc, size, size, len(self.name), len(extra), 0, 0, 0,
+            0o100644 << 16, min(self.offset, ZIP64_LIMIT),
+        ) + self.name + extra
+
+    @property
+    def central_size(self):
+        return 46 + len(self.name) + len(self._central_extra())
+
+
+class Bundle:
+    """The layout of a ZIP archive of ``documents``, in the order given"""
+
+    def __init__(self, documents):
+        self.entries = []
+        offset = 0
+        for document, name in zip(documents, archive_names(documents)):
+            entry = _Entry(document, name, offset)
+            self.entries.append(entry)
+            offset += entry.header_size + entry.size + entry.descriptor_size
+        self.central_offset = offset
+        self.central_size = sum(entry.central_size for entry in self.entries)
+        self.zip64 = (
+            len(self.entries) >= 0xFFFF or self.central_offset >= ZIP64_LIMIT or self.central_size >= ZIP64_LIMIT
+        )
+        self.length = self.central_offset + self.central_size + (56 + 20 if self.zip64 else 0) + 22
+
+    @property
+    def etag(self):
+        """Changes whenever the bytes of the archive could"""
+        layout = hashlib.sha256()
+        for entry in self.entries:
+            layout.update(
+                f'{entry.document.pk}:{entry.document.file}:{entry.size}:{entry.time}:{entry.date}:'.encode()
+                + entry.name + b'\0'
+            )
+        return f'"{layout.hexdigest()[:32]}"'
+
+    def _segments(self):
+        """``(start, length, kind, entry)`` for every part of the archive, in order"""
+        for entry in self.entries:
+            start = entry.offset
+            yield start, entry.header_size, 'header', entry
+            yield start + entry.header_size, entry.size, 'data', entry
+            yield start + entry.header_size + entry.size, entry.descriptor_size, 'descriptor', entry
+        yield self.central_offset, self.length - self.central_offset, 'directory', None
+
+    def iter_bytes(self, start=0, end=None):
+        """Yield the bytes of the archive from ``start`` up to, not including, ``end``"""
+        end = self.length if end is None else min(end, self.length)
+        for segment_start, length, kind, entry in self._segments():
+            segment_end = segment_start + length
+            if segment_end <= start or length == 0:
+                continue
+            if segment_start >= end:
+                return
+            first, last = max(start, segment_start) - segment_start, min(end, segment_end) - segment_start
+            if kind == 'data':
+                yield from self._iter_data(entry, first, last)
+                continue
+            if kind == 'header':
+                content = entry.local_header()
+            elif kind == 'descriptor':
+                self._ensure_crc(entry)
+                content = entry.descriptor()
+            else:
+                content = self._directory()
+            yield content[first:last]
+
+    def _open(self, entry, offset=0):
+        document = entry.document
+        return get_upload_backend().open(document.file.public_id, document.file.version, 'raw', offset)
+
+    def _iter_data(self, entry, first, last):
+        # The CRC can be worked out on the way only when the whole file is sent
+        crc = 0 if entry.crc is None and first == 0 and last == entry.size else None
+        sent = first
+        with self._open(entry, first) as source:
+            while sent < last:
+                block = source.read(min(READ_BLOCK, last - sent))
+                if not block:
+                    raise BundleError(f'{entry.document.pk} is shorter than its recorded size')
+                sent += len(block)
+                if crc is not None:
+                    crc = zlib.crc32(block, crc)
+                yield block
+        if crc is not None:
+            self._remember_crc(entry, crc)
+
+    def _ensure_crc(self, entry):
+        if entry.crc is not None:
+            return
+        crc, read = 0, 0
+        with self._open(entry) as source:
+            while True:
+                block = source.read(READ_BLOCK)
+                if not block:
+                    break
+                read += len(block)
+                crc = zlib.crc32(block, crc)
+        if read != entry.size:
+            raise BundleError(f'{entry.document.pk} has {read} bytes, not {entry.size}')
+        self._remember_crc(entry, crc)
+
+    def _remember_crc(self, entry, crc):
+        entry.crc = entry.document.crc32 = crc
+        Document.objects.filter(pk=entry.document.pk).update(crc32=crc)
+
+    def _directory(self):
+        parts = []
+        for entry in self.entries:
+            self._ensure_crc(entry)
+            parts.append(entry.central_header())
+        count = len(self.entries)
+        if self.zip64:
+            zip64_end = self.central_offset + self.central_size
+            parts.append(struct.pack(
+                '<IQHHIIQQQQ', 0x06064b50, 44, 45, 45, 0, 0, count, count, self.central_size, self.central_offset
+            ))
+            parts.append(struct.pack('<IIQI', 0x07064b50, 0, zip64_end, 1))
+        parts.append(struct.pack(
+            '<IHHHHIIH', 0x06054b50, 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+            min(self.central_size, ZIP64_LIMIT), min(self.central_offset, ZIP64_LIMIT), 0,
+        ))
+        return b''.join(parts)
+
+
+def parse_range(header, length):
+    """``(start, end)`` of a single ``bytes=`` range, None to send everything, or ValueError if unsatisfiable"""
+    match = re.fullmatch(r'bytes=(\d*)-(\d*)', (header or '').strip())
+    if not match or match.groups() == ('', ''):
+        # Absent, malformed or several ranges: the whole archive is sent
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last) + 1, length) if last else length
+        if last and int(last) < start:
+            return None
+    else:
+        start, end = max(length - int(last), 0), length
+    if start >= length or end <= start:
+        raise ValueError('Range not satisfiable')
+    return start, end
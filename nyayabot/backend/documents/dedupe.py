@@ -0,0 +1,65 @@
+"""
+Content-addressed document storage.
+
+Many users upload the same standard documents, so a file's bytes are stored
+once as a ``DocumentBlob`` keyed by their SHA-256 and every ``Document`` with
+those bytes points at it. Titles, privacy and sharing stay on the documents.
+The ``DocumentAnalysis`` of a blob is shared too: a document whose blob was
+already analysed gets its results copied instead of running the pipeline
+again (see :mod:`documents.analysis`).
+
+Whether an upload was deduplicated is never reported to the uploader, so the
+API can't be used to find out what other users have uploaded.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Sum
+
+from nyayabot_backend.storage import get_upload_backend
+from .models import AnalysisJob, Document, DocumentAnalysis, DocumentBlob
+
+
+def blob_public_id(sha256):
+    return f'documents/blobs/{sha256}'
+
+
+def store_blob(path, sha256, size, file_type):
+    """The blob holding the bytes of the file at ``path``, uploading them only if they are new"""
+    blob = DocumentBlob.objects.filter(sha256=sha256).first()
+    if blob:
+        return blob
+    public_id = blob_public_id(sha256)
+    version = get_upload_backend().store(public_id, path, 'raw')
+    try:
+        with transaction.atomic():
+            return DocumentBlob.objects.create(
+                sha256=sha256, file=f'raw/upload/v{version}/{public_id}', size=size, file_type=file_type
+            )
+    except IntegrityError:
+        # Stored concurrently by an identical upload, under the same public ID
+        return DocumentBlob.objects.get(sha256=sha256)
+
+
+def report():
+    """Storage and analysis savings from deduplication"""
+    documents = Document.objects.filter(blob__isnull=False).aggregate(count=Count('id'), bytes=Sum('file_size'))
+    blobs = DocumentBlob.objects.aggregate(count=Count('id'), bytes=Sum('size'))
+    analyses = DocumentAnalysis.objects.filter(blob__isnull=False).aggregate(
+        count=Count('id'), seconds=Sum('processing_time')
+    )
+    reused = AnalysisJob.objects.filter(reused=True, document__blob__analysis__isnull=False).aggregate(
+        count=Count('id'), seconds=Sum('document__blob__analysis__processing_time')
+    )
+
+    logical_bytes, stored_bytes = documents['bytes'] or 0, blobs['bytes'] or 0
+    return {
+        'documents': documents['count'],
+        'blobs': blobs['count'],
+        'logical_bytes': logical_bytes,
+        'stored_bytes': stored_bytes,
+        'bytes_saved': logical_bytes - stored_bytes,
+        'dedupe_ratio': round(logical_bytes / stored_bytes, 3) if stored_bytes else None,
+        'analyses_run': analyses['count'],
+        'analysis_seconds': round(analyses['seconds'] or 0, 3),
+        'analyses_reused': reused['count'],
+        'analysis_seconds_saved': round(reused['seconds'] or 0, 3),
+    }
@@ -0,0 +1,224 @@
+"""
+Rule-based extraction of legal entities from document text.
+
+Dates, rupee amounts, statutory references and named parties follow a few
+regular shapes in Indian legal documents, so they are found with patterns
+compiled once at import. Dates, amounts and references share one
+alternation and are collected in a single pass over the text. Only the
+fields the rules leave empty are asked of the LLM (see
+:mod:`documents.analysis`).
+
+Every entity is returned as it appears in the text together with a
+normalised value: ISO dates, amounts in rupees, and references like
+``Section 420 IPC``. ``normalize`` puts entities found elsewhere (by the
+LLM) into the same shapes, so each field has one schema whatever found it.
+"""
+import re
+from datetime import date
+
+MONTHS = {
+    'jan': 1, 'feb': 2, 'mar': 3, 'apr': 4, 'may': 5, 'jun': 6,
+    'jul': 7, 'aug': 8, 'sep': 9, 'oct': 10, 'nov': 11, 'dec': 12,
+}
+MONTH = (r'(?:jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|aug(?:ust)?|'
+         r'sep(?:t(?:ember)?)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?)\.?')
+DAY = r'(?:[12]\d|3[01]|0?[1-9])(?:st|nd|rd|th)?'
+
+SCALES = {'thousand': 10 ** 3, 'lakh': 10 ** 5, 'lakhs': 10 ** 5, 'lac': 10 ** 5, 'lacs': 10 ** 5,
+          'crore': 10 ** 7, 'crores': 10 ** 7, 'cr': 10 ** 7}
+
+# Short names of the acts most often cited, keyed by their usual abbreviation
+ACTS = {
+    'ipc': 'IPC', 'indian penal code': 'IPC',
+    'crpc': 'CrPC', 'cr.p.c': 'CrPC', 'code of criminal procedure': 'CrPC',
+    'cpc': 'CPC', 'c.p.c': 'CPC', 'code of civil procedure': 'CPC',
+    'bns': 'BNS', 'bharatiya nyaya sanhita': 'BNS',
+    'bnss': 'BNSS', 'bharatiya nagarik suraksha sanhita': 'BNSS',
+    'ni act': 'NI Act', 'negotiable instruments act': 'NI Act',
+    'it act': 'IT Act', 'information technology act': 'IT Act',
+    'evidence act': 'Evidence Act', 'indian evidence act': 'Evidence Act',
+    'hindu marriage act': 'Hindu Marriage Act',
+    'consumer protection act': 'Consumer Protection Act',
+    'transfer of property act': 'Transfer of Property Act',
+}
+ACT = (r'(?:i\.?p\.?c|cr\.?p\.?c|c\.?p\.?c|bnss|bns|n\.?i\.?\s+act|i\.?t\.?\s+act|'
+       r'(?:(?:the|of)\s+)*(?-i:(?:[A-Z][a-z]+\s+){1,5}(?:Act|Code|Sanhita))(?:,?\s+\d{4})?)')
+
+ENTITY = re.compile(
+    # Entities start a word with one of these characters; checking that first
+    # lets the scanner skip most positions cheaply
+    r'(?<!\w)(?=[0-9₹rsiuaojfmnd])(?:'
+    # 12/03/2023, 12-03-23, 12.03.2023 (day first, as written in India)
+    rf'(?P<numeric_date>\b(?P<nd>[12]\d|3[01]|0?[1-9])[/.-](?P<nm>1[0-2]|0?[1-9])[/.-](?P<ny>(?:19|20)\d{{2}}|\d{{2}})\b)'
+    # 12th March 2023, 12 Mar, 2023, 12th day of March, 2023
+    rf'|(?P<day_first>\b(?P<dd>{DAY})(?:\s+day\s+of)?\s+(?P<dm>{MONTH}),?\s+(?P<dy>(?:19|20)\d{{2}})\b)'
+    # March 12, 2023
+    rf'|(?P<month_first>\b(?P<mm>{MONTH})\s+(?P<md>{DAY}),?\s+(?P<my>(?:19|20)\d{{2}})\b)'
+    # ₹ 5,00,000/-, Rs. 1.5 lakh, INR 2 crores
+    r'|(?P<amount>(?:₹|\brs\.?|\binr\b|\brupees\b)\s*(?P<figure>\d[\d,]*(?:\.\d+)?)(?:\s*/-)?'
+    r'(?:\s*(?P<scale>thousand|lakhs?|lacs?|crores?|cr)\b)?)'
+    # Section 420 IPC, Sec. 138 of the Negotiable Instruments Act, 1881, u/s 498A IPC
+    rf'|(?P<section>\b(?:sections?|secs?\.?|u/s\.?|s\.)\s*(?P<number>\d+[A-Z]{{0,2}}(?:\s*\(\d+\))?)'
+    rf'(?:\s+(?:of\s+(?:the\s+)?)?(?P<act>{ACT}))?)'
+    # Article 21, Art. 14 of the Constitution
+    r'|(?P<article>\b(?:articles?|art\.)\s*(?P<article_number>\d+[A-Z]?(?:\s*\(\d+\))?))'
+    # Order VII Rule 11 CPC
+    r'|(?P<order>\border\s+(?P<order_number>[IVXL]+|\d+)\s+rule\s+(?P<rule>\d+[A-Z]?)(?:\s+(?P<order_act>c\.?p\.?c))?))',
+    re.IGNORECASE,
+)
+
+HONORIFIC = r'(?:Mr|Mrs|Ms|Dr|Shri|Sri|Smt|Kumari|Km|M/s)\.?'
+NAME = r"[A-Z][A-Za-z.'-]*(?:[ ]+[A-Z][A-Za-z.'-]*){0,4}"
+CANDIDATE = re.compile(rf'\b(?:{HONORIFIC}[ ]+)?{NAME}')
+# (hereinafter referred to as the "Landlord"); the party is named just before it
+HEREINAFTER = re.compile(
+    r"\(\s*hereinafter\s+(?:called|referred\s+to\s+as)\s+(?:the\s+)?[\"'“‘]?(?P<role>[A-Za-z]+)", re.IGNORECASE
+)
+CLAUSE_START = re.compile(r'.*(?:\bbetween\b|\band\b|[\n;:])', re.DOTALL)
+PARTY = re.compile(
+    r'(?<!\w)(?=[A-Z])(?:'
+    # Petitioner: Ramesh Kumar
+    r'\b(?P<label>Petitioner|Respondent|Plaintiff|Defendant|Complainant|Accused|Appellant|Applicant'
+    r'|Landlord|Lessor|Tenant|Lessee|Licensor|Licensee|Employer|Employee|Buyer|Seller|Vendor|Purchaser)'
+    rf's?[ ]*(?:no\.[ ]*\d+[ ]*)?[:\-–][ ]*(?P<labelled>(?:{HONORIFIC}[ ]+)?{NAME})'
+    # Shri Ramesh Kumar
+    rf'|(?P<honoured>\b{HONORIFIC}[ ]+{NAME}))'
+)
+
+
+def _year(value):
+    year = int(value)
+    if year >= 100:
+        return year
+    # Two-digit years: 50-99 are 1950-1999, 00-49 are 2000-2049
+    return year + (1900 if year >= 50 else 2000)
+
+
+def _iso_date(match):
+    try:
+        if match['numeric_date']:
+            return date(_year(match['ny']), int(match['nm']), int(match['nd'])).isoformat()
+        if match['day_first']:
+            return date(int(match['dy']), MONTHS[match['dm'][:3].lower()], int(re.sub(r'\D', '', match['dd']))).isoformat()
+        return date(int(match['my']), MONTHS[match['mm'][:3].lower()], int(re.sub(r'\D', '', match['md']))).isoformat()
+    except ValueError:
+        # 31/02/2023 and the like
+        return None
+
+
+def _rupees(match):
+    value = float(match['figure'].replace(',', ''))
+    if match['scale']:
+        value *= SCALES[match['scale'].lower()]
+    return int(value) if value == int(value) else value
+
+
+def _act(value):
+    value = re.sub(r'\s+', ' ', value).strip(' ,')
+    key = re.sub(r'^(?:(?:the|of) )+', '', value.lower()).replace('.', '')
+    key = re.sub(r',? \d{4}$', '', key)
+    return ACTS.get(key) or ACTS.get(key.replace(' ', '')) or re.sub(r'^(?:(?:the|of) )+', '', value, flags=re.I)
+
+
+def _compact(value):
+    return re.sub(r'\s+', '', value)
+
+
+def _reference(match):
+    if match['section']:
+        reference = f"Section {_compact(match['number'])}"
+        return f"{reference} {_act(match['act'])}" if match['act'] else reference
+    if match['article']:
+        return f"Article {_compact(match['article_number'])}"
+    reference = f"Order {match['order_number'].upper()} Rule {match['rule']}"
+    return f'{reference} CPC' if match['order_act'] else reference
+
+
+def extract(text):
+    """Entities of one text, keyed by the ``DocumentAnalysis`` field they belong in"""
+    dates, amounts, references, seen = [], [], [], set()
+    for match in ENTITY.finditer(text):
+        matched = match.group(0)
+        if match['amount']:
+            entity = ('amount', _rupees(match))
+            if entity not in seen:
+                amounts.append({'text': matched.strip(), 'rupees': entity[1]})
+        elif match['section'] or match['article'] or match['order']:
+            entity = ('reference', _reference(match))
+            if entity not in seen:
+                references.append(entity[1])
+        else:
+            entity = ('date', _iso_date(match))
+            if entity[1] is None:
+                continue
+            if entity not in seen:
+                dates.append({'text': matched, 'date': entity[1]})
+        seen.add(entity)
+
+    found = []
+    for match in HEREINAFTER.finditer(text):
+        window = text[max(match.start() - 200, 0):match.start()]
+        clause = CLAUSE_START.match(window)
+        name = CANDIDATE.search(window, clause.end() if clause else 0)
+        if name:
+            found.append((name.start() + match.start() - len(window), name.group(0), match['role']))
+    for match in PARTY.finditer(text):
+        found.append((match.start(), match['labelled'] or match['honoured'], match['label']))
+
+    parties, by_name = [], {}
+    for _, name, role in sorted(found, key=lambda party: party[0]):
+        name = name.strip(' .,')
+        role = role.capitalize() if role else None
+        party = by_name.get(name.lower())
+        if party is None:
+            party = by_name[name.lower()] = {'name': name, 'role': role}
+            parties.append(party)
+        elif role and not party['role']:
+            party['role'] = role
+
+    return {
+        'important_dates': dates,
+        'monetary_amounts': amounts,
+        'legal_references': references,
+        'parties_involved': parties,
+    }
+
+
+# Fields whose entities are objects, with the key of their text and of their value
+ENTITY_KEYS = {
+    'important_dates': ('text', 'date'),
+    'monetary_amounts': ('text', 'rupees'),
+    'parties_involved': ('name', 'role'),
+}
+
+
+def _entity(field, text):
+    """An entity given only as a string, parsed with the rules where they can"""
+    label, value = ENTITY_KEYS[field]
+    if field == 'important_dates':
+        try:
+            return {label: text, value: date.fromisoformat(text).isoformat()}
+        except ValueError:
+            pass
+    found = extract(text)[field] if field != 'parties_involved' else []
+    return {label: text, value: found[0][value] if found else None}
+
+
+def normalize(fields):
+    """A copy of ``fields`` with its entity lists in the shapes ``extract`` returns"""
+    normalized = dict(fields)
+    for field, (label, value) in ENTITY_KEYS.items():
+        items = fields.get(field)
+        if not isinstance(items, list):
+            continue
+        normalized[field] = [
+            {label: item.get(label), value: item.get(value)} if isinstance(item, dict) else _entity(field, str(item))
+            for item in items
+        ]
+    return normalized
+
+
+def extract_many(texts):
+    """``extract`` over an iterable of texts, yielding one result per text"""
+    for text in texts:
+        yield extract(text)
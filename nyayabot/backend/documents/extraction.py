@@ -0,0 +1,203 @@
+"""
+Page-by-page text extraction from stored documents.
+
+Only the standard library is used. ``iter_pages`` reads a file sequentially
+and yields ``(position, text)`` for every page, where ``position`` can be
+passed back as ``start`` to resume after that page:
+
+* PDFs are scanned object by object in ``READ_BLOCK`` reads. Every content
+  stream (uncompressed or ``FlateDecode``) is a page, and its text is the
+  strings shown with the ``Tj``/``TJ``/``'``/``"`` operators. Images, fonts
+  and other streams with a direct ``/Length`` are skipped without being
+  buffered, so memory is bounded by the largest content stream rather than
+  the file. Content streams are taken in file order, which is page order for
+  the files produced by common writers. The position is a byte offset.
+* ``.docx`` files yield one paragraph of ``word/document.xml`` at a time,
+  parsed incrementally. The position is a paragraph count.
+
+Scanned pages have no text layer and yield empty text; images yield nothing.
+"""
+import re
+import tempfile
+import zipfile
+import zlib
+from xml.etree import ElementTree
+
+READ_BLOCK = 1024 * 1024
+MAX_CARRY = 64 * 1024  # bytes kept between reads while no stream is in sight
+
+STREAM_START = re.compile(rb'>>\s*stream\r?\n')
+DIRECT_LENGTH = re.compile(rb'/Length\s+(\d+)(?!\s+\d+\s+R)')
+NOT_CONTENT = re.compile(rb'/(?:Subtype|Length1|Length2|Length3)\b|/Type\s*/(?:XRef|ObjStm|Metadata|EmbeddedFile)\b')
+TEXT_TOKEN = re.compile(rb'\((?:[^()\\]|\\.|\((?:[^()\\]|\\.)*\))*\)|\[(?:[^\]\\]|\\.)*\]|T\*|Tj|TJ|Td|TD|ET|\'|"')
+STRING = re.compile(rb'\(((?:[^()\\]|\\.|\((?:[^()\\]|\\.)*\))*)\)', re.S)
+ESCAPE = re.compile(rb'\\([0-7]{1,3}|.)', re.S)
+ESCAPES = {b'n': b'\n', b'r': b'\r', b't': b'\t', b'b': b'\b', b'f': b'\f'}
+
+WORD_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+# Letters of each script, for detecting the language of Indian documents
+SCRIPTS = {
+    'en': re.compile('[A-Za-z]'),
+    'hi': re.compile('[ऀ-ॿ]'),
+    'bn': re.compile('[ঀ-৿]'),
+    'pa': re.compile('[਀-੿]'),
+    'gu': re.compile('[઀-૿]'),
+    'or': re.compile('[଀-୿]'),
+    'ta': re.compile('[஀-௿]'),
+    'te': re.compile('[ఀ-౿]'),
+    'kn': re.compile('[ಀ-೿]'),
+    'ml': re.compile('[ഀ-ൿ]'),
+    'ur': re.compile('[؀-ۿ]'),
+}
+
+
+def _unescape(match):
+    value = match.group(1)
+    if value[:1].isdigit():
+        return bytes([int(value, 8) & 0xFF])
+    return ESCAPES.get(value, value if value != b'\n' else b'')
+
+
+def _decode_string(raw):
+    return ESCAPE.sub(_unescape, raw).decode('latin-1')
+
+
+def _content_text(content):
+    """Text shown by the operators of one PDF content stream"""
+    lines, line, pending = [], [], []
+    for token in TEXT_TOKEN.findall(content):
+        if token.startswith((b'(', b'[')):
+            pending.append(token)
+        elif token in (b'Tj', b'TJ', b"'", b'"'):
+            if token in (b"'", b'"') and line:
+                lines.append(''.join(line))
+                line = []
+            for operand in pending:
+                line.extend(_decode_string(value) for value in STRING.findall(operand))
+            pending = []
+        else:
+            # T*, Td, TD and ET move to another line
+            pending = []
+            if line:
+                lines.append(''.join(line))
+                line = []
+    if line:
+        lines.append(''.join(line))
+    return '\n'.join(lines)
+
+
+def _stream_text(dictionary, body):
+    """Text of a content stream, or None for a stream that can't be decoded"""
+    if b'/FlateDecode' in dictionary:
+        try:
+            body = zlib.decompress(body)
+        except zlib.error:
+            return None
+    elif b'/Filter' in dictionary:
+        return None
+    return _content_text(body)
+
+
+def _skip(source, count):
+    if source.seekable():
+        source.seek(count, 1)
+        return
+    while count:
+        block = source.read(min(READ_BLOCK, count))
+        if not block:
+            return
+        count -= len(block)
+
+
+def iter_pdf_pages(source, start=0):
+    _skip(source, start)
+    position = start  # file offset of buffer[0]
+    buffer = bytearray()
+    eof = False
+    while True:
+        match = STREAM_START.search(buffer)
+        if match:
+            dictionary = bytes(buffer[max(buffer.rfind(b'obj', 0, match.start()), 0):match.start() + 2])
+            body_start = match.end()
+            length = DIRECT_LENGTH.search(dictionary)
+            skipped = NOT_CONTENT.search(dictionary)
+            if length:
+                end = body_start + int(length.group(1))
+                if skipped and end > len(buffer):
+                    # Don't buffer images and fonts just to throw them away
+                    _skip(source, end - len(buffer))
+                    position += end
+                    buffer.clear()
+                    continue
+            else:
+                end = buffer.find(b'endstream', body_start)
+                end = len(buffer) + 1 if end == -1 else end
+            if end <= len(buffer):
+                body = bytes(buffer[body_start:end])
+                position += end
+                del buffer[:end]
+                text = None if skipped else _stream_text(dictionary, body)
+                if text is not None:
+                    yield position, text
+                continue
+        elif len(buffer) > MAX_CARRY:
+            position += len(buffer) - MAX_CARRY
+            del buffer[:len(buffer) - MAX_CARRY]
+
+        if eof:
+            return
+        block = source.read(READ_BLOCK)
+        if block:
+            buffer += block
+        else:
+            eof = True
+
+
+def _seekable(source):
+    if source.seekable():
+        return source
+    # zipfile needs to seek to the central directory
+    spooled = tempfile.SpooledTemporaryFile(max_size=READ_BLOCK)
+    while True:
+        block = source.read(READ_BLOCK)
+        if not block:
+            break
+        spooled.write(block)
+    spooled.seek(0)
+    return spooled
+
+
+def iter_docx_pages(source, start=0):
+    with zipfile.ZipFile(_seekable(source)) as archive, archive.open('word/document.xml') as document:
+        position = 0
+        for _, element in ElementTree.iterparse(document):
+            if element.tag != f'{WORD_NS}p':
+                continue
+            position += 1
+            if position > start:
+                yield position, ''.join(node.text or '' for node in element.iter(f'{WORD_NS}t'))
+            element.clear()
+
+
+def iter_pages(source, file_type, start=0):
+    """Yield ``(position, text)`` for each page of a binary file object of type ``Document.file_type``"""
+    if file_type == 'pdf':
+        return iter_pdf_pages(source, start)
+    if file_type == 'docx':
+        return iter_docx_pages(source, start)
+    return iter(())
+
+
+def count_scripts(text, counts):
+    """Add the letters of ``text`` in each script of ``SCRIPTS`` to ``counts``"""
+    for language, letters in SCRIPTS.items():
+        found = len(letters.findall(text))
+        if found:
+            counts[language] = counts.get(language, 0) + found
+    return counts
+
+
+def detect_language(counts, default='en'):
+    """The language whose script has the most letters"""
+    return max(counts, key=counts.get) if counts else default
@@ -0,0 +1,30 @@
+import zlib
+
+from django.db import models
+
+COMPRESSION_LEVEL = 6
+
+
+class CompressedTextField(models.BinaryField):
+    """Text stored zlib-compressed in a binary column; reads and writes ``str``.
+
+    Extracted legal text compresses several times over, and as a binary
+    column it is never worth selecting by accident: load it with ``only()``
+    or ``values_list()`` where it is actually needed.
+    """
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return None
+        return zlib.decompress(value).decode('utf-8')
+
+    def to_python(self, value):
+        return value
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if isinstance(value, str):
+            value = zlib.compress(value.encode('utf-8'), COMPRESSION_LEVEL)
+        return super().get_db_prep_value(value, connection, prepared)
+
+    def value_to_string(self, obj):
+        return self.value_from_object(obj)
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from documents.dedupe import report
+
+
+class Command(BaseCommand):
+    help = 'Report storage and analysis savings from content-hash deduplication of documents'
+
+    def handle(self, *args, **options):
+        stats = report()
+        self.stdout.write(f"{stats['documents']} documents stored as {stats['blobs']} blobs")
+        self.stdout.write(
+            f"{stats['logical_bytes']} bytes uploaded, {stats['stored_bytes']} stored "
+            f"(dedupe ratio {stats['dedupe_ratio']}, {stats['bytes_saved']} bytes saved)"
+        )
+        self.stdout.write(
+            f"{stats['analyses_run']} analyses run in {stats['analysis_seconds']}s, "
+            f"{stats['analyses_reused']} reused, saving {stats['analysis_seconds_saved']}s"
+        )
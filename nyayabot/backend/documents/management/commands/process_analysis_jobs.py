@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from documents.analysis import process_due_jobs
+
+
+class Command(BaseCommand):
+    help = 'Run due document analysis retries and jobs left behind by a stopped worker'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep running, checking every --interval seconds')
+        parser.add_argument('--interval', type=int, default=60)
+        parser.add_argument('--limit', type=int, default=None)
+
+    def handle(self, *args, **options):
+        while True:
+            jobs = [job for job in process_due_jobs(limit=options['limit']) if job]
+            completed = sum(job.status == 'completed' for job in jobs)
+            self.stdout.write(f'Ran {len(jobs)} analysis jobs, {completed} completed')
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from documents.uploads import purge_expired_sessions
+
+
+class Command(BaseCommand):
+    help = 'Abort expired chunked uploads and delete their temporary files'
+
+    def handle(self, *args, **options):
+        purged = purge_expired_sessions()
+        self.stdout.write(f'Purged {purged} expired upload(s)')
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from documents.access import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Recompute the materialized document permissions from shares, lawyer lists and appointments'
+
+    def handle(self, *args, **options):
+        changed = rebuild()
+        self.stdout.write(f'Updated {changed} document access rows')
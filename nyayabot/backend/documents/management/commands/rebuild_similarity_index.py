@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from documents.similarity import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Recompute the MinHash signatures and LSH buckets of every analysed document'
+
+    def handle(self, *args, **options):
+        indexed = rebuild_index()
+        self.stdout.write(f'Indexed {indexed} documents')
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.7 on 2026-10-19 04:08
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('documents', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('filename', models.CharField(max_length=255)),
+                ('title', models.CharField(max_length=200)),
+                ('description', models.TextField(blank=True, null=True)),
+                ('document_type', models.CharField(choices=[('legal_notice', 'Legal Notice'), ('contract', 'Contract'), ('court_order', 'Court Order'), ('complaint', 'Complaint'), ('affidavit', 'Affidavit'), ('agreement', 'Agreement'), ('lease_deed', 'Lease Deed'), ('property_document', 'Property Document'), ('identity_proof', 'Identity Proof'), ('income_proof', 'Income Proof'), ('medical_report', 'Medical Report'), ('police_report', 'Police Report'), ('other', 'Other')], default='other', max_length=20)),
+                ('privacy_level', models.CharField(choices=[('private', 'Private'), ('shared_with_lawyer', 'Shared with Lawyer'), ('public', 'Public')], default='private', max_length=20)),
+                ('total_size', models.PositiveBigIntegerField()),
+                ('received_bytes', models.PositiveBigIntegerField(default=0)),
+                ('file_type', models.CharField(blank=True, max_length=10)),
+                ('sha256', models.CharField(blank=True, max_length=64)),
+                ('status', models.CharField(choices=[('active', 'Active'), ('completed', 'Completed'), ('aborted', 'Aborted')], default='active', max_length=10)),
+                ('expires_at', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('document', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='upload_session', to='documents.document')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='upload_sessions', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
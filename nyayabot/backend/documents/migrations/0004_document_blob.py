@@ -0,0 +1,46 @@
+# Generated by Django 4.2.7 on 2026-10-19 04:14
+
+import cloudinary.models
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0003_analysis_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True)),
+                ('file', cloudinary.models.CloudinaryField(max_length=255, verbose_name='raw')),
+                ('size', models.PositiveBigIntegerField()),
+                ('file_type', models.CharField(max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='analysisjob',
+            name='reused',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterField(
+            model_name='documentanalysis',
+            name='document',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='analysis', to='documents.document'),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='documents', to='documents.documentblob'),
+        ),
+        migrations.AddField(
+            model_name='documentanalysis',
+            name='blob',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='analysis', to='documents.documentblob'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-19 04:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0004_document_blob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysisjob',
+            name='checkpoint',
+            field=models.JSONField(default=dict),
+        ),
+    ]
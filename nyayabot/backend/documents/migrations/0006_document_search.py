@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-19 09:12
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0005_analysis_checkpoint'),
+    ]
+
+    operations = [
+        # Full-text index of documents; the rowid is the document id (see documents/search.py)
+        migrations.RunSQL(
+            sql=[
+                "CREATE VIRTUAL TABLE documents_search USING fts5("
+                "title, description, body, tokenize = 'porter unicode61 remove_diacritics 2')",
+                "INSERT INTO documents_search (rowid, title, description, body) "
+                "SELECT id, title, COALESCE(description, ''), COALESCE(ai_extracted_text, '') FROM documents_document",
+            ],
+            reverse_sql="DROP TABLE documents_search",
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 4.2.7 on 2026-10-19 04:25
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+RANK = {'view': 1, 'comment': 2, 'edit': 3, 'owner': 4}
+
+
+def populate_access(apps, schema_editor):
+    # Same rules as documents.access.computed_access, on the historical models
+    Document = apps.get_model('documents', 'Document')
+    DocumentShare = apps.get_model('documents', 'DocumentShare')
+    DocumentAccess = apps.get_model('documents', 'DocumentAccess')
+    Appointment = apps.get_model('appointments', 'Appointment')
+
+    access = {}
+
+    def grant(document_id, user_id, permission):
+        current = access.get((document_id, user_id))
+        if current is None or RANK[permission] > RANK[current]:
+            access[document_id, user_id] = permission
+
+    for document_id, owner_id in Document.objects.values_list('id', 'user_id'):
+        grant(document_id, owner_id, 'owner')
+    shared = Document.objects.filter(privacy_level='shared_with_lawyer').values('id')
+    for document_id, user_id in Document.shared_with_lawyers.through.objects.filter(
+        document_id__in=shared
+    ).values_list('document_id', 'user_id'):
+        grant(document_id, user_id, 'view')
+    for document_id, user_id, permission in DocumentShare.objects.filter(
+        document_id__in=shared, is_revoked=False
+    ).values_list('document_id', 'shared_with_id', 'permission_level'):
+        grant(document_id, user_id, permission)
+    for document_id, user_id in Appointment.documents_shared.through.objects.filter(
+        document_id__in=shared
+    ).values_list('document_id', 'appointment__lawyer_id'):
+        grant(document_id, user_id, 'view')
+
+    DocumentAccess.objects.bulk_create(
+        [DocumentAccess(document_id=document_id, user_id=user_id, permission=permission)
+         for (document_id, user_id), permission in access.items()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('appointments', '0002_initial'),
+        ('documents', '0006_document_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentAccess',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('permission', models.CharField(choices=[('view', 'View Only'), ('comment', 'View and Comment'), ('edit', 'View and Edit'), ('owner', 'Owner')], max_length=10)),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='access', to='documents.document')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='document_access', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'permission'], name='documents_d_user_id_2d3e73_idx')],
+                'unique_together': {('document', 'user')},
+            },
+        ),
+        migrations.RunPython(populate_access, migrations.RunPython.noop),
+    ]
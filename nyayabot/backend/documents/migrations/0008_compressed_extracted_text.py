@@ -0,0 +1,60 @@
+# Generated by Django 4.2.7 on 2026-10-19 10:02
+
+from django.db import migrations
+
+import documents.fields
+
+BATCH = 200
+
+
+def compress_texts(apps, schema_editor):
+    DocumentAnalysis = apps.get_model('documents', 'DocumentAnalysis')
+    Document = apps.get_model('documents', 'Document')
+    for analysis in DocumentAnalysis.objects.only('id', 'extracted_text').iterator(chunk_size=BATCH):
+        DocumentAnalysis.objects.filter(pk=analysis.pk).update(compressed_text=analysis.extracted_text or '')
+    # Analysed documents keep their text in the analysis; this only covers rows that lost theirs
+    for document in Document.objects.filter(ai_extracted_text__gt='').only(
+        'id', 'blob_id', 'ai_extracted_text'
+    ).iterator(chunk_size=BATCH):
+        key = {'blob_id': document.blob_id} if document.blob_id else {'document_id': document.pk}
+        DocumentAnalysis.objects.filter(compressed_text='', **key).update(compressed_text=document.ai_extracted_text)
+
+
+def decompress_texts(apps, schema_editor):
+    DocumentAnalysis = apps.get_model('documents', 'DocumentAnalysis')
+    for analysis in DocumentAnalysis.objects.only('id', 'compressed_text').iterator(chunk_size=BATCH):
+        DocumentAnalysis.objects.filter(pk=analysis.pk).update(extracted_text=analysis.compressed_text or '')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0007_document_access'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentanalysis',
+            name='compressed_text',
+            field=documents.fields.CompressedTextField(null=True),
+        ),
+        migrations.RunPython(compress_texts, decompress_texts),
+        migrations.RemoveField(
+            model_name='documentanalysis',
+            name='extracted_text',
+        ),
+        migrations.RenameField(
+            model_name='documentanalysis',
+            old_name='compressed_text',
+            new_name='extracted_text',
+        ),
+        migrations.AlterField(
+            model_name='documentanalysis',
+            name='extracted_text',
+            field=documents.fields.CompressedTextField(),
+        ),
+        migrations.RemoveField(
+            model_name='document',
+            name='ai_extracted_text',
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-19 04:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0008_compressed_extracted_text'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='crc32',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+    ]
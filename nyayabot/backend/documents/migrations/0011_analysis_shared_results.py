@@ -0,0 +1,28 @@
+# Generated by Django 4.2.7 on 2026-10-19 05:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0010_similarity_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentanalysis',
+            name='key_points',
+            field=models.JSONField(default=list),
+        ),
+        migrations.AddField(
+            model_name='documentanalysis',
+            name='legal_issues',
+            field=models.JSONField(default=list),
+        ),
+        migrations.AddField(
+            model_name='documentanalysis',
+            name='summary',
+            field=models.TextField(blank=True, null=True),
+        ),
+    ]
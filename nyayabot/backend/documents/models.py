@@ -1,6 +1,8 @@
+import uuid
 from django.db import models
 from django.conf import settings
 from cloudinary.models import CloudinaryField
+from .fields import CompressedTextField
 
 class Document(models.Model):
     DOCUMENT_TYPE_CHOICES = [
@@ -33,11 +35,12 @@ class Document(models.Model):
     file_size = models.PositiveIntegerField(help_text="File size in bytes")
     file_type = models.CharField(max_length=10)  # pdf, doc, jpg, etc.
     privacy_level = models.CharField(max_length=20, choices=PRIVACY_CHOICES, default='private')
+    blob = models.ForeignKey('DocumentBlob', on_delete=models.PROTECT, null=True, blank=True, related_name='documents')
+    crc32 = models.PositiveBigIntegerField(blank=True, null=True)  # of the stored file, filled in by documents/bundles.py
     
     # AI Analysis
     is_analyzed = models.BooleanField(default=False)
     ai_summary = models.TextField(blank=True, null=True)
-    ai_extracted_text = models.TextField(blank=True, null=True)
     ai_key_points = models.JSONField(default=list, blank=True)
     ai_legal_issues = models.JSONField(default=list, blank=True)
     ai_confidence_score = models.FloatField(blank=True, null=True)
@@ -55,13 +58,32 @@ class Document(models.Model):
     
     def __str__(self):
         return f"{self.title} - {self.user.username}"
+    
+    def stored_analysis(self):
+        """The ``DocumentAnalysis`` holding this document's results and extracted text, as a queryset"""
+        if self.blob_id:
+            return DocumentAnalysis.objects.filter(blob_id=self.blob_id)
+        return DocumentAnalysis.objects.filter(document_id=self.pk)
+
+class DocumentBlob(models.Model):
+    """Stored file contents, shared by every document with the same bytes"""
+    sha256 = models.CharField(max_length=64, unique=True)
+    file = CloudinaryField('raw')
+    size = models.PositiveBigIntegerField()
+    file_type = models.CharField(max_length=10)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"{self.sha256[:12]} ({self.size} bytes)"
 
 class DocumentAnalysis(models.Model):
     """Detailed AI analysis of documents"""
-    document = models.OneToOneField(Document, on_delete=models.CASCADE, related_name='analysis')
+    # The document that was analysed; the result belongs to its blob and is shared by identical documents
+    document = models.OneToOneField(Document, on_delete=models.SET_NULL, null=True, blank=True, related_name='analysis')
+    blob = models.OneToOneField(DocumentBlob, on_delete=models.CASCADE, null=True, blank=True, related_name='analysis')
     
-    # Text extraction and processing
-    extracted_text = models.TextField()
+    # Text extraction and processing; the only copy of the extracted text
+    extracted_text = CompressedTextField()
     word_count = models.PositiveIntegerField(default=0)
     language_detected = models.CharField(max_length=10, default='en')
     
@@ -86,13 +108,19 @@ class DocumentAnalysis(models.Model):
     
     # AI processing metadata
     processing_time = models.FloatField()
+    stage_timings = models.JSONField(default=dict)  # seconds per pipeline stage
     ai_model_used = models.CharField(max_length=50)
     confidence_score = models.FloatField()
     
+    # Results copied onto every document of the blob; null on analyses made before they were kept here
+    summary = models.TextField(blank=True, null=True)
+    key_points = models.JSONField(default=list)
+    legal_issues = models.JSONField(default=list)
+    
     created_at = models.DateTimeField(auto_now_add=True)
     
     def __str__(self):
-        return f"Analysis of {self.document.title}"
+        return f"Analysis of {self.document.title if self.document else self.blob}"
 
 class DocumentShare(models.Model):
     """Track document sharing between users and lawyers"""
@@ -119,6 +147,39 @@ class DocumentShare(models.Model):
     def __str__(self):
         return f"{self.document.title} shared with {self.shared_with.username}"
 
+class DocumentAccess(models.Model):
+    """Materialized permission of one user on one document, maintained by documents/access.py"""
+    PERMISSION_CHOICES = DocumentShare.PERMISSION_CHOICES + [('owner', 'Owner')]
+    
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='access')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='document_access')
+    permission = models.CharField(max_length=10, choices=PERMISSION_CHOICES)
+    
+    class Meta:
+        unique_together = ['document', 'user']
+        indexes = [models.Index(fields=['user', 'permission'])]
+    
+    def __str__(self):
+        return f"{self.user_id} may {self.permission} document {self.document_id}"
+
+class DocumentSignature(models.Model):
+    """MinHash signature of a document's extracted text, see documents/similarity.py"""
+    document = models.OneToOneField(Document, on_delete=models.CASCADE, related_name='signature')
+    minhash = models.BinaryField()  # low 16 bits of each of the NUM_PERM minimum hashes
+    shingle_count = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"Signature of document {self.document_id}"
+
+class SimilarityBucket(models.Model):
+    """LSH bucket of one band of a document's signature"""
+    key = models.BigIntegerField(db_index=True)  # hash of the band number and its minimum hashes
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='similarity_buckets')
+    
+    def __str__(self):
+        return f"Document {self.document_id} in bucket {self.key}"
+
 class DocumentComment(models.Model):
     """Comments on documents by lawyers or users"""
     document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='comments')
@@ -132,3 +193,73 @@ class DocumentComment(models.Model):
     
     def __str__(self):
         return f"Comment by {self.user.username} on {self.document.title}"
+
+class UploadSession(models.Model):
+    """A resumable, chunked upload that becomes a ``Document`` once complete"""
+    STATUS_CHOICES = [
+        ('active', 'Active'),
+        ('completed', 'Completed'),
+        ('aborted', 'Aborted'),
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='upload_sessions')
+    
+    # Document fields applied at completion
+    filename = models.CharField(max_length=255)
+    title = models.CharField(max_length=200)
+    description = models.TextField(blank=True, null=True)
+    document_type = models.CharField(max_length=20, choices=Document.DOCUMENT_TYPE_CHOICES, default='other')
+    privacy_level = models.CharField(max_length=20, choices=Document.PRIVACY_CHOICES, default='private')
+    
+    total_size = models.PositiveBigIntegerField()
+    received_bytes = models.PositiveBigIntegerField(default=0)
+    file_type = models.CharField(max_length=10, blank=True)  # detected from the first bytes
+    sha256 = models.CharField(max_length=64, blank=True)
+    
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='active')
+    document = models.OneToOneField(Document, on_delete=models.SET_NULL, null=True, blank=True, related_name='upload_session')
+    expires_at = models.DateTimeField()
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Upload of {self.filename} by {self.user.username} ({self.received_bytes}/{self.total_size})"
+
+class AnalysisJob(models.Model):
+    """A background run of the document analysis pipeline"""
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+    
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='analysis_jobs')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    stage = models.CharField(max_length=20, blank=True)  # stage running or last failed
+    
+    # Output and duration of every completed stage; a retry skips these
+    results = models.JSONField(default=dict)
+    timings = models.JSONField(default=dict)
+    checkpoint = models.JSONField(default=dict)  # progress within an unfinished stage
+    
+    attempts = models.PositiveIntegerField(default=0)
+    reused = models.BooleanField(default=False)  # completed from the analysis of an identical document
+    error = models.TextField(blank=True)
+    run_after = models.DateTimeField(blank=True, null=True)
+    claimed_at = models.DateTimeField(blank=True, null=True)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'run_after']),
+        ]
+    
+    def __str__(self):
+        return f"Analysis of {self.document.title} ({self.status})"
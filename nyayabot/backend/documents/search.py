@@ -0,0 +1,108 @@
+"""
+Full-text search over documents.
+
+Titles, descriptions and extracted text are indexed in the SQLite FTS5 table
+``documents_search``, whose rowid is the document id. A document is
+(re)indexed when it is saved and when its analysis completes, and removed
+when it is deleted. Saves only rewrite the title and description, so the
+compressed extracted text is read back only for documents not yet indexed.
+
+Results are ranked with BM25, weighting title matches over description
+matches over body matches. Access rules are part of the query
+(:func:`documents.access.readable_by`), so only documents the user may read
+are ever matched, counted or paged.
+"""
+import re
+
+from django.db import connection
+
+from .access import readable_by
+from .models import Document, DocumentAnalysis
+
+TERM = re.compile(r'"([^"]+)"|(\w+)')
+# BM25 weights of the title, description and body columns
+WEIGHTS = (10.0, 4.0, 1.0)
+SNIPPET_TOKENS = 16
+REBUILD_BATCH = 200
+
+
+def match_expression(query):
+    """Turn free text into an FTS5 query: every word or "quoted phrase" must match"""
+    terms = []
+    for phrase, word in TERM.findall(query):
+        words = re.findall(r'\w+', phrase or word)
+        if words:
+            terms.append('"{}"'.format(' '.join(words)))
+    return ' '.join(terms)
+
+
+def index_document(document_id, body=None):
+    """Index a document, keeping its indexed text unless a new ``body`` is given"""
+    document = Document.objects.filter(pk=document_id).only('id', 'title', 'description', 'blob_id').first()
+    if document is None:
+        unindex_document(document_id)
+        return
+    with connection.cursor() as cursor:
+        if body is None:
+            cursor.execute(
+                'UPDATE documents_search SET title = %s, description = %s WHERE rowid = %s',
+                [document.title, document.description or '', document_id],
+            )
+            if cursor.rowcount:
+                return
+            body = document.stored_analysis().values_list('extracted_text', flat=True).first()
+        cursor.execute('DELETE FROM documents_search WHERE rowid = %s', [document_id])
+        cursor.execute(
+            'INSERT INTO documents_search (rowid, title, description, body) VALUES (%s, %s, %s, %s)',
+            [document_id, document.title, document.description or '', body or ''],
+        )
+
+
+def unindex_document(document_id):
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM documents_search WHERE rowid = %s', [document_id])
+
+
+def rebuild_index():
+    indexed = 0
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM documents_search')
+        rows = Document.objects.order_by('id').values_list('id', 'title', 'description', 'blob_id')
+        for start in range(0, rows.count(), REBUILD_BATCH):
+            batch = list(rows[start:start + REBUILD_BATCH])
+            by_blob = dict(DocumentAnalysis.objects.filter(
+                blob_id__in=[blob_id for _, _, _, blob_id in batch if blob_id]
+            ).values_list('blob_id', 'extracted_text'))
+            by_document = dict(DocumentAnalysis.objects.filter(
+                blob__isnull=True, document_id__in=[document_id for document_id, _, _, blob_id in batch if not blob_id]
+            ).values_list('document_id', 'extracted_text'))
+            cursor.executemany(
+                'INSERT INTO documents_search (rowid, title, description, body) VALUES (%s, %s, %s, %s)',
+                [(document_id, title, description or '',
+                  (by_blob.get(blob_id) if blob_id else by_document.get(document_id)) or '')
+                 for document_id, title, description, blob_id in batch],
+            )
+            indexed += len(batch)
+        cursor.execute("INSERT INTO documents_search (documents_search) VALUES ('optimize')")
+    return indexed
+
+
+def search(user, query, limit=20, offset=0):
+    """Return ``(total, [(document_id, snippet, rank), ...])`` of the documents ``user`` may read"""
+    expression = match_expression(query)
+    if not expression:
+        return 0, []
+    readable, params = Document.objects.filter(readable_by(user)).values('id').query.sql_with_params()
+    matches = f'FROM documents_search WHERE documents_search MATCH %s AND rowid IN ({readable})'
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT COUNT(*) {matches}', [expression, *params])
+        [total] = cursor.fetchone()
+        if not total or offset >= total:
+            return total, []
+        cursor.execute(
+            f"SELECT rowid, snippet(documents_search, -1, '[', ']', '…', {SNIPPET_TOKENS}), "
+            f"bm25(documents_search, {', '.join(map(str, WEIGHTS))}) AS rank "
+            f'{matches} ORDER BY rank LIMIT %s OFFSET %s',
+            [expression, *params, limit, offset],
+        )
+        return total, cursor.fetchall()
@@ -0,0 +1,58 @@
+from rest_framework import serializers
+from .models import AnalysisJob, Document, DocumentAccess, UploadSession
+
+
+class DocumentSerializer(serializers.ModelSerializer):
+    file = serializers.CharField(source='file.public_id', read_only=True)
+    
+    class Meta:
+        model = Document
+        fields = ('id', 'user', 'title', 'description', 'document_type', 'file', 'file_size', 'file_type',
+                 'privacy_level', 'is_analyzed', 'created_at', 'updated_at')
+        read_only_fields = fields
+
+
+class DocumentDetailSerializer(DocumentSerializer):
+    class Meta(DocumentSerializer.Meta):
+        fields = DocumentSerializer.Meta.fields + ('ai_summary', 'ai_key_points', 'ai_legal_issues', 'ai_confidence_score')
+        read_only_fields = fields
+
+
+class SharedDocumentSerializer(serializers.ModelSerializer):
+    document = DocumentSerializer(read_only=True)
+    
+    class Meta:
+        model = DocumentAccess
+        fields = ('document', 'permission')
+        read_only_fields = fields
+
+
+class UploadSessionCreateSerializer(serializers.ModelSerializer):
+    total_size = serializers.IntegerField(min_value=1)
+    
+    class Meta:
+        model = UploadSession
+        fields = ('filename', 'total_size', 'title', 'description', 'document_type', 'privacy_level')
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    document = DocumentSerializer(read_only=True)
+    
+    class Meta:
+        model = UploadSession
+        fields = ('id', 'filename', 'title', 'total_size', 'received_bytes', 'file_type', 'sha256', 'status',
+                 'document', 'expires_at', 'created_at')
+        read_only_fields = fields
+
+
+class AnalysisJobSerializer(serializers.ModelSerializer):
+    completed_stages = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = AnalysisJob
+        fields = ('id', 'document', 'status', 'stage', 'completed_stages', 'timings', 'attempts', 'error',
+                 'run_after', 'created_at', 'finished_at')
+        read_only_fields = fields
+    
+    def get_completed_stages(self, obj):
+        return list(obj.results)
@@ -0,0 +1,92 @@
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save, pre_delete
+from django.dispatch import receiver
+
+from appointments.models import Appointment
+from . import access, search
+from .models import Document, DocumentShare
+
+
+@receiver(post_save, sender=Document)
+def index_saved_document(sender, instance, **kwargs):
+    search.index_document(instance.pk)
+
+
+@receiver(post_delete, sender=Document)
+def unindex_deleted_document(sender, instance, **kwargs):
+    search.unindex_document(instance.pk)
+
+
+# Access rows (see documents/access.py)
+
+@receiver(post_init, sender=Document)
+def remember_access_fields(sender, instance, **kwargs):
+    # Deferred fields stay unloaded; a save then refreshes the access rows to be safe
+    instance._original_access = (instance.__dict__.get('user_id'), instance.__dict__.get('privacy_level'))
+
+
+@receiver(post_save, sender=Document)
+def refresh_document_access(sender, instance, created, **kwargs):
+    current = (instance.user_id, instance.privacy_level)
+    if created or current != instance._original_access:
+        access.refresh([instance.pk])
+    instance._original_access = current
+
+
+@receiver(post_save, sender=DocumentShare)
+def refresh_share_access(sender, instance, **kwargs):
+    access.refresh([instance.document_id])
+
+
+@receiver(post_delete, sender=DocumentShare)
+def revoke_deleted_share_access(sender, instance, **kwargs):
+    access.refresh([instance.document_id], revoke_only=True)
+
+
+def _m2m_document_ids(instance, action, pk_set, through, field):
+    """Documents touched by an m2m change, remembering those of a ``clear`` in its ``pre_clear``"""
+    if isinstance(instance, Document):
+        return [instance.pk]
+    if action == 'pre_clear':
+        instance._cleared_documents = list(
+            through.objects.filter(**{field: instance.pk}).values_list('document_id', flat=True)
+        )
+    if action == 'post_clear':
+        return instance._cleared_documents
+    return pk_set or []
+
+
+def _refresh_m2m_access(action, document_ids):
+    if action == 'post_add':
+        access.refresh(document_ids)
+    elif action in ('post_remove', 'post_clear'):
+        access.refresh(document_ids, revoke_only=True)
+
+
+@receiver(m2m_changed, sender=Document.shared_with_lawyers.through)
+def refresh_listed_lawyer_access(sender, instance, action, pk_set, **kwargs):
+    _refresh_m2m_access(action, _m2m_document_ids(instance, action, pk_set, sender, 'user_id'))
+
+
+@receiver(m2m_changed, sender=Appointment.documents_shared.through)
+def refresh_appointment_access(sender, instance, action, pk_set, **kwargs):
+    _refresh_m2m_access(action, _m2m_document_ids(instance, action, pk_set, sender, 'appointment_id'))
+
+
+@receiver(post_init, sender=Appointment)
+def remember_appointment_lawyer(sender, instance, **kwargs):
+    instance._original_lawyer_id = instance.__dict__.get('lawyer_id')
+
+
+@receiver(post_save, sender=Appointment)
+def refresh_appointment_lawyer_access(sender, instance, created, **kwargs):
+    if not created and instance.lawyer_id != instance._original_lawyer_id:
+        access.refresh(instance.documents_shared.values_list('id', flat=True))
+    instance._original_lawyer_id = instance.lawyer_id
+
+
+@receiver(pre_delete, sender=Appointment)
+def revoke_deleted_appointment_access(sender, instance, **kwargs):
+    # The documents_shared rows are deleted without m2m signals, so revoke before they go
+    access.refresh(
+        instance.documents_shared.values_list('id', flat=True), revoke_only=True, exclude_appointment=instance.pk
+    )
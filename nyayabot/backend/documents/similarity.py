@@ -0,0 +1,161 @@
+"""
+Near-duplicate detection over extracted text with MinHash and LSH.
+
+The text of a document is reduced to its set of ``SHINGLE_WORDS``-word
+shingles, and the set to ``NUM_PERM`` minimum hashes under fixed random
+permutations. Two signatures agree on a hash with probability equal to the
+Jaccard similarity of the shingle sets, so the fraction of agreeing hashes
+estimates it. Only the low 16 bits of each hash are stored (256 bytes per
+document); the chance of two different hashes agreeing on them is corrected
+for in ``estimate``.
+
+For lookups the signature is cut into ``BANDS`` bands of ``ROWS`` hashes, and
+each band is stored as a ``SimilarityBucket`` keyed by its hash. Documents
+sharing a bucket are candidates; with 16 bands of 8 the chance of becoming
+one rises steeply around a similarity of 0.7. A lookup reads the buckets of
+one document and the rows sharing their keys through the ``key`` index, so
+its cost depends on the number of near-duplicates, not of documents.
+
+Documents are indexed when their analysis completes (see
+:mod:`documents.analysis`); ``rebuild_index`` reindexes every analysed one.
+"""
+import hashlib
+import random
+import re
+import struct
+import zlib
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q
+
+from .access import readable_by
+from .models import Document, DocumentAnalysis, DocumentComment, DocumentSignature, SimilarityBucket
+
+SHINGLE_WORDS = 5
+MAX_WORDS = 20000  # near-duplicates show in the opening of a document; bounds the cost of long ones
+NUM_PERM = 128
+BANDS, ROWS = 16, 8
+MAX_CANDIDATES = 500
+STORED_BITS = 16
+
+PRIME = (1 << 61) - 1
+# Fixed for good: stored signatures are only comparable under the same permutations
+_generator = random.Random(0x6E79617961)
+PERMUTATIONS = [(_generator.randrange(1, PRIME), _generator.randrange(PRIME)) for _ in range(NUM_PERM)]
+WORD = re.compile(r'\w+')
+
+
+def shingles(text):
+    """CRC-32s of the word shingles of ``text``"""
+    words = WORD.findall(text.lower())[:MAX_WORDS]
+    if not words:
+        return set()
+    if len(words) < SHINGLE_WORDS:
+        return {zlib.crc32(' '.join(words).encode())}
+    return {zlib.crc32(' '.join(words[i:i + SHINGLE_WORDS]).encode())
+            for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+
+def minhash(hashes):
+    """The ``NUM_PERM`` minimum hashes of a non-empty set"""
+    hashes = list(hashes)
+    return [min([(a * value + b) % PRIME for value in hashes]) for a, b in PERMUTATIONS]
+
+
+def band_keys(values):
+    """The ``SimilarityBucket`` key of every band of a signature"""
+    keys = []
+    for band in range(BANDS):
+        rows = values[band * ROWS:(band + 1) * ROWS]
+        digest = hashlib.blake2b(struct.pack(f'<H{ROWS}Q', band, *rows), digest_size=8).digest()
+        keys.append(int.from_bytes(digest, 'little', signed=True))
+    return keys
+
+
+def pack(values):
+    mask = (1 << STORED_BITS) - 1
+    return struct.pack(f'<{NUM_PERM}H', *(value & mask for value in values))
+
+
+def estimate(first, second):
+    """Estimated Jaccard similarity of two packed signatures"""
+    layout = f'<{NUM_PERM}H'
+    agreeing = sum(x == y for x, y in zip(struct.unpack(layout, first), struct.unpack(layout, second)))
+    chance = 1 / (1 << STORED_BITS)
+    return max((agreeing / NUM_PERM - chance) / (1 - chance), 0.0)
+
+
+def index_document(document_id, text):
+    """Store the signature and buckets of a document's text, replacing earlier ones"""
+    hashes = shingles(text or '')
+    with transaction.atomic():
+        SimilarityBucket.objects.filter(document_id=document_id).delete()
+        if not hashes:
+            DocumentSignature.objects.filter(document_id=document_id).delete()
+            return
+        values = minhash(hashes)
+        DocumentSignature.objects.update_or_create(document_id=document_id, defaults={
+            'minhash': pack(values), 'shingle_count': len(hashes),
+        })
+        SimilarityBucket.objects.bulk_create(
+            [SimilarityBucket(key=key, document_id=document_id) for key in band_keys(values)]
+        )
+
+
+def rebuild_index():
+    indexed = 0
+    for document in Document.objects.filter(is_analyzed=True).only('id', 'blob_id').iterator():
+        index_document(document.pk, document.stored_analysis().values_list('extracted_text', flat=True).first())
+        indexed += 1
+    return indexed
+
+
+def similar(user, document, limit=None, threshold=None):
+    """``[(document_id, similarity), ...]`` of the documents ``user`` may read, most similar first"""
+    limit = limit or settings.DOCUMENT_SIMILAR_LIMIT
+    threshold = settings.DOCUMENT_SIMILARITY_THRESHOLD if threshold is None else threshold
+    signature = DocumentSignature.objects.filter(document_id=document.pk).values_list('minhash', flat=True).first()
+    if signature is None:
+        return []
+    keys = SimilarityBucket.objects.filter(document_id=document.pk).values('key')
+    # Documents sharing the most bands first
+    candidates = SimilarityBucket.objects.filter(key__in=keys).exclude(document_id=document.pk).values(
+        'document_id'
+    ).annotate(bands=Count('id')).order_by('-bands').values_list('document_id', flat=True)[:MAX_CANDIDATES]
+    readable = Document.objects.filter(readable_by(user), pk__in=list(candidates)).order_by().values_list(
+        'id', 'signature__minhash'
+    )
+
+    scored = []
+    for document_id, candidate in readable:
+        if candidate is None:
+            continue
+        similarity = estimate(signature, candidate)
+        if similarity >= threshold:
+            scored.append((document_id, round(similarity, 3)))
+    scored.sort(key=lambda item: (-item[1], item[0]))
+    return scored[:limit]
+
+
+def review_notes(user, documents):
+    """``{document_id: (potential_issues, [comment, ...])}`` of the documents, with the comments ``user`` may see"""
+    by_blob = {}
+    for document in documents:
+        if document.blob_id:
+            by_blob.setdefault(document.blob_id, []).append(document.pk)
+    analyses = DocumentAnalysis.objects.filter(
+        Q(blob_id__in=list(by_blob))
+        | Q(blob__isnull=True, document_id__in=[document.pk for document in documents if not document.blob_id])
+    ).values_list('blob_id', 'document_id', 'potential_issues')
+    notes = {document.pk: ([], []) for document in documents}
+    for blob_id, document_id, issues in analyses:
+        for owner_id in by_blob[blob_id] if blob_id else [document_id]:
+            notes[owner_id][0].extend(issues)
+    # Internal notes stay with their author
+    comments = DocumentComment.objects.filter(document_id__in=list(notes)).filter(
+        Q(is_internal=False) | Q(user=user)
+    ).select_related('user').only('document_id', 'comment', 'is_internal', 'created_at', 'user__username')
+    for comment in comments:
+        notes[comment.document_id][1].append(comment)
+    return notes
@@ -1,3 +1,1262 @@
-from django.test import TestCase
+import hashlib
+import io
+import os
+import random
+import shutil
+import subprocess
+import sys
+import time as clock
+import tempfile
+import tracemalloc
+import zipfile
+import zlib
+from datetime import timedelta
+from unittest import mock
+from unittest import skipUnless
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from authentication.models import User
+from nyayabot_backend.storage import LocalStorageBackend
+from appointments.models import Appointment
+from . import access, analysis, bundles, dedupe, entities, extraction, search, similarity, uploads
+from .models import (
+    AnalysisJob, Document, DocumentAccess, DocumentAnalysis, DocumentBlob, DocumentComment, DocumentShare,
+    DocumentSignature, UploadSession,
+)
 
-# Create your tests here.
+PDF_HEADER = b'%PDF-1.7\n'
+
+BENCHMARKS = skipUnless(os.environ.get('NYAYABOT_BENCHMARKS'), 'set NYAYABOT_BENCHMARKS=1 to run benchmarks')
+
+
+def make_pdf(pages, image_bytes=0):
+    """A minimal PDF with one compressed content stream per page of text lines.
+
+    With ``image_bytes`` every page also gets a scanned image of that size.
+    """
+    return PDF_HEADER + b''.join(iter_pdf_objects(pages, image_bytes)) + b'%%EOF\n'
+
+
+def iter_pdf_objects(pages, image_bytes=0):
+    number = 0
+    for lines in pages:
+        objects = []
+        if image_bytes:
+            objects.append(b'<< /Type /XObject /Subtype /Image /Width 1 /Height 1 /Length %d >>\nstream\n' % image_bytes
+                           + os.urandom(image_bytes) + b'\nendstream')
+        operators = ' '.join(f'({line}) Tj T*' for line in lines)
+        content = zlib.compress(f'BT /F1 11 Tf 72 760 Td 14 TL {operators} ET'.encode('latin-1'))
+        objects.append(b'<< /Length %d /Filter /FlateDecode >>\nstream\n' % len(content) + content + b'\nendstream')
+        for obj in objects:
+            number += 1
+            yield b'%d 0 obj\n' % number + obj + b'\nendobj\n'
+
+
+@override_settings(UPLOAD_STORAGE_BACKEND='nyayabot_backend.storage.LocalStorageBackend')
+class ChunkedUploadTests(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        override = override_settings(
+            MEDIA_ROOT=os.path.join(self.root, 'media'),
+            DOCUMENT_UPLOAD_TEMP_DIR=os.path.join(self.root, 'partial'),
+            DOCUMENT_UPLOAD_MAX_CHUNK_BYTES=1024 * 1024,
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.user = User.objects.create_user(username='uploader')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def start(self, total_size, filename='order.pdf'):
+        response = self.client.post(reverse('documents:upload-sessions'), {
+            'filename': filename, 'total_size': total_size, 'title': 'High Court order', 'document_type': 'court_order',
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.data['id']
+
+    def put(self, session_id, offset, data):
+        return self.client.generic(
+            'PUT', reverse('documents:upload-chunk', args=[session_id]), data,
+            content_type='application/octet-stream', HTTP_UPLOAD_OFFSET=str(offset)
+        )
+
+    def upload(self, size, chunk_size=1024 * 1024):
+        """Upload ``size`` bytes of a generated PDF, producing each chunk on the fly"""
+        session_id = self.start(size)
+        digest = hashlib.sha256()
+        for offset in range(0, size, chunk_size):
+            chunk = (PDF_HEADER if offset == 0 else b'') + os.urandom(min(chunk_size, size - offset))
+            chunk = chunk[:min(chunk_size, size - offset)]
+            digest.update(chunk)
+            self.assertEqual(self.put(session_id, offset, chunk).status_code, 200)
+        return session_id, digest.hexdigest()
+
+    def test_chunks_are_assembled_into_a_document_at_completion(self):
+        session_id, digest = self.upload(2_500_000)
+        self.assertFalse(Document.objects.exists())
+
+        response = self.client.post(reverse('documents:upload-complete', args=[session_id]))
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['sha256'], digest)
+        document = Document.objects.get()
+        self.assertEqual((document.file_size, document.file_type, document.document_type), (2_500_000, 'pdf', 'court_order'))
+        with open(LocalStorageBackend().path(document.file.public_id), 'rb') as stored:
+            self.assertEqual(hashlib.sha256(stored.read()).hexdigest(), digest)
+        self.assertFalse(os.listdir(os.path.join(self.root, 'partial')))
+
+    def test_interrupted_upload_resumes_from_the_stored_offset(self):
+        session_id = self.start(300_000)
+        body = PDF_HEADER + os.urandom(300_000 - len(PDF_HEADER))
+        self.assertEqual(self.put(session_id, 0, body[:100_000]).status_code, 200)
+
+        response = self.put(session_id, 200_000, body[200_000:])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response['Upload-Offset'], '100000')
+
+        # A different worker picks up the rest and has to rebuild the running hash from disk
+        uploads.hashers.discard(UploadSession.objects.get().id)
+        offset = self.client.get(reverse('documents:upload-session', args=[session_id])).data['received_bytes']
+        self.assertEqual(self.put(session_id, offset, body[offset:]).status_code, 200)
+
+        response = self.client.post(reverse('documents:upload-complete', args=[session_id]))
+        self.assertEqual(response.data['sha256'], hashlib.sha256(body).hexdigest())
+
+    def test_type_and_size_limits(self):
+        session_id = self.start(1000, filename='payload.pdf')
+        response = self.put(session_id, 0, b'MZ\x90\x00' + b'\x00' * 996)
+        self.assertEqual(response.status_code, 415)
+        self.assertEqual(UploadSession.objects.get().received_bytes, 0)
+
+        self.assertEqual(self.put(session_id, 0, PDF_HEADER + b'\x00' * 1000).status_code, 413)
+        self.assertEqual(self.client.post(reverse('documents:upload-complete', args=[session_id])).status_code, 409)
+
+        with override_settings(DOCUMENT_UPLOAD_MAX_BYTES=10):
+            response = self.client.post(reverse('documents:upload-sessions'), {
+                'filename': 'big.pdf', 'total_size': 11, 'title': 'Too big',
+            }, format='json')
+        self.assertEqual(response.status_code, 413)
+
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user(username='intruder'))
+        self.assertEqual(other.get(reverse('documents:upload-session', args=[session_id])).status_code, 404)
+
+    def test_only_word_archives_are_accepted_as_docx(self):
+        def complete(files):
+            archive = io.BytesIO()
+            with zipfile.ZipFile(archive, 'w') as contents:
+                for name in files:
+                    contents.writestr(name, '<w:document/>')
+            body = archive.getvalue()
+            session_id = self.start(len(body), filename='lease.docx')
+            self.assertEqual(self.put(session_id, 0, body).status_code, 200)
+            return self.client.post(reverse('documents:upload-complete', args=[session_id]))
+
+        self.assertEqual(complete(['payload.exe']).status_code, 415)
+        self.assertEqual(UploadSession.objects.get().status, 'aborted')
+        response = complete(['[Content_Types].xml', 'word/document.xml'])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Document.objects.get().file_type, 'docx')
+
+    def test_a_session_is_stored_once(self):
+        session = uploads.open_session(self.user, 'order.pdf', 1000, title='Order')
+        uploads.write_chunk(session, 0, GeneratedStream(1000, True), 1000)
+        stale = UploadSession.objects.get(pk=session.pk)
+
+        with mock.patch.object(uploads, 'store_blob', side_effect=OSError('storage unavailable')):
+            with self.assertRaises(OSError):
+                uploads.complete_session(session)
+        self.assertEqual(UploadSession.objects.get().status, 'active')
+
+        uploads.complete_session(session)
+        # A concurrent completion that read the session before it was completed stores nothing
+        with mock.patch.object(uploads, 'store_blob') as store:
+            with self.assertRaises(uploads.UploadError):
+                uploads.complete_session(stale)
+        store.assert_not_called()
+        self.assertEqual(Document.objects.count(), 1)
+
+    def test_peak_memory_does_not_grow_with_file_size(self):
+        def peak_for(size, chunk_size=1024 * 1024):
+            session = uploads.open_session(self.user, 'large.pdf', size, title='Case file')
+            tracemalloc.start()
+            try:
+                for offset in range(0, size, chunk_size):
+                    length = min(chunk_size, size - offset)
+                    uploads.write_chunk(session, offset, GeneratedStream(length, offset == 0), length)
+                uploads.complete_session(session)
+                return tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+        small, large = peak_for(1024 * 1024), peak_for(32 * 1024 * 1024)
+        self.assertLess(large, small * 1.5)
+        self.assertLess(large, 1024 * 1024)
+
+
+class GeneratedStream:
+    """A request body of ``length`` bytes that is produced as it is read"""
+
+    def __init__(self, length, first=False):
+        self.remaining = length
+        self.prefix = PDF_HEADER if first else b''
+
+    def read(self, size):
+        size = min(size, self.remaining)
+        block = (self.prefix + b'\x00' * size)[:size]
+        self.prefix = b''
+        self.remaining -= size
+        return block
+
+
+class FakeAnalyzer:
+    """Analyzer standing in for the LLM; fails the first ``failures`` calls"""
+    model = 'fake-analyzer'
+    calls = 0
+    failures = 0
+
+    def analyze(self, text, known=None, details=None):
+        FakeAnalyzer.calls += 1
+        if FakeAnalyzer.calls <= FakeAnalyzer.failures:
+            raise RuntimeError('model unavailable')
+        return {
+            'summary': f"Summary of {(details or {}).get('Title', 'the document')}",
+            'key_points': ['Security deposit of two months'],
+            'important_dates': ['1 April 2023', 'next month'],
+            'legal_category': 'property',
+            'key_clauses': [line for line in text.splitlines() if 'deposit' in line],
+            'risk_level': 'medium',
+            'confidence_score': 0.9,
+        }
+
+
+@override_settings(
+    UPLOAD_STORAGE_BACKEND='nyayabot_backend.storage.LocalStorageBackend',
+    DOCUMENT_ANALYZER='documents.tests.FakeAnalyzer',
+    DOCUMENT_ANALYSIS_EAGER=True,
+)
+class AnalysisPipelineTests(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.root, DOCUMENT_ANALYSIS_WORK_DIR=os.path.join(self.root, 'work'))
+        override.enable()
+        self.addCleanup(override.disable)
+        FakeAnalyzer.calls, FakeAnalyzer.failures = 0, 0
+
+        self.user = User.objects.create_user(username='tenant')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.document = self.create_document(make_pdf([
+            ['RENT AGREEMENT', 'The tenant shall pay a security deposit of Rs. 50,000.'],
+            ['The lease is for eleven months.'],
+        ]))
+
+    def create_document(self, content):
+        public_id = f'documents/{self.user.id}/lease'
+        path = os.path.join(self.root, 'lease.pdf')
+        with open(path, 'wb') as source:
+            source.write(content)
+        LocalStorageBackend().store(public_id, path, 'raw')
+        return Document.objects.create(
+            user=self.user, title='Lease deed', document_type='lease_deed',
+            file=f'raw/upload/v1/{public_id}', file_size=len(content), file_type='pdf',
+        )
+
+    def analyze(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('documents:analyze', args=[self.document.id]))
+        self.assertEqual(response.status_code, 202)
+        return response.data['id']
+
+    def poll(self, job_id):
+        return self.client.get(reverse('documents:analysis-job', args=[job_id])).data
+
+    def test_job_writes_the_analysis_with_stage_timings(self):
+        job = self.poll(self.analyze())
+
+        self.assertEqual(job['status'], 'completed')
+        self.assertEqual(job['completed_stages'], ['extract', 'entities', 'analyze', 'save'])
+        result = DocumentAnalysis.objects.get(document=self.document)
+        self.assertIn('security deposit of Rs. 50,000', result.extracted_text)
+        self.assertEqual(result.word_count, 18)
+        self.assertEqual(set(result.stage_timings), {'extract', 'entities', 'analyze'})
+        self.assertAlmostEqual(result.processing_time, sum(result.stage_timings.values()), delta=0.001)
+        self.assertEqual((result.risk_level, result.legal_category, result.ai_model_used), ('medium', 'property', 'fake-analyzer'))
+        self.assertEqual(result.key_clauses, ['The tenant shall pay a security deposit of Rs. 50,000.'])
+        self.assertEqual(result.monetary_amounts, [{'text': 'Rs. 50,000', 'rupees': 50000}])
+        # The model's dates, given as strings, are stored in the shape of the rules' dates
+        self.assertEqual(result.important_dates, [
+            {'text': '1 April 2023', 'date': '2023-04-01'}, {'text': 'next month', 'date': None},
+        ])
+        # The extracted text is searchable, and comparable, as soon as the analysis completes
+        self.assertEqual([hit[0] for hit in search.search(self.user, 'eleven months')[1]], [self.document.id])
+        self.assertTrue(DocumentSignature.objects.filter(document=self.document).exists())
+
+        self.document.refresh_from_db()
+        self.assertTrue(self.document.is_analyzed)
+        self.assertEqual(self.document.ai_summary, 'Summary of Lease deed')
+        text = self.client.get(reverse('documents:text', args=[self.document.id])).data
+        self.assertEqual((text['text'], text['word_count']), (result.extracted_text, 18))
+
+    def test_failed_stage_is_retried_without_redoing_completed_ones(self):
+        FakeAnalyzer.failures = 1
+        with mock.patch.object(analysis, 'iter_pages', wraps=analysis.iter_pages) as extract:
+            job_id = self.analyze()
+            job = AnalysisJob.objects.get(pk=job_id)
+            self.assertEqual((job.status, job.stage, job.attempts), ('queued', 'analyze', 1))
+            self.assertEqual(list(job.results), ['extract', 'entities'])
+            self.assertIn('model unavailable', job.error)
+
+            # Not due yet
+            self.assertEqual(analysis.process_due_jobs(), [])
+            [job] = analysis.process_due_jobs(now=timezone.now() + timedelta(minutes=2))
+
+        self.assertEqual(job.status, 'completed')
+        self.assertEqual(extract.call_count, 1)
+        self.assertEqual(FakeAnalyzer.calls, 2)
+        self.assertTrue(DocumentAnalysis.objects.filter(document=self.document).exists())
+
+    def test_exhausted_job_fails_and_can_be_requeued(self):
+        FakeAnalyzer.failures = 3
+        job_id = self.analyze()
+        analysis.process_due_jobs(now=timezone.now() + timedelta(minutes=2))
+        analysis.process_due_jobs(now=timezone.now() + timedelta(minutes=10))
+        job = self.poll(job_id)
+        self.assertEqual((job['status'], job['attempts'], job['completed_stages']), ('failed', 3, ['extract', 'entities']))
+
+        self.assertEqual(self.analyze(), job_id)
+        self.assertEqual(self.poll(job_id)['status'], 'completed')
+        self.assertEqual(FakeAnalyzer.calls, 4)
+
+    def test_running_job_is_claimed_once_until_its_claim_expires(self):
+        job = AnalysisJob.objects.create(document=self.document)
+        self.assertTrue(analysis.claim(job.id))
+        self.assertFalse(analysis.claim(job.id))
+        self.assertIsNone(analysis.run_job(job.id))
+        self.assertTrue(analysis.claim(job.id, now=timezone.now() + timedelta(hours=1)))
+
+    def test_jobs_are_private_to_the_document_owner(self):
+        job_id = self.analyze()
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user(username='stranger'))
+        self.assertEqual(other.get(reverse('documents:analysis-job', args=[job_id])).status_code, 404)
+        self.assertEqual(other.post(reverse('documents:analyze', args=[self.document.id])).status_code, 404)
+
+
+    @override_settings(DOCUMENT_EXTRACTION_CHECKPOINT_PAGES=5)
+    def test_crashed_extraction_resumes_at_the_last_checkpoint(self):
+        pages = [[f'Page {number} of the bundle', f'Clause {number} applies.'] for number in range(1, 26)]
+        self.document = self.create_document(make_pdf(pages, image_bytes=2000))
+        extracted, crashes = [], []
+
+        def crash_after_13_pages(source, file_type, start=0):
+            for position, text in extraction.iter_pages(source, file_type, start):
+                if len(extracted) == 13 and not crashes:
+                    crashes.append(position)
+                    raise MemoryError('worker killed')
+                extracted.append(text)
+                yield position, text
+
+        with mock.patch.object(analysis, 'iter_pages', crash_after_13_pages):
+            job = AnalysisJob.objects.get(pk=self.analyze())
+            self.assertEqual((job.status, job.checkpoint['extract']['pages']), ('queued', 10))
+            extracted.clear()
+            analysis.process_due_jobs(now=timezone.now() + timedelta(minutes=2))
+
+        # Only the pages after the checkpoint were read again, and none of them twice
+        self.assertEqual(len(extracted), 15)
+        result = DocumentAnalysis.objects.get(document=self.document)
+        self.assertEqual(result.extracted_text.splitlines()[::2], [lines[0] for lines in pages])
+        self.assertEqual((result.word_count, result.language_detected), (25 * 8, 'en'))
+        self.assertEqual(AnalysisJob.objects.get(pk=job.pk).checkpoint, {})
+        self.assertFalse(os.listdir(os.path.join(self.root, 'work')))
+
+    @override_settings(DOCUMENT_EXTRACTION_CHECKPOINT_PAGES=5)
+    def test_checkpoint_ahead_of_its_spool_file_starts_over(self):
+        pages = [[f'Page {number} of the bundle'] for number in range(1, 13)]
+        self.document = self.create_document(make_pdf(pages))
+        read = []
+
+        def crash_after_7_pages(source, file_type, start=0):
+            for position, text in extraction.iter_pages(source, file_type, start):
+                if len(read) == 7:
+                    raise MemoryError('worker killed')
+                read.append(text)
+                yield position, text
+
+        with mock.patch.object(analysis, 'iter_pages', crash_after_7_pages):
+            job = AnalysisJob.objects.get(pk=self.analyze())
+        self.assertEqual(job.checkpoint['extract']['pages'], 5)
+        # The retry finds less text in the spool file than the checkpoint counts
+        with open(analysis.spool_path(job), 'r+b') as spool:
+            spool.truncate(10)
+        read.clear()
+        with mock.patch.object(analysis, 'iter_pages', wraps=extraction.iter_pages) as iter_pages:
+            analysis.process_due_jobs(now=timezone.now() + timedelta(minutes=2))
+
+        self.assertEqual(iter_pages.call_args.args[2], 0)
+        result = DocumentAnalysis.objects.get(document=self.document)
+        self.assertEqual(result.extracted_text.splitlines(), [lines[0] for lines in pages])
+        self.assertEqual(result.word_count, 12 * 5)
+
+    @BENCHMARKS
+    def test_benchmark_peak_rss_of_a_500_page_scanned_bundle(self):
+        path = os.path.join(self.root, 'bundle.pdf')
+        with open(path, 'wb') as bundle:
+            bundle.write(PDF_HEADER)
+            for obj in iter_pdf_objects([[f'Page {number}'] * 40 for number in range(500)], image_bytes=400 * 1024):
+                bundle.write(obj)
+        script = (
+            'import resource, sys; from documents.extraction import iter_pages\n'
+            'baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss\n'
+            'pages = 0\n'
+            'if sys.argv[1:]:\n'
+            '    with open(sys.argv[1], "rb") as source:\n'
+            '        pages = sum(1 for _ in iter_pages(source, "pdf"))\n'
+            'print(pages, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline)\n'
+        )
+        output = subprocess.run([sys.executable, '-c', script, path], capture_output=True, text=True, check=True)
+        pages, growth_kb = map(int, output.stdout.split())
+        print(f'\n500-page bundle of {os.path.getsize(path) >> 20} MB: peak RSS grew {growth_kb / 1024:.1f} MB')
+        self.assertEqual(pages, 500)
+        self.assertLess(growth_kb, 32 * 1024)
+
+
+@override_settings(
+    UPLOAD_STORAGE_BACKEND='nyayabot_backend.storage.LocalStorageBackend',
+    DOCUMENT_ANALYZER='documents.tests.FakeAnalyzer',
+    DOCUMENT_ANALYSIS_EAGER=True,
+)
+class DeduplicationTests(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        override = override_settings(
+            MEDIA_ROOT=os.path.join(self.root, 'media'), DOCUMENT_UPLOAD_TEMP_DIR=self.root,
+            DOCUMENT_ANALYSIS_WORK_DIR=os.path.join(self.root, 'work'),
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+        FakeAnalyzer.calls, FakeAnalyzer.failures = 0, 0
+        self.rent_agreement = make_pdf([['RENT AGREEMENT', 'Security deposit of Rs. 50,000 is refundable.']])
+
+    def upload(self, username, content, title, privacy_level='private'):
+        client = APIClient()
+        client.force_authenticate(User.objects.get_or_create(username=username)[0])
+        session_id = client.post(reverse('documents:upload-sessions'), {
+            'filename': 'agreement.pdf', 'total_size': len(content), 'title': title, 'privacy_level': privacy_level,
+        }, format='json').data['id']
+        client.generic('PUT', reverse('documents:upload-chunk', args=[session_id]), content,
+                       content_type='application/octet-stream', HTTP_UPLOAD_OFFSET='0')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.post(reverse('documents:upload-complete', args=[session_id]))
+        self.assertEqual(response.status_code, 201)
+        return Document.objects.get(pk=response.data['document']['id'])
+
+    def test_identical_uploads_share_one_blob_and_one_analysis(self):
+        first = self.upload('asha', self.rent_agreement, 'My rent agreement')
+        with mock.patch('nyayabot_backend.storage.LocalStorageBackend.store') as store:
+            second = self.upload('vikram', self.rent_agreement, 'Flat lease', privacy_level='shared_with_lawyer')
+        store.assert_not_called()
+        other = self.upload('asha', make_pdf([['AFFIDAVIT']]), 'Affidavit')
+
+        self.assertEqual(first.blob_id, second.blob_id)
+        self.assertNotEqual(first.blob_id, other.blob_id)
+        self.assertEqual(DocumentBlob.objects.count(), 2)
+        self.assertEqual((second.title, second.privacy_level, second.user.username), ('Flat lease', 'shared_with_lawyer', 'vikram'))
+
+        # One LLM call per distinct content; the twin copies the results
+        self.assertEqual(FakeAnalyzer.calls, 2)
+        self.assertEqual(DocumentAnalysis.objects.count(), 2)
+        self.assertEqual(DocumentAnalysis.objects.get(blob=first.blob).document, first)
+        self.assertTrue(second.is_analyzed)
+        # Neither uploader's title reached the model, so the shared summary reveals neither
+        self.assertEqual((first.ai_summary, second.ai_summary), ('Summary of the document', 'Summary of the document'))
+        self.assertEqual(second.ai_key_points, ['Security deposit of two months'])
+        self.assertEqual(second.stored_analysis().get(), first.stored_analysis().get())
+        self.assertTrue(AnalysisJob.objects.get(document=second).reused)
+
+        # The shared analysis outlives the document it was computed for
+        first.delete()
+        self.assertIsNone(DocumentAnalysis.objects.get(blob=second.blob).document)
+
+    def test_report(self):
+        for username in ('asha', 'vikram', 'meera'):
+            self.upload(username, self.rent_agreement, 'Rent agreement')
+        self.upload('asha', make_pdf([['AFFIDAVIT']]), 'Affidavit')
+        affidavit_size = DocumentBlob.objects.exclude(size=len(self.rent_agreement)).get().size
+        seconds = DocumentAnalysis.objects.get(blob__size=len(self.rent_agreement)).processing_time
+
+        stats = dedupe.report()
+
+        self.assertEqual((stats['documents'], stats['blobs']), (4, 2))
+        self.assertEqual(stats['logical_bytes'], 3 * len(self.rent_agreement) + affidavit_size)
+        self.assertEqual(stats['bytes_saved'], 2 * len(self.rent_agreement))
+        self.assertEqual(stats['dedupe_ratio'], round(stats['logical_bytes'] / stats['stored_bytes'], 3))
+        self.assertEqual((stats['analyses_run'], stats['analyses_reused']), (2, 2))
+        self.assertAlmostEqual(stats['analysis_seconds_saved'], 2 * seconds, places=3)
+
+
+class ExtractionTests(TestCase):
+    def test_pdf_pages_resume_from_their_positions(self):
+        content = make_pdf([['First page'], ['Second (page)', 'with two lines'], ['Third page']], image_bytes=300)
+        with mock.patch.object(extraction, 'READ_BLOCK', 64):
+            pages = list(extraction.iter_pages(io.BytesIO(content), 'pdf'))
+            self.assertEqual([text for _, text in pages], ['First page', 'Second (page)\nwith two lines', 'Third page'])
+            resumed = list(extraction.iter_pages(io.BytesIO(content), 'pdf', start=pages[0][0]))
+        self.assertEqual(resumed, pages[1:])
+
+    def test_docx_paragraphs_and_language(self):
+        body = ''.join(f'<w:p><w:r><w:t>{text}</w:t></w:r></w:p>' for text in ['किराया समझौता', 'मासिक किराया Rs. 15,000'])
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as docx:
+            docx.writestr('word/document.xml', (
+                '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+                f'<w:body>{body}</w:body></w:document>'
+            ))
+        archive.seek(0)
+
+        pages = list(extraction.iter_pages(archive, 'docx'))
+
+        self.assertEqual(pages, [(1, 'किराया समझौता'), (2, 'मासिक किराया Rs. 15,000')])
+        counts = {}
+        for _, text in pages:
+            extraction.count_scripts(text, counts)
+        self.assertEqual(extraction.detect_language(counts), 'hi')
+        self.assertEqual(extraction.detect_language({}), 'en')
+
+
+class EntityExtractionTests(TestCase):
+    AGREEMENT = (
+        'RENT AGREEMENT\n'
+        'This agreement is made on 12th March 2023 at Pune between Shri Ramesh Kumar Sharma, S/o Late Mohan Lal '
+        '(hereinafter referred to as the "Landlord") and Ms. Priya Nair (hereinafter called the \'Tenant\').\n'
+        'The monthly rent is Rs. 25,000/- and a security deposit of ₹ 1,50,000 is payable; a penalty of INR 2.5 lakh '
+        'applies. The lease runs from 01/04/2023 to March 31, 2024 (not 31/02/2023).\n'
+        'Offences under Section 420 IPC, Sec. 138 of the Negotiable Instruments Act, 1881 and u/s 498A of the '
+        'Indian Penal Code; Article 21 of the Constitution; Order VII Rule 11 CPC.\n'
+        'Witness: Smt. Kavita Rao\n'
+    )
+
+    def test_entities_of_a_rent_agreement(self):
+        found = entities.extract(self.AGREEMENT)
+
+        self.assertEqual([item['date'] for item in found['important_dates']], ['2023-03-12', '2023-04-01', '2024-03-31'])
+        self.assertEqual(found['monetary_amounts'], [
+            {'text': 'Rs. 25,000/-', 'rupees': 25000},
+            {'text': '₹ 1,50,000', 'rupees': 150000},
+            {'text': 'INR 2.5 lakh', 'rupees': 250000},
+        ])
+        self.assertEqual(found['legal_references'], [
+            'Section 420 IPC', 'Section 138 NI Act', 'Section 498A IPC', 'Article 21', 'Order VII Rule 11 CPC',
+        ])
+        self.assertEqual(found['parties_involved'], [
+            {'name': 'Shri Ramesh Kumar Sharma', 'role': 'Landlord'},
+            {'name': 'Ms. Priya Nair', 'role': 'Tenant'},
+            {'name': 'Smt. Kavita Rao', 'role': None},
+        ])
+
+    def test_batch_and_empty_text(self):
+        results = list(entities.extract_many(['', 'Paid Rs 2 crore on 5 Jan 2024.']))
+        self.assertEqual(results[0], dict.fromkeys(results[0], []))
+        self.assertEqual(results[1]['monetary_amounts'], [{'text': 'Rs 2 crore', 'rupees': 20000000}])
+        self.assertEqual(results[1]['important_dates'], [{'text': '5 Jan 2024', 'date': '2024-01-05'}])
+
+    def test_two_digit_years(self):
+        found = entities.extract('Dated 12/03/98, renewed on 01-04-23 and 31.12.49.')
+        self.assertEqual([item['date'] for item in found['important_dates']], ['1998-03-12', '2023-04-01', '2049-12-31'])
+
+    def test_model_entities_take_the_shapes_of_the_rules(self):
+        normalized = entities.normalize({
+            'important_dates': ['2024-01-05', 'Filed on 12/03/98', {'text': 'Hearing', 'date': '2024-02-01', 'court': 2}],
+            'monetary_amounts': ['Rs. 2 lakh', 'Unpaid rent'],
+            'parties_involved': ['Priya Nair', {'name': 'Ramesh Kumar', 'role': 'Landlord'}],
+            'legal_references': ['Section 420 IPC'],
+        })
+        self.assertEqual(normalized['important_dates'], [
+            {'text': '2024-01-05', 'date': '2024-01-05'},
+            {'text': 'Filed on 12/03/98', 'date': '1998-03-12'},
+            {'text': 'Hearing', 'date': '2024-02-01'},
+        ])
+        self.assertEqual(normalized['monetary_amounts'], [
+            {'text': 'Rs. 2 lakh', 'rupees': 200000}, {'text': 'Unpaid rent', 'rupees': None},
+        ])
+        self.assertEqual(normalized['parties_involved'], [
+            {'name': 'Priya Nair', 'role': None}, {'name': 'Ramesh Kumar', 'role': 'Landlord'},
+        ])
+        self.assertEqual(normalized['legal_references'], ['Section 420 IPC'])
+
+    @BENCHMARKS
+    def test_benchmark_thousands_of_documents_per_second(self):
+        texts = [self.AGREEMENT.replace('Pune', f'Pune ({number})') for number in range(5000)]
+        started = clock.perf_counter()
+        for _ in entities.extract_many(texts):
+            pass
+        rate = len(texts) / (clock.perf_counter() - started)
+        print(f'\nEntity extraction: {rate:.0f} documents of {len(self.AGREEMENT)} characters per second')
+        self.assertGreater(rate, 1000)
+
+
+class DocumentSearchTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner')
+        self.lawyer = User.objects.create_user(username='lawyer', user_type='lawyer')
+        self.stranger = User.objects.create_user(username='stranger')
+        self.client = APIClient()
+
+        self.lease = self.document(
+            self.owner, 'Lease deed for flat 4B', 'private',
+            body='The lessee shall pay a security deposit of two months rent, refundable on vacating.',
+        )
+        self.shared = self.document(self.owner, 'Leave and licence agreement', 'shared_with_lawyer',
+                                    body='Security deposit of Rs. 1,00,000 is interest free.')
+        DocumentShare.objects.create(document=self.shared, shared_by=self.owner, shared_with=self.lawyer)
+        self.revoked = self.document(self.owner, 'Old rent agreement', 'shared_with_lawyer', body='Security deposit forfeited.')
+        DocumentShare.objects.create(document=self.revoked, shared_by=self.owner, shared_with=self.lawyer, is_revoked=True)
+        self.listed = self.document(self.owner, 'Security deposit receipt', 'shared_with_lawyer')
+        self.listed.shared_with_lawyers.add(self.lawyer)
+        self.consultation = self.document(self.owner, 'Notice about deposit', 'shared_with_lawyer',
+                                          description='Landlord refuses to return the security deposit')
+        appointment = Appointment.objects.create(
+            user=self.owner, lawyer=self.lawyer, title='Deposit dispute', description='Deposit',
+            requested_date=timezone.localdate(), requested_time='10:00',
+        )
+        appointment.documents_shared.add(self.consultation)
+        self.private_but_shared = self.document(self.owner, 'Security deposit cheque', 'private')
+        DocumentShare.objects.create(document=self.private_but_shared, shared_by=self.owner, shared_with=self.lawyer)
+        self.public = self.document(self.stranger, 'Model security deposit clause', 'public')
+
+    def document(self, user, title, privacy_level, description='', body=None):
+        document = Document.objects.create(
+            user=user, title=title, description=description, privacy_level=privacy_level,
+            file='raw/upload/v1/documents/x', file_size=1, file_type='pdf',
+        )
+        if body:
+            DocumentAnalysis.objects.create(
+                document=document, extracted_text=body, processing_time=0, ai_model_used='test', confidence_score=1
+            )
+            search.index_document(document.id, body)
+        return document
+
+    def found(self, user, query):
+        return {document_id for document_id, _, _ in search.search(user, query, limit=100)[1]}
+
+    def test_access_rules_are_applied_in_the_query(self):
+        everything = {self.lease.id, self.shared.id, self.revoked.id, self.listed.id, self.consultation.id,
+                      self.private_but_shared.id, self.public.id}
+        self.assertEqual(self.found(self.owner, 'security deposit'), everything)
+        self.assertEqual(self.found(self.lawyer, 'security deposit'),
+                         {self.shared.id, self.listed.id, self.consultation.id, self.public.id})
+        self.assertEqual(self.found(self.stranger, 'security deposit'), {self.public.id})
+
+        self.shared.privacy_level = 'private'
+        self.shared.save()
+        self.assertNotIn(self.shared.id, self.found(self.lawyer, 'security deposit'))
+
+    def test_ranked_snippets_and_paging(self):
+        self.client.force_authenticate(self.owner)
+        response = self.client.get(reverse('documents:search'), {'q': 'security deposit'})
+
+        self.assertEqual(response.data['count'], 7)
+        titles = [result['title'] for result in response.data['results']]
+        # Title matches rank above body matches
+        self.assertEqual(set(titles[:3]), {'Security deposit receipt', 'Security deposit cheque', 'Model security deposit clause'})
+        lease = next(result for result in response.data['results'] if result['id'] == self.lease.id)
+        self.assertIn('[security] [deposit]', lease['snippet'])
+
+        with override_settings(DOCUMENT_SEARCH_PAGE_SIZE=3):
+            with self.assertNumQueries(3):
+                page = self.client.get(reverse('documents:search'), {'q': 'security deposit', 'page': 3}).data
+        self.assertEqual((page['count'], len(page['results'])), (7, 1))
+
+    def test_query_syntax_is_not_interpreted(self):
+        self.assertEqual(self.found(self.owner, '"two months" (rent* -'), {self.lease.id})
+        self.assertEqual(self.found(self.owner, 'deposits refund'), {self.lease.id})
+        self.assertEqual(search.search(self.owner, '***'), (0, []))
+
+    def test_index_follows_saves_and_deletes(self):
+        self.lease.title = 'Registered sale deed'
+        self.lease.save()
+        self.assertEqual(self.found(self.owner, 'sale'), {self.lease.id})
+        self.lease.delete()
+        self.assertEqual(self.found(self.owner, 'sale'), set())
+
+
+class DocumentAccessTests(TestCase):
+    RANK = {'view': 1, 'comment': 2, 'edit': 3, 'owner': 4}
+
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner')
+        self.lawyer = User.objects.create_user(username='lawyer', user_type='lawyer')
+        self.client = APIClient()
+
+    def document(self, user, privacy_level='shared_with_lawyer'):
+        return Document.objects.create(
+            user=user, title='Sale deed', privacy_level=privacy_level,
+            file='raw/upload/v1/documents/x', file_size=1, file_type='pdf',
+        )
+
+    def appointment(self, user, lawyer):
+        return Appointment.objects.create(
+            user=user, lawyer=lawyer, title='Consultation', description='Property dispute',
+            requested_date=timezone.localdate(), requested_time='10:00',
+        )
+
+    def expected(self):
+        """``{(document_id, user_id): permission}`` straight from the source relations"""
+        expected = {}
+
+        def grant(document, user_id, permission):
+            current = expected.get((document.id, user_id))
+            if current is None or self.RANK[permission] > self.RANK[current]:
+                expected[document.id, user_id] = permission
+
+        for document in Document.objects.prefetch_related('shared_with_lawyers', 'shares', 'related_appointments'):
+            grant(document, document.user_id, 'owner')
+            if document.privacy_level != 'shared_with_lawyer':
+                continue
+            for lawyer in document.shared_with_lawyers.all():
+                grant(document, lawyer.id, 'view')
+            for share in document.shares.all():
+                if not share.is_revoked:
+                    grant(document, share.shared_with_id, share.permission_level)
+            for appointment in document.related_appointments.all():
+                grant(document, appointment.lawyer_id, 'view')
+        return expected
+
+    def assertMatchesSources(self, message):
+        materialized = {(row.document_id, row.user_id): row.permission for row in DocumentAccess.objects.all()}
+        expected = self.expected()
+        self.assertEqual(materialized, expected, message)
+        public = set(Document.objects.filter(privacy_level='public').values_list('id', flat=True))
+        for user in User.objects.all():
+            readable = {document_id for document_id, user_id in expected if user_id == user.id} | public
+            self.assertEqual(set(Document.objects.filter(access.readable_by(user)).values_list('id', flat=True)),
+                             readable, message)
+
+    def test_random_changes_keep_the_table_in_line_with_the_sources(self):
+        for seed in range(4):
+            with self.subTest(seed=seed):
+                self.run_random_changes(random.Random(seed), steps=120)
+
+    def run_random_changes(self, rng, steps):
+        users = [User.objects.create_user(username=f'user-{rng.random()}') for _ in range(3)]
+        lawyers = [User.objects.create_user(username=f'lawyer-{rng.random()}', user_type='lawyer') for _ in range(3)]
+        documents = [self.document(rng.choice(users), rng.choice(['private', 'shared_with_lawyer', 'public']))
+                     for _ in range(4)]
+        appointments = [self.appointment(rng.choice(users), rng.choice(lawyers)) for _ in range(2)]
+
+        def share(document, lawyer):
+            existing = DocumentShare.objects.filter(document=document, shared_with=lawyer).first()
+            if existing:
+                existing.is_revoked = rng.random() < 0.5
+                existing.permission_level = rng.choice(['view', 'comment', 'edit'])
+                existing.save()
+                return f'reshared {document.id} with {lawyer.id}'
+            DocumentShare.objects.create(document=document, shared_by=document.user, shared_with=lawyer,
+                                         permission_level=rng.choice(['view', 'comment', 'edit']))
+            return f'shared {document.id} with {lawyer.id}'
+
+        def unshare(document, lawyer):
+            DocumentShare.objects.filter(document=document).delete()
+            return f'deleted shares of {document.id}'
+
+        def list_lawyer(document, lawyer):
+            if rng.random() < 0.5:
+                document.shared_with_lawyers.add(lawyer)
+            else:
+                lawyer.shared_documents.add(document)
+            return f'listed {lawyer.id} on {document.id}'
+
+        def unlist_lawyer(document, lawyer):
+            choice = rng.randrange(4)
+            if choice == 0:
+                document.shared_with_lawyers.remove(lawyer)
+            elif choice == 1:
+                lawyer.shared_documents.remove(document)
+            elif choice == 2:
+                document.shared_with_lawyers.clear()
+            else:
+                lawyer.shared_documents.clear()
+            return f'unlisted {lawyer.id} from {document.id} ({choice})'
+
+        def attach(document, lawyer):
+            appointment = rng.choice(appointments)
+            if rng.random() < 0.5:
+                appointment.documents_shared.add(document)
+            else:
+                document.related_appointments.add(appointment)
+            return f'attached {document.id} to appointment {appointment.id}'
+
+        def detach(document, lawyer):
+            appointment = rng.choice(appointments)
+            choice = rng.randrange(4)
+            if choice == 0:
+                appointment.documents_shared.remove(document)
+            elif choice == 1:
+                document.related_appointments.remove(appointment)
+            elif choice == 2:
+                appointment.documents_shared.clear()
+            else:
+                document.related_appointments.clear()
+            return f'detached {document.id} from appointment {appointment.id} ({choice})'
+
+        def reassign(document, lawyer):
+            appointment = rng.choice(appointments)
+            appointment.lawyer = lawyer
+            appointment.save()
+            return f'moved appointment {appointment.id} to {lawyer.id}'
+
+        def replace_appointment(document, lawyer):
+            appointment = appointments.pop(rng.randrange(len(appointments)))
+            appointment.delete()
+            appointments.append(self.appointment(rng.choice(users), lawyer))
+            return f'deleted appointment {appointment.id}'
+
+        def change_privacy(document, lawyer):
+            document.privacy_level = rng.choice(['private', 'shared_with_lawyer', 'public'])
+            document.save()
+            return f'made {document.id} {document.privacy_level}'
+
+        def change_owner(document, lawyer):
+            document.user = rng.choice(users + [lawyer])
+            document.save()
+            return f'gave {document.id} to {document.user_id}'
+
+        def replace_document(document, lawyer):
+            documents.remove(document)
+            document.delete()
+            documents.append(self.document(rng.choice(users)))
+            return f'deleted document {document.id}'
+
+        def replace_lawyer(document, lawyer):
+            lawyer_id = lawyer.id
+            lawyers.remove(lawyer)
+            # Appointments go first: deleting them by cascade is covered by replace_appointment
+            for appointment in [appointment for appointment in appointments if appointment.lawyer_id == lawyer_id]:
+                appointments.remove(appointment)
+                appointment.delete()
+                appointments.append(self.appointment(rng.choice(users), rng.choice(lawyers)))
+            lawyer.delete()
+            lawyers.append(User.objects.create_user(username=f'lawyer-{rng.random()}', user_type='lawyer'))
+            for owned in [owned for owned in documents if owned.user_id == lawyer_id]:
+                documents.remove(owned)
+                documents.append(self.document(rng.choice(users)))
+            return f'deleted lawyer {lawyer_id}'
+
+        changes = [share, share, unshare, list_lawyer, unlist_lawyer, attach, attach, detach, reassign,
+                   replace_appointment, change_privacy, change_privacy, change_owner, replace_document, replace_lawyer]
+        for step in range(steps):
+            message = rng.choice(changes)(rng.choice(documents), rng.choice(lawyers))
+            self.assertMatchesSources(f'step {step}: {message}')
+
+    def test_permission_check_is_one_lookup(self):
+        document = self.document(self.owner)
+        DocumentShare.objects.create(document=document, shared_by=self.owner, shared_with=self.lawyer,
+                                     permission_level='comment')
+        document.shared_with_lawyers.add(self.lawyer)
+        public = self.document(self.owner, 'public')
+
+        with self.assertNumQueries(1):
+            self.assertEqual(access.permission_of(self.lawyer, document), 'comment')
+        self.assertEqual(access.permission_of(self.owner, document), 'owner')
+        self.assertEqual(access.permission_of(self.lawyer, public), 'view')
+
+        document.privacy_level = 'private'
+        document.save()
+        self.assertIsNone(access.permission_of(self.lawyer, document))
+
+    def test_shared_with_me(self):
+        shared = self.document(self.owner)
+        appointment = self.appointment(self.owner, self.lawyer)
+        appointment.documents_shared.add(shared)
+        self.document(self.owner)
+        own = self.document(self.lawyer)
+
+        self.client.force_authenticate(self.lawyer)
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('documents:shared-with-me'))
+        self.assertEqual(response.data['count'], 1)
+        self.assertEqual(response.data['results'][0]['document']['id'], shared.id)
+        self.assertEqual(response.data['results'][0]['permission'], 'view')
+        self.assertNotIn(own.id, [result['document']['id'] for result in response.data['results']])
+
+    def test_rebuild_repairs_changes_that_bypassed_signals(self):
+        document = self.document(self.owner)
+        DocumentShare.objects.create(document=document, shared_by=self.owner, shared_with=self.lawyer)
+        Document.objects.filter(pk=document.pk).update(privacy_level='private')
+        self.assertTrue(DocumentAccess.objects.filter(document=document, user=self.lawyer).exists())
+
+        out = io.StringIO()
+        call_command('rebuild_document_access', stdout=out)
+        self.assertIn('Updated 1 document access rows', out.getvalue())
+        self.assertFalse(DocumentAccess.objects.filter(document=document, user=self.lawyer).exists())
+
+
+class DocumentListTests(TestCase):
+    WORDS = ('the tenant shall pay rent deposit landlord premises agreement clause notice month period '
+             'section court party lease term renewal arbitration dispute payment').split()
+
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner')
+        self.stranger = User.objects.create_user(username='stranger')
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def document(self, title, text=None, user=None):
+        document = Document.objects.create(
+            user=user or self.owner, title=title, file='raw/upload/v1/documents/x', file_size=1, file_type='pdf',
+        )
+        if text is not None:
+            DocumentAnalysis.objects.create(
+                document=document, extracted_text=text, word_count=len(text.split()),
+                processing_time=0, ai_model_used='test', confidence_score=1,
+            )
+            Document.objects.filter(pk=document.pk).update(is_analyzed=True, ai_summary=f'Summary of {title}')
+            search.index_document(document.pk, text)
+        return document
+
+    def legal_text(self, words, seed=0):
+        return ' '.join(random.Random(seed).choices(self.WORDS, k=words))
+
+    def test_list_page_leaves_text_and_analysis_unloaded(self):
+        for number in range(3):
+            self.document(f'Lease {number}', self.legal_text(2000, number))
+        self.document('Not mine', 'text', user=self.stranger)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('documents:list'))
+        self.assertEqual(len(queries), 2)  # count and page
+        for query in queries:
+            self.assertNotIn('ai_summary', query['sql'])
+            self.assertNotIn('documents_documentanalysis', query['sql'])
+        self.assertEqual(response.data['count'], 3)
+        self.assertEqual([result['title'] for result in response.data['results']], ['Lease 2', 'Lease 1', 'Lease 0'])
+
+    def test_detail_and_text_are_served_on_demand(self):
+        text = self.legal_text(500)
+        lease = self.document('Lease', text)
+        pending = self.document('Pending')
+
+        detail = self.client.get(reverse('documents:detail', args=[lease.id])).data
+        self.assertEqual((detail['ai_summary'], detail['permission']), ('Summary of Lease', 'owner'))
+        self.assertNotIn('text', detail)
+        served = self.client.get(reverse('documents:text', args=[lease.id])).data
+        self.assertEqual((served['text'], served['word_count']), (text, 500))
+        self.assertEqual(self.client.get(reverse('documents:text', args=[pending.id])).status_code, 404)
+
+        self.client.force_authenticate(self.stranger)
+        self.assertEqual(self.client.get(reverse('documents:detail', args=[lease.id])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('documents:text', args=[lease.id])).status_code, 404)
+
+    def test_extracted_text_is_stored_once_compressed(self):
+        text = self.legal_text(20000)
+        lease = self.document('Lease', text)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT length(extracted_text) FROM documents_documentanalysis WHERE document_id = %s',
+                           [lease.id])
+            [stored] = cursor.fetchone()
+        self.assertLess(stored, len(text) / 3)
+        self.assertFalse(any(field.name == 'ai_extracted_text' for field in Document._meta.get_fields()))
+
+        # Saving the document keeps its indexed text without reading it back
+        lease.title = 'Registered lease'
+        with CaptureQueriesContext(connection) as queries:
+            lease.save()
+        self.assertFalse(any('documents_documentanalysis' in query['sql'] for query in queries))
+        self.assertEqual([hit[0] for hit in search.search(self.owner, 'registered arbitration')[1]], [lease.id])
+
+    @BENCHMARKS
+    def test_benchmark_list_page_with_1mb_texts(self):
+        texts = [self.legal_text(160000, seed) for seed in range(4)]
+        documents = [self.document(f'Bundle {number}', texts[number % 4]) for number in range(40)]
+        self.assertGreater(len(texts[0]), 1024 * 1024)
+
+        def timed(url, repeat=20):
+            started = clock.perf_counter()
+            for _ in range(repeat):
+                self.assertEqual(self.client.get(url).status_code, 200)
+            return (clock.perf_counter() - started) / repeat * 1000
+
+        page = timed(reverse('documents:list'))
+        detail = timed(reverse('documents:detail', args=[documents[0].id]))
+        text = timed(reverse('documents:text', args=[documents[0].id]), repeat=5)
+        print(f'\nList page of 20 documents with 1 MB texts: {page:.1f} ms; detail {detail:.1f} ms; '
+              f'text {text:.1f} ms')
+        self.assertLess(page, 100)
+
+
+class BundleReader(io.RawIOBase):
+    """A seekable view of a bundle that only produces the bytes that are read"""
+
+    def __init__(self, bundle):
+        self.bundle, self.position = bundle, 0
+
+    def seekable(self):
+        return True
+
+    def readable(self):
+        return True
+
+    def seek(self, offset, whence=0):
+        self.position = {0: 0, 1: self.position, 2: self.bundle.length}[whence] + offset
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def read(self, size=-1):
+        end = self.bundle.length if size < 0 else self.position + size
+        data = b''.join(self.bundle.iter_bytes(self.position, end))
+        self.position += len(data)
+        return data
+
+
+@override_settings(UPLOAD_STORAGE_BACKEND='nyayabot_backend.storage.LocalStorageBackend')
+class AppointmentBundleTests(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.owner = User.objects.create_user(username='owner')
+        self.lawyer = User.objects.create_user(username='lawyer', user_type='lawyer')
+        self.appointment = Appointment.objects.create(
+            user=self.owner, lawyer=self.lawyer, title='Property dispute', description='Sale deed',
+            requested_date=timezone.localdate(), requested_time='10:00',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.lawyer)
+        self.url = reverse('appointments:documents-bundle', args=[self.appointment.id])
+
+    def stored(self, title, content=b'', size=None, privacy_level='shared_with_lawyer'):
+        """A document shared for the appointment; ``size`` makes a sparse file of zeros"""
+        document = Document.objects.create(
+            user=self.owner, title=title, privacy_level=privacy_level, file='raw/upload/v1/documents/pending',
+            file_size=len(content) if size is None else size, file_type='pdf',
+        )
+        public_id = f'documents/bundle-{document.id}'
+        path = LocalStorageBackend().path(public_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as destination:
+            destination.write(content)
+            if size is not None:
+                destination.truncate(size)
+        Document.objects.filter(pk=document.pk).update(file=f'raw/upload/v1/{public_id}')
+        self.appointment.documents_shared.add(document)
+        return document
+
+    def download(self, **headers):
+        response = self.client.get(self.url, **headers)
+        return response, b''.join(response.streaming_content) if response.streaming else None
+
+    def test_zip_of_the_documents_the_user_may_read(self):
+        self.stored('Sale deed', PDF_HEADER + b'deed ' * 1000)
+        self.stored('Sale deed', PDF_HEADER + b'copy ' * 10)
+        self.stored('Encumbrance certificate', PDF_HEADER + b'certificate')
+        self.stored('Personal notes', PDF_HEADER + b'notes', privacy_level='private')
+
+        response, content = self.download()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(int(response['Content-Length']), len(content))
+        with zipfile.ZipFile(io.BytesIO(content)) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(archive.namelist(), ['Sale deed.pdf', 'Sale deed (2).pdf', 'Encumbrance certificate.pdf'])
+            self.assertEqual(archive.read('Sale deed (2).pdf'), PDF_HEADER + b'copy ' * 10)
+
+        # The owner also gets their private document
+        self.client.force_authenticate(self.owner)
+        with zipfile.ZipFile(io.BytesIO(self.download()[1])) as archive:
+            self.assertIn('Personal notes.pdf', archive.namelist())
+
+        self.client.force_authenticate(User.objects.create_user(username='stranger'))
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_interrupted_download_resumes_with_a_range(self):
+        documents = [self.stored(f'Exhibit {number}', PDF_HEADER + bytes([number]) * 5000) for number in range(3)]
+        response, full = self.download()
+        etag = response['ETag']
+        self.assertTrue(all(document.crc32 is not None for document in Document.objects.filter(pk__in=[
+            document.id for document in documents
+        ])))
+
+        response, tail = self.download(HTTP_RANGE='bytes=7000-', HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 7000-{len(full) - 1}/{len(full)}')
+        self.assertEqual(tail, full[7000:])
+        self.assertEqual(self.download(HTTP_RANGE='bytes=-22')[1], full[-22:])
+
+        # Without stored CRCs the files are read to rebuild the directory
+        Document.objects.update(crc32=None)
+        self.assertEqual(self.download(HTTP_RANGE='bytes=100-199')[1], full[100:200])
+        self.assertEqual(self.download(HTTP_RANGE=f'bytes={len(full) - 500}-')[1], full[-500:])
+
+        self.assertEqual(self.download(HTTP_RANGE='bytes=10-', HTTP_IF_RANGE='"stale"')[0].status_code, 200)
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={len(full)}-')
+        self.assertEqual((response.status_code, response['Content-Range']), (416, f'bytes */{len(full)}'))
+
+    def test_1gb_bundle_streams_under_a_fixed_memory_ceiling(self):
+        part = 256 * 1024 * 1024
+        for number in range(4):
+            self.stored(f'Case file volume {number + 1}', size=part)
+
+        response = self.client.get(self.url)
+        self.assertEqual(int(response['Content-Length']), 4 * part + 4 * (30 + 22 + 16) + 4 * (46 + 22) + 22)
+        tracemalloc.start()
+        try:
+            received = sum(len(block) for block in response.streaming_content)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(received, int(response['Content-Length']))
+        self.assertLess(peak, 2 * 1024 * 1024)
+
+        # A resumed download of the directory reads no file data: the CRCs were kept
+        documents = list(Document.objects.order_by('id'))
+        with mock.patch.object(LocalStorageBackend, 'open', side_effect=AssertionError('file read')):
+            with zipfile.ZipFile(BundleReader(bundles.Bundle(documents))) as archive:
+                self.assertEqual([info.file_size for info in archive.infolist()], [part] * 4)
+                zeros, crc = bytes(1024 * 1024), 0
+                for _ in range(part // len(zeros)):
+                    crc = zlib.crc32(zeros, crc)
+                self.assertEqual({info.CRC for info in archive.infolist()}, {crc})
+
+    def test_files_over_4gb_use_zip64(self):
+        small = self.stored('Index', PDF_HEADER)
+        huge = self.stored('Scanned records', size=5 * 1024 ** 3)
+        Document.objects.filter(pk=huge.pk).update(crc32=1234)
+        after = self.stored('Affidavit', PDF_HEADER + b'affidavit')
+
+        bundle = bundles.Bundle(list(Document.objects.order_by('id')))
+        with zipfile.ZipFile(BundleReader(bundle)) as archive:
+            self.assertEqual([info.file_size for info in archive.infolist()], [len(PDF_HEADER), 5 * 1024 ** 3, 18])
+            self.assertEqual(archive.read('Index.pdf'), PDF_HEADER)
+            # The entry after the huge file has a ZIP64 offset
+            self.assertEqual(archive.read('Affidavit.pdf'), PDF_HEADER + b'affidavit')
+        self.assertEqual(Document.objects.get(pk=small.pk).crc32, zlib.crc32(PDF_HEADER))
+        self.assertIsNotNone(Document.objects.get(pk=after.pk).crc32)
+
+
+class SimilarDocumentsTests(TestCase):
+    WORDS = ('lessor lessee premises rent deposit month notice term renewal arbitration clause party agreement '
+             'maintenance society charges electricity water tax registration stamp duty possession vacate '
+             'sublet repair damage indemnity jurisdiction court mumbai pune delhi witness schedule').split()
+
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner')
+        self.lawyer = User.objects.create_user(username='lawyer', user_type='lawyer')
+        self.colleague = User.objects.create_user(username='colleague', user_type='lawyer')
+        self.client = APIClient()
+        self.client.force_authenticate(self.lawyer)
+        self.lease = self.text(900, seed=1)
+
+    def text(self, words, seed):
+        return ' '.join(random.Random(seed).choices(self.WORDS, k=words))
+
+    def edited(self, text, changes, seed):
+        words, rng = text.split(), random.Random(seed)
+        for _ in range(changes):
+            words[rng.randrange(len(words))] = 'amended'
+        return ' '.join(words)
+
+    def analysed(self, user, title, text, privacy_level='shared_with_lawyer', issues=()):
+        document = Document.objects.create(
+            user=user, title=title, document_type='lease_deed', privacy_level=privacy_level,
+            file='raw/upload/v1/documents/x', file_size=1, file_type='pdf', is_analyzed=True,
+        )
+        DocumentAnalysis.objects.create(
+            document=document, extracted_text=text, potential_issues=list(issues),
+            processing_time=0, ai_model_used='test', confidence_score=1,
+        )
+        similarity.index_document(document.pk, text)
+        return document
+
+    def test_estimate_tracks_the_jaccard_similarity(self):
+        first, second = self.lease, self.edited(self.lease, 15, seed=2)
+        shingles = similarity.shingles(first), similarity.shingles(second)
+        jaccard = len(shingles[0] & shingles[1]) / len(shingles[0] | shingles[1])
+        signatures = [similarity.pack(similarity.minhash(hashes)) for hashes in shingles]
+        self.assertEqual(len(signatures[0]), 256)
+        self.assertAlmostEqual(similarity.estimate(*signatures), jaccard, delta=0.12)
+        self.assertLess(similarity.estimate(signatures[0], similarity.pack(similarity.minhash(
+            similarity.shingles(self.text(900, seed=3))
+        ))), 0.1)
+
+    def test_similar_documents_with_their_review_notes(self):
+        shared = self.analysed(self.owner, 'Leave and licence', self.lease)
+        reviewed = self.analysed(self.owner, 'Leave and licence (old)', self.edited(self.lease, 10, seed=4),
+                                 issues=['No lock-in period'])
+        DocumentComment.objects.create(document=reviewed, user=self.lawyer, comment='Check the escalation clause')
+        DocumentComment.objects.create(document=reviewed, user=self.colleague, comment='Client is late', is_internal=True)
+        self.analysed(self.owner, 'Private copy', self.lease, privacy_level='private')
+        self.analysed(self.owner, 'Unrelated', self.text(900, seed=5))
+        for document in Document.objects.filter(privacy_level='shared_with_lawyer'):
+            document.shared_with_lawyers.add(self.lawyer)
+
+        with self.assertNumQueries(7):
+            response = self.client.get(reverse('documents:similar', args=[shared.id]))
+        [result] = response.data['results']
+        self.assertEqual(result['id'], reviewed.id)
+        self.assertGreater(result['similarity'], 0.7)
+        self.assertEqual(result['potential_issues'], ['No lock-in period'])
+        self.assertEqual([comment['comment'] for comment in result['comments']], ['Check the escalation clause'])
+
+        # The owner also sees the private copy, identical to the document
+        self.client.force_authenticate(self.owner)
+        results = self.client.get(reverse('documents:similar', args=[shared.id])).data['results']
+        self.assertEqual([result['title'] for result in results], ['Private copy', 'Leave and licence (old)'])
+        self.assertEqual(results[0]['similarity'], 1.0)
+
+        # A document deleted between scoring and loading is left out
+        scored = similarity.similar(self.owner, shared)
+        with mock.patch.object(similarity, 'similar', return_value=[(999999, 0.99)] + scored):
+            results = self.client.get(reverse('documents:similar', args=[shared.id])).data['results']
+        self.assertEqual([result['title'] for result in results], ['Private copy', 'Leave and licence (old)'])
+
+        self.client.force_authenticate(self.colleague)
+        self.assertEqual(self.client.get(reverse('documents:similar', args=[shared.id])).status_code, 404)
+
+    @BENCHMARKS
+    def test_benchmark_lookup_over_a_million_documents(self):
+        count = int(os.environ.get('NYAYABOT_SIMILARITY_DOCUMENTS', 1000000))
+        with connection.cursor() as cursor:
+            # Unrelated public documents with random signatures and buckets, written in bulk
+            cursor.execute(
+                'WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < %s) '
+                'INSERT INTO documents_document (user_id, title, document_type, file, file_size, file_type, '
+                'privacy_level, is_analyzed, ai_key_points, ai_legal_issues, created_at, updated_at) '
+                "SELECT %s, 'Agreement ' || i, 'agreement', 'raw/upload/v1/documents/x', 1, 'pdf', 'public', 1, "
+                "'[]', '[]', datetime('now'), datetime('now') FROM n",
+                [count, self.owner.id],
+            )
+            cursor.execute(
+                'INSERT INTO documents_documentsignature (document_id, minhash, shingle_count, created_at) '
+                "SELECT id, randomblob(256), 900, datetime('now') FROM documents_document"
+            )
+            cursor.execute(
+                'WITH RECURSIVE band(b) AS (SELECT 1 UNION ALL SELECT b + 1 FROM band WHERE b < %s) '
+                'INSERT INTO documents_similaritybucket (key, document_id) '
+                'SELECT random(), id FROM documents_document, band',
+                [similarity.BANDS],
+            )
+        lease = self.analysed(self.owner, 'Lease', self.lease, privacy_level='public')
+        for seed in range(20):
+            self.analysed(self.owner, f'Lease {seed}', self.edited(self.lease, 20, seed), privacy_level='public')
+
+        started = clock.perf_counter()
+        for _ in range(50):
+            found = similarity.similar(self.lawyer, lease)
+        elapsed = (clock.perf_counter() - started) / 50 * 1000
+        print(f'\nSimilar documents among {count + 21} documents: {elapsed:.2f} ms per lookup')
+        self.assertEqual(len(found), 10)
+        self.assertLess(elapsed, 50)
@@ -0,0 +1,242 @@
+"""
+Chunked, resumable document uploads.
+
+A client opens an ``UploadSession`` declaring the file's size, then sends the
+bytes in any number of ``PUT`` requests, each starting at the session's
+current offset (``Upload-Offset`` header). Chunks are streamed from the
+request straight into a temporary file in ``DOCUMENT_UPLOAD_TEMP_DIR`` in
+``READ_BLOCK`` pieces, so memory use does not depend on the chunk or file
+size. An interrupted upload resumes from ``received_bytes``.
+
+The file type is detected from the magic bytes of the first chunk (a ZIP
+archive is only accepted as a .docx at completion, once its directory shows a
+Word document part) and the SHA-256 of the content is computed while the chunks arrive. The running
+hash lives in this process; when a chunk lands on another worker (or after a
+restart) the hash is rebuilt from the temporary file. Only ``complete``
+creates the ``Document``, storing the file as a content-addressed
+``DocumentBlob`` unless identical bytes are already stored. The file is only
+stored while the session row is locked and marked completed, so concurrent
+completions of one session store it once.
+"""
+import fcntl
+import hashlib
+import os
+import threading
+import zipfile
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .dedupe import store_blob
+from .models import Document, UploadSession
+
+READ_BLOCK = 64 * 1024
+
+# (signature, offset, file type); longest signatures first
+MAGIC_NUMBERS = [
+    (b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 0, 'doc'),
+    (b'\x89PNG\r\n\x1a\n', 0, 'png'),
+    (b'%PDF-', 0, 'pdf'),
+    (b'PK\x03\x04', 0, 'docx'),
+    (b'II*\x00', 0, 'tiff'),
+    (b'MM\x00*', 0, 'tiff'),
+    (b'\xff\xd8\xff', 0, 'jpg'),
+]
+MAGIC_BYTES_NEEDED = max(len(signature) + offset for signature, offset, _ in MAGIC_NUMBERS)
+
+
+class UploadError(Exception):
+    """A chunk or completion request that can't be accepted"""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def detect_file_type(head):
+    for signature, offset, file_type in MAGIC_NUMBERS:
+        if head[offset:offset + len(signature)] == signature:
+            return file_type
+    return None
+
+
+def is_docx(path):
+    """Whether the ZIP archive at ``path`` is a Word document rather than any other archive"""
+    try:
+        with zipfile.ZipFile(path) as archive:
+            return 'word/document.xml' in archive.namelist()
+    except zipfile.BadZipFile:
+        return False
+
+
+def temp_path(session):
+    return os.path.join(settings.DOCUMENT_UPLOAD_TEMP_DIR, f'{session.id}.part')
+
+
+class _Hashers:
+    """Running SHA-256 objects of the sessions this process has been receiving, keyed by session id"""
+
+    def __init__(self, limit=256):
+        self.limit = limit
+        self.lock = threading.Lock()
+        self.items = OrderedDict()
+
+    def take(self, session_id, offset):
+        """The hasher positioned at ``offset``, or None if this process doesn't have it"""
+        with self.lock:
+            entry = self.items.pop(session_id, None)
+        if entry and entry[0] == offset:
+            return entry[1]
+        return None
+
+    def put(self, session_id, offset, hasher):
+        with self.lock:
+            self.items[session_id] = (offset, hasher)
+            while len(self.items) > self.limit:
+                self.items.popitem(last=False)
+
+    def discard(self, session_id):
+        with self.lock:
+            self.items.pop(session_id, None)
+
+
+hashers = _Hashers()
+
+
+def _rehash(path, length):
+    """Rebuild the running hash of the first ``length`` bytes of a partial upload"""
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as source:
+        remaining = length
+        while remaining:
+            block = source.read(min(READ_BLOCK, remaining))
+            if not block:
+                break
+            hasher.update(block)
+            remaining -= len(block)
+    return hasher
+
+
+def open_session(user, filename, total_size, **details):
+    if total_size > settings.DOCUMENT_UPLOAD_MAX_BYTES:
+        raise UploadError('File is too large', 413)
+    session = UploadSession.objects.create(
+        user=user, filename=filename, total_size=total_size,
+        expires_at=timezone.now() + settings.DOCUMENT_UPLOAD_SESSION_TTL, **details
+    )
+    os.makedirs(settings.DOCUMENT_UPLOAD_TEMP_DIR, exist_ok=True)
+    open(temp_path(session), 'wb').close()
+    return session
+
+
+def write_chunk(session, offset, stream, length):
+    """Append ``length`` bytes read from ``stream`` at ``offset`` and return the new offset"""
+    if session.status != 'active' or session.expires_at <= timezone.now():
+        raise UploadError('Upload session is no longer active', 410)
+    if offset != session.received_bytes:
+        raise UploadError(f'Expected offset {session.received_bytes}', 409)
+    if length > settings.DOCUMENT_UPLOAD_MAX_CHUNK_BYTES:
+        raise UploadError('Chunk is too large', 413)
+    if offset + length > session.total_size:
+        raise UploadError('Chunk exceeds the declared file size', 413)
+
+    path = temp_path(session)
+    with open(path, 'r+b') as destination:
+        try:
+            # One writer per session; a concurrent chunk for the same session is rejected, not interleaved
+            fcntl.flock(destination, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise UploadError('Another chunk of this upload is being written', 409)
+        session.refresh_from_db(fields=['received_bytes', 'file_type'])
+        if offset != session.received_bytes:
+            raise UploadError(f'Expected offset {session.received_bytes}', 409)
+
+        hasher = hashers.take(session.id, offset) or _rehash(path, offset)
+        destination.seek(offset)
+        received = 0
+        head = b'' if offset == 0 else None
+        while received < length:
+            block = stream.read(min(READ_BLOCK, length - received))
+            if not block:
+                break
+            received += len(block)
+            if head is not None:
+                head += block[:MAGIC_BYTES_NEEDED - len(head)]
+                if len(head) >= MAGIC_BYTES_NEEDED or received == length:
+                    # Reject a wrong type before writing anything
+                    session.file_type = detect_file_type(head)
+                    if session.file_type not in settings.DOCUMENT_UPLOAD_ALLOWED_TYPES:
+                        raise UploadError('Unsupported file type', 415)
+                    head = None
+            destination.write(block)
+            hasher.update(block)
+
+        if received != length:
+            destination.truncate(offset)
+            raise UploadError('Chunk was shorter than its Content-Length')
+        destination.truncate(offset + received)
+
+        session.received_bytes = offset + received
+        session.expires_at = timezone.now() + settings.DOCUMENT_UPLOAD_SESSION_TTL
+        session.save(update_fields=['received_bytes', 'file_type', 'expires_at', 'updated_at'])
+        hashers.put(session.id, session.received_bytes, hasher)
+    return session.received_bytes
+
+
+def complete_session(session):
+    """Store the finished file, once per distinct content, and create its ``Document``"""
+    if session.status != 'active':
+        raise UploadError('Upload session is no longer active', 410)
+    if session.received_bytes != session.total_size:
+        raise UploadError(f'Only {session.received_bytes} of {session.total_size} bytes were received', 409)
+
+    path = temp_path(session)
+    with transaction.atomic():
+        session = UploadSession.objects.select_for_update().get(pk=session.pk)
+        if session.status != 'active':
+            raise UploadError('Upload session is no longer active', 410)
+        if session.file_type == 'docx' and not is_docx(path):
+            session.status = 'aborted'
+            session.save(update_fields=['status', 'updated_at'])
+        else:
+            hasher = hashers.take(session.id, session.received_bytes) or _rehash(path, session.received_bytes)
+            session.status = 'completed'
+            session.sha256 = hasher.hexdigest()
+            session.save(update_fields=['status', 'sha256', 'updated_at'])
+            # A failed store rolls the session back to active, so completing can be retried
+            blob = store_blob(path, session.sha256, session.total_size, session.file_type)
+            session.document = Document.objects.create(
+                user=session.user, title=session.title, description=session.description,
+                document_type=session.document_type, privacy_level=session.privacy_level,
+                file=blob.file, blob=blob, file_size=session.total_size, file_type=session.file_type,
+            )
+            session.save(update_fields=['document', 'updated_at'])
+    hashers.discard(session.id)
+    _remove(path)
+    if session.status == 'aborted':
+        raise UploadError('Unsupported file type', 415)
+    return session
+
+
+def abort_session(session):
+    UploadSession.objects.filter(pk=session.pk, status='active').update(status='aborted', updated_at=timezone.now())
+    hashers.discard(session.id)
+    _remove(temp_path(session))
+
+
+def purge_expired_sessions(now=None):
+    """Abort active sessions past their expiry and delete their temporary files"""
+    now = now or timezone.now()
+    expired = list(UploadSession.objects.filter(status='active', expires_at__lt=now))
+    for session in expired:
+        abort_session(session)
+    return len(expired)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -1,8 +1,22 @@
 from django.urls import path
+from .views import (
+    analysis_job_detail, analyze_document, complete_upload, create_upload_session, document_detail, document_list,
+    document_text, search_documents, shared_with_me, similar_documents, upload_chunk, upload_session_detail,
+)
 
 app_name = 'documents'
 
 urlpatterns = [
-    # Document URLs will be implemented
-    # path('', document_views, name='documents'),
-]
\ No newline at end of file
+    path('', document_list, name='list'),
+    path('<int:pk>/', document_detail, name='detail'),
+    path('<int:pk>/text/', document_text, name='text'),
+    path('<int:pk>/similar/', similar_documents, name='similar'),
+    path('uploads/', create_upload_session, name='upload-sessions'),
+    path('uploads/<uuid:pk>/', upload_session_detail, name='upload-session'),
+    path('uploads/<uuid:pk>/chunk/', upload_chunk, name='upload-chunk'),
+    path('uploads/<uuid:pk>/complete/', complete_upload, name='upload-complete'),
+    path('<int:pk>/analyze/', analyze_document, name='analyze'),
+    path('analysis-jobs/<int:pk>/', analysis_job_detail, name='analysis-job'),
+    path('search/', search_documents, name='search'),
+    path('shared-with-me/', shared_with_me, name='shared-with-me'),
+]
@@ -1,3 +1,205 @@
-from django.shortcuts import render
+from django.conf import settings
+from django.shortcuts import get_object_or_404
+from rest_framework import permissions, status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from . import access, analysis, search, similarity, uploads
+from .models import AnalysisJob, Document, UploadSession
+from .serializers import (
+    AnalysisJobSerializer, DocumentDetailSerializer, DocumentSerializer, SharedDocumentSerializer,
+    UploadSessionCreateSerializer, UploadSessionSerializer,
+)
 
 # Create your views here.
+
+def _upload_error(error):
+    return Response({'error': str(error)}, status=error.status_code)
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def create_upload_session(request):
+    """Start a resumable upload; chunks are then PUT to the session's chunk URL"""
+    serializer = UploadSessionCreateSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    try:
+        session = uploads.open_session(request.user, **serializer.validated_data)
+    except uploads.UploadError as e:
+        return _upload_error(e)
+    
+    return Response({
+        **UploadSessionSerializer(session).data,
+        'max_chunk_bytes': settings.DOCUMENT_UPLOAD_MAX_CHUNK_BYTES,
+    }, status=status.HTTP_201_CREATED)
+
+@api_view(['GET', 'DELETE'])
+@permission_classes([permissions.IsAuthenticated])
+def upload_session_detail(request, pk):
+    """Current offset of an upload to resume from, or DELETE to abort it"""
+    session = get_object_or_404(UploadSession, pk=pk, user=request.user)
+    if request.method == 'DELETE':
+        uploads.abort_session(session)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+    return Response(UploadSessionSerializer(session).data)
+
+@api_view(['PUT'])
+@permission_classes([permissions.IsAuthenticated])
+def upload_chunk(request, pk):
+    """Stream the raw request body into the upload at the ``Upload-Offset`` header"""
+    session = get_object_or_404(UploadSession, pk=pk, user=request.user)
+    try:
+        offset = int(request.headers['Upload-Offset'])
+        length = int(request.headers['Content-Length'])
+    except (KeyError, ValueError):
+        return Response({'error': 'Upload-Offset and Content-Length headers are required'},
+                        status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        received = uploads.write_chunk(session, offset, request.stream, length)
+    except uploads.UploadError as e:
+        response = _upload_error(e)
+        response['Upload-Offset'] = session.received_bytes
+        return response
+    
+    response = Response({'received_bytes': received, 'total_size': session.total_size})
+    response['Upload-Offset'] = received
+    return response
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def complete_upload(request, pk):
+    """Turn a fully received upload into a Document"""
+    session = get_object_or_404(UploadSession, pk=pk, user=request.user)
+    try:
+        session = uploads.complete_session(session)
+    except uploads.UploadError as e:
+        return _upload_error(e)
+    analysis.enqueue(session.document)
+    return Response(UploadSessionSerializer(session).data, status=status.HTTP_201_CREATED)
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def analyze_document(request, pk):
+    """Queue (or retry) the analysis of one of the user's documents"""
+    document = get_object_or_404(Document, pk=pk, user=request.user)
+    job = analysis.enqueue(document)
+    return Response(AnalysisJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def analysis_job_detail(request, pk):
+    """Poll the progress of an analysis job"""
+    job = get_object_or_404(AnalysisJob, pk=pk, document__user=request.user)
+    return Response(AnalysisJobSerializer(job).data)
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def search_documents(request):
+    """Ranked full-text search over the documents the user may read"""
+    query = request.query_params.get('q', '').strip()
+    if not query:
+        return Response({'error': 'q is required'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        page = max(int(request.query_params.get('page', 1)), 1)
+    except ValueError:
+        return Response({'error': 'Invalid page'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    page_size = settings.DOCUMENT_SEARCH_PAGE_SIZE
+    total, hits = search.search(request.user, query, limit=page_size, offset=(page - 1) * page_size)
+    documents = Document.objects.only('id', 'title', 'document_type', 'file_type', 'created_at').in_bulk(
+        [document_id for document_id, _, _ in hits]
+    )
+    results = []
+    for document_id, snippet, rank in hits:
+        document = documents.get(document_id)
+        if document is None:
+            # Deleted since the search
+            continue
+        results.append({
+            'id': document.id,
+            'title': document.title,
+            'document_type': document.document_type,
+            'file_type': document.file_type,
+            'created_at': document.created_at,
+            'snippet': snippet,
+            'score': round(-rank, 4),
+        })
+    return Response({'count': total, 'page': page, 'results': results})
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def shared_with_me(request):
+    """Documents other users have shared with the user, most recently shared first"""
+    shared = access.shared_with(request.user).select_related('document').order_by('-id')
+    paginator = PageNumberPagination()
+    page = paginator.paginate_queryset(shared, request)
+    return paginator.get_paginated_response(SharedDocumentSerializer(page, many=True).data)
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def document_list(request):
+    """The user's documents, newest first, without their analysis results"""
+    documents = Document.objects.filter(user=request.user).only(*DocumentSerializer.Meta.fields).order_by(
+        '-created_at', '-id'
+    )
+    paginator = PageNumberPagination()
+    page = paginator.paginate_queryset(documents, request)
+    return paginator.get_paginated_response(DocumentSerializer(page, many=True).data)
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def document_detail(request, pk):
+    """A readable document with its analysis summary; the extracted text is served by document_text"""
+    document = get_object_or_404(
+        Document.objects.filter(access.readable_by(request.user)).only(*DocumentDetailSerializer.Meta.fields), pk=pk
+    )
+    data = DocumentDetailSerializer(document).data
+    data['permission'] = access.permission_of(request.user, document)
+    return Response(data)
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def document_text(request, pk):
+    """The full extracted text of a readable document"""
+    document = get_object_or_404(
+        Document.objects.filter(access.readable_by(request.user)).only('id', 'blob_id'), pk=pk
+    )
+    stored = document.stored_analysis().values_list('extracted_text', 'word_count', 'language_detected').first()
+    if stored is None:
+        return Response({'error': 'Document has not been analysed'}, status=status.HTTP_404_NOT_FOUND)
+    text, word_count, language = stored
+    return Response({'id': document.id, 'word_count': word_count, 'language': language, 'text': text})
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def similar_documents(request, pk):
+    """Readable near-duplicates of a readable document, with their issues and comments"""
+    document = get_object_or_404(Document.objects.filter(access.readable_by(request.user)).only('id'), pk=pk)
+    scored = similarity.similar(request.user, document)
+    documents = Document.objects.only('id', 'blob_id', 'title', 'document_type', 'file_type', 'created_at').in_bulk(
+        [document_id for document_id, _ in scored]
+    )
+    notes = similarity.review_notes(request.user, documents.values())
+    results = []
+    for document_id, score in scored:
+        similar = documents.get(document_id)
+        if similar is None:
+            # Deleted since it was scored
+            continue
+        issues, comments = notes[document_id]
+        results.append({
+            'id': similar.id,
+            'title': similar.title,
+            'document_type': similar.document_type,
+            'file_type': similar.file_type,
+            'created_at': similar.created_at,
+            'similarity': score,
+            'potential_issues': issues,
+            'comments': [{
+                'user': comment.user.username,
+                'comment': comment.comment,
+                'is_internal': comment.is_internal,
+                'created_at': comment.created_at,
+            } for comment in comments],
+        })
+    return Response({'document': document.id, 'results': results})
@@ -0,0 +1,34 @@
+"""
+Directory cache for public lawyer pages.
+
+Entries are keyed by lawyer profile id and deleted whenever something that
+appears on the page changes (profile edits, ratings, moderation, the
+lawyer's user record and, later, their availability).
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+
+def lawyer_detail_key(profile_id):
+    return f'lawyer-directory:detail:{profile_id}'
+
+
+def get_lawyer_detail(profile_id, build):
+    """Return the cached page payload for ``profile_id``, building it with ``build()`` on a miss"""
+    key = lawyer_detail_key(profile_id)
+    data = cache.get(key)
+    if data is None:
+        data = build()
+        if data is not None:
+            cache.set(key, data, settings.LAWYER_DIRECTORY_CACHE_TIMEOUT)
+    return data
+
+
+def invalidate_lawyer(*profile_ids):
+    cache.delete_many([lawyer_detail_key(profile_id) for profile_id in profile_ids])
+
+
+def invalidate_lawyer_user(*user_ids):
+    """Invalidate pages of lawyers identified by their user ids"""
+    from .models import LawyerProfile
+    invalidate_lawyer(*LawyerProfile.objects.filter(user_id__in=user_ids).values_list('id', flat=True))
@@ -0,0 +1,26 @@
+import django_filters
+from .models import LawyerProfile
+
+
+class JSONListContainsFilter(django_filters.CharFilter):
+    """Match profiles whose JSON list field contains the given value.
+
+    JSON ``contains`` isn't available on SQLite, so match the quoted element
+    inside the serialized list instead.
+    """
+
+    def filter(self, qs, value):
+        if not value:
+            return qs
+        return qs.filter(**{f'{self.field_name}__icontains': f'"{value}"'})
+
+
+class PublicLawyerFilter(django_filters.FilterSet):
+    specializations = JSONListContainsFilter(field_name='specializations')
+    languages_spoken = JSONListContainsFilter(field_name='languages_spoken')
+    min_experience = django_filters.NumberFilter(field_name='years_of_experience', lookup_expr='gte')
+    max_fee = django_filters.NumberFilter(field_name='consultation_fee', lookup_expr='lte')
+
+    class Meta:
+        model = LawyerProfile
+        fields = ['specializations', 'languages_spoken', 'years_of_experience', 'consultation_fee']
@@ -1,17 +1,24 @@
 from rest_framework import serializers
 from .models import LawyerProfile, LawyerRating
-from authentication.serializers import UserSerializer
+from authentication.serializers import UserSummarySerializer
+from nyayabot_backend.storage import SignedUploadField, SignedUploadSerializerMixin, image_derivatives
 
 class LawyerProfileSerializer(serializers.ModelSerializer):
-    user = UserSerializer(read_only=True)
+    user = UserSummarySerializer(read_only=True)
     
     class Meta:
         model = LawyerProfile
         fields = '__all__'
         read_only_fields = ('user', 'status', 'average_rating', 'total_reviews', 
-                          'total_consultations', 'verified_by', 'verification_date')
+                          'total_consultations', 'verified_by', 'verification_date',
+                          'bar_council_certificate', 'identity_proof', 'degree_certificate')
 
-class LawyerProfileCreateSerializer(serializers.ModelSerializer):
+class LawyerProfileCreateSerializer(SignedUploadSerializerMixin, serializers.ModelSerializer):
+    # Verification documents are uploaded directly to storage; only the confirmations come through here
+    bar_council_certificate = SignedUploadField()
+    identity_proof = SignedUploadField(required=False, allow_null=True)
+    degree_certificate = SignedUploadField(required=False, allow_null=True)
+    
     class Meta:
         model = LawyerProfile
         fields = ('bar_council_id', 'bar_council_certificate', 'specializations', 
@@ -24,14 +31,40 @@ class LawyerProfileCreateSerializer(serializers.ModelSerializer):
         validated_data['user'] = self.context['request'].user
         return super().create(validated_data)
 
+class LawyerDocumentUploadSerializer(SignedUploadSerializerMixin, serializers.ModelSerializer):
+    """Replace verification documents on an existing profile with confirmed direct uploads"""
+    bar_council_certificate = SignedUploadField(required=False)
+    identity_proof = SignedUploadField(required=False, allow_null=True)
+    degree_certificate = SignedUploadField(required=False, allow_null=True)
+    
+    class Meta:
+        model = LawyerProfile
+        fields = ('bar_council_certificate', 'identity_proof', 'degree_certificate')
+
 class LawyerRatingSerializer(serializers.ModelSerializer):
-    user = UserSerializer(read_only=True)
+    user = UserSummarySerializer(read_only=True)
     
     class Meta:
         model = LawyerRating
         fields = '__all__'
         read_only_fields = ('user',)
 
+class LawyerReviewSerializer(serializers.ModelSerializer):
+    """Compact review representation for the lawyer page"""
+    user = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = LawyerRating
+        fields = ('id', 'user', 'rating', 'review', 'created_at')
+    
+    def get_user(self, obj):
+        return {
+            'id': obj.user.id,
+            'first_name': obj.user.first_name,
+            'last_name': obj.user.last_name,
+            'profile_picture_urls': image_derivatives(obj.user.profile_picture),
+        }
+
 class LawyerRatingCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = LawyerRating
@@ -57,6 +90,7 @@ class PublicLawyerSerializer(serializers.ModelSerializer):
             'first_name': obj.user.first_name,
             'last_name': obj.user.last_name,
             'profile_picture': str(obj.user.profile_picture) if obj.user.profile_picture else None,
+            'profile_picture_urls': image_derivatives(obj.user.profile_picture),
             'city': obj.user.city,
             'state': obj.user.state
         }
\ No newline at end of file
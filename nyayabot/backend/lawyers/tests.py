@@ -1,3 +1,405 @@
-from django.test import TestCase
+import io
+import os
+import shutil
+import tempfile
+from datetime import time
+from unittest import mock
+from PIL import Image
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+from appointments.models import LawyerAvailability
+from authentication.models import User, UserProfile
+from nyayabot_backend.storage import LocalStorageBackend, image_derivatives
+from nyayabot_backend.testing import ListQueryCountMixin
+from .models import LawyerProfile, LawyerRating
 
-# Create your tests here.
+
+def create_lawyer(username, status='pending', **kwargs):
+    user = User.objects.create_user(username=username, user_type='lawyer')
+    UserProfile.objects.create(user=user)
+    defaults = {
+        'bar_council_id': f'BCI-{username}',
+        'bar_council_certificate': 'certificates/sample',
+        'years_of_experience': 5,
+        'education': 'LLB',
+        'office_address': 'Mumbai',
+        'bio': 'Advocate',
+        'status': status,
+    }
+    defaults.update(kwargs)
+    return LawyerProfile.objects.create(user=user, **defaults)
+
+
+def png_file(name='certificate.png', size=(40, 30)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, 'white').save(buffer, 'PNG')
+    return SimpleUploadedFile(name, buffer.getvalue())
+
+
+class ModerationQueueTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user(username='admin', user_type='admin')
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def test_pending_queue_is_paginated_with_constant_queries(self):
+        for i in range(30):
+            create_lawyer(f'lawyer{i}')
+        create_lawyer('approved', status='approved')
+
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('lawyers:pending'), {'page_size': 25})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 30)
+        self.assertEqual(len(response.data['results']), 25)
+
+    def test_pending_queue_requires_admin(self):
+        self.client.force_authenticate(User.objects.create_user(username='someone'))
+        response = self.client.get(reverse('lawyers:pending'))
+        self.assertEqual(response.status_code, 403)
+
+    def test_bulk_moderation_reports_per_item_results(self):
+        first = create_lawyer('first')
+        second = create_lawyer('second')
+        done = create_lawyer('done', status='approved')
+
+        response = self.client.post(reverse('lawyers:bulk-moderate'), {'items': [
+            {'id': first.id, 'action': 'approve'},
+            {'id': second.id, 'action': 'reject', 'reason': 'Certificate unreadable'},
+            {'id': done.id, 'action': 'reject'},
+            {'id': 999999, 'action': 'approve'},
+            {'id': first.id, 'action': 'reject'},
+            {'id': second.id, 'action': 'suspend'},
+        ]}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['processed'], 2)
+        self.assertEqual(
+            [result['status'] for result in response.data['results']],
+            ['approved', 'rejected', 'error', 'error', 'error', 'error']
+        )
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        done.refresh_from_db()
+        self.assertEqual(first.status, 'approved')
+        self.assertEqual(first.verified_by, self.admin)
+        self.assertTrue(first.user.is_verified)
+        self.assertEqual(second.status, 'rejected')
+        self.assertEqual(second.rejection_reason, 'Certificate unreadable')
+        self.assertFalse(second.user.is_verified)
+        self.assertEqual(done.status, 'approved')
+
+    def test_bulk_moderation_query_count_is_independent_of_batch_size(self):
+        profiles = [create_lawyer(f'bulk{i}') for i in range(40)]
+        items = [{'id': profile.id, 'action': 'approve'} for profile in profiles]
+
+        # savepoint + select_for_update + one bulk_update per model + release + cached token keys
+        with self.assertNumQueries(6):
+            response = self.client.post(reverse('lawyers:bulk-moderate'), {'items': items}, format='json')
+
+        self.assertEqual(response.data['processed'], 40)
+        self.assertEqual(LawyerProfile.objects.filter(status='approved').count(), 40)
+        self.assertEqual(User.objects.filter(is_verified=True).count(), 40)
+
+
+@override_settings(UPLOAD_STORAGE_BACKEND='nyayabot_backend.storage.LocalStorageBackend')
+class ListQueryCountTests(ListQueryCountMixin, TestCase):
+    """List endpoints run the same queries whatever the number of rows on the page"""
+    client_class = APIClient
+
+    def setUp(self):
+        cache.clear()
+
+    def test_public_lawyers(self):
+        def add_rows(count):
+            for _ in range(count):
+                create_lawyer(f'lawyer{LawyerProfile.objects.count()}', status='approved')
+
+        response = self.assertConstantQueries(reverse('lawyers:public-list'), add_rows)
+        self.assertEqual(response.data['count'], 17)
+        self.assertNotIn('email', response.data['results'][0]['user'])
+
+    def test_moderation_queue(self):
+        self.client.force_authenticate(User.objects.create_user(username='admin', user_type='admin'))
+
+        def add_rows(count):
+            for _ in range(count):
+                create_lawyer(f'lawyer{LawyerProfile.objects.count()}')
+
+        response = self.assertConstantQueries(reverse('lawyers:pending'), add_rows)
+        self.assertEqual(response.data['count'], 17)
+        self.assertEqual(set(response.data['results'][0]['user']), {
+            'id', 'username', 'first_name', 'last_name', 'user_type', 'is_verified', 'profile_picture_urls',
+        })
+
+    def test_ratings(self):
+        profile = create_lawyer('rated', status='approved')
+
+        def add_rows(count):
+            for _ in range(count):
+                user = User.objects.create_user(username=f'client{User.objects.count()}', email='client@example.com')
+                UserProfile.objects.create(user=user)
+                LawyerRating.objects.create(lawyer=profile, user=user, rating=4, review='Helpful')
+
+        response = self.assertConstantQueries(reverse('lawyers:ratings', args=[profile.id]), add_rows)
+        self.assertEqual(response.data['count'], 17)
+        reviewer = response.data['results'][0]['user']
+        self.assertNotIn('email', reviewer)
+        self.assertNotIn('profile', reviewer)
+
+
+class DirectUploadTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.user = User.objects.create_user(username='advocate')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def upload(self, field):
+        slot = self.client.post(reverse('lawyers:upload-signatures'), {'fields': [field]}, format='json').data[field]
+        response = APIClient().post(slot['upload_url'], {
+            'token': slot['token'],
+            'file': png_file(),
+        }, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        return {'token': slot['token'], 'version': response.data['version'], 'signature': response.data['signature']}
+
+    def profile_payload(self, **uploads):
+        return {
+            'bar_council_id': 'MH/123/2020',
+            'years_of_experience': 3,
+            'education': 'LLB',
+            'office_address': 'Pune',
+            'bio': 'Advocate',
+            **uploads,
+        }
+
+    def test_profile_is_created_from_confirmed_upload(self):
+        confirmation = self.upload('bar_council_certificate')
+
+        response = self.client.post(
+            reverse('lawyers:create-profile'),
+            self.profile_payload(bar_council_certificate=confirmation), format='json'
+        )
+
+        self.assertEqual(response.status_code, 201)
+        profile = LawyerProfile.objects.get(user=self.user)
+        self.assertTrue(profile.bar_council_certificate.public_id.startswith(
+            f'lawyers/{self.user.pk}/bar_council_certificate/'
+        ))
+        self.assertEqual(str(profile.bar_council_certificate.version), str(confirmation['version']))
+
+    def test_tampered_or_misrouted_confirmations_are_rejected(self):
+        confirmation = self.upload('bar_council_certificate')
+        tampered = dict(confirmation, signature='0' * 40)
+        response = self.client.post(
+            reverse('lawyers:create-profile'),
+            self.profile_payload(bar_council_certificate=tampered), format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.post(
+            reverse('lawyers:create-profile'),
+            self.profile_payload(bar_council_certificate=confirmation, identity_proof=confirmation), format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('identity_proof', response.data)
+
+    def test_upload_tokens_are_single_use(self):
+        confirmation = self.upload('identity_proof')
+        replay = APIClient().post(reverse('local-upload'), {
+            'token': confirmation['token'], 'file': png_file('other.png'),
+        }, format='multipart')
+        self.assertEqual(replay.status_code, 403)
+
+        response = self.client.post(reverse('lawyers:create-profile'), self.profile_payload(
+            bar_council_certificate=self.upload('bar_council_certificate'), identity_proof=confirmation,
+        ), format='json')
+        self.assertEqual(response.status_code, 201)
+        response = self.client.patch(
+            reverse('lawyers:upload-confirm'), {'identity_proof': confirmation}, format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('identity_proof', response.data)
+
+    def test_rejected_request_does_not_spend_the_token(self):
+        confirmation = self.upload('bar_council_certificate')
+        response = self.client.post(reverse('lawyers:create-profile'), self.profile_payload(
+            bar_council_certificate=confirmation, years_of_experience='many',
+        ), format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('years_of_experience', response.data)
+
+        response = self.client.post(
+            reverse('lawyers:create-profile'), self.profile_payload(bar_council_certificate=confirmation), format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+
+    def test_malformed_confirmation_is_a_validation_error(self):
+        confirmation = dict(self.upload('bar_council_certificate'), token=12345)
+        response = self.client.post(
+            reverse('lawyers:create-profile'), self.profile_payload(bar_council_certificate=confirmation), format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('bar_council_certificate', response.data)
+
+    def test_uploads_must_be_images_or_pdfs(self):
+        slot = self.client.post(reverse('lawyers:upload-signatures'), format='json').data['degree_certificate']
+        response = APIClient().post(slot['upload_url'], {
+            'token': slot['token'], 'file': SimpleUploadedFile('degree.png', b'\x89PNG not really'),
+        }, format='multipart')
+        self.assertEqual(response.status_code, 400)
+
+        response = APIClient().post(slot['upload_url'], {
+            'token': slot['token'], 'file': SimpleUploadedFile('degree.pdf', b'%PDF-1.7 degree'),
+        }, format='multipart')
+        self.assertEqual(response.status_code, 201)
+
+    def test_expired_upload_token_is_rejected(self):
+        slot = self.client.post(reverse('lawyers:upload-signatures'), format='json').data['identity_proof']
+        with override_settings(UPLOAD_SIGNATURE_MAX_AGE=-1):
+            response = APIClient().post(slot['upload_url'], {
+                'token': slot['token'],
+                'file': SimpleUploadedFile('id.png', b'data'),
+            }, format='multipart')
+        self.assertEqual(response.status_code, 403)
+
+
+@override_settings(UPLOAD_STORAGE_BACKEND='nyayabot_backend.storage.LocalStorageBackend')
+class ProfilePictureDerivativeTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        cache.clear()
+
+    def store_picture(self, public_id, size=(800, 600)):
+        buffer = io.BytesIO()
+        Image.new('RGB', size, 'navy').save(buffer, 'PNG')
+        version, _ = LocalStorageBackend().save(public_id, SimpleUploadedFile('me.png', buffer.getvalue()))
+        return f'image/upload/v{version}/{public_id}'
+
+    def test_listing_emits_cached_derivatives(self):
+        profile = create_lawyer('pictured', status='approved')
+        profile.user.profile_picture = self.store_picture('users/pictured')
+        profile.user.save()
+
+        response = self.client.get(reverse('lawyers:public-list'))
+
+        urls = response.data['results'][0]['user']['profile_picture_urls']
+        self.assertEqual(set(urls), {'thumb', 'card', 'full'})
+        thumb_path = os.path.join(self.media_root, urls['thumb'][len(settings.MEDIA_URL):])
+        with Image.open(thumb_path) as thumb:
+            self.assertEqual(thumb.size, (96, 96))
+        full_path = os.path.join(self.media_root, urls['full'][len(settings.MEDIA_URL):])
+        with Image.open(full_path) as full:
+            self.assertEqual(full.size, (800, 600))
+
+        os.remove(thumb_path)
+        response = self.client.get(reverse('lawyers:public-list'))
+        self.assertEqual(response.data['results'][0]['user']['profile_picture_urls'], urls)
+        self.assertFalse(os.path.exists(thumb_path))
+
+    def test_listing_filters_json_list_fields(self):
+        create_lawyer('family', status='approved', specializations=['family'], languages_spoken=['Hindi'])
+        create_lawyer('criminal', status='approved', specializations=['criminal'], languages_spoken=['English'])
+
+        response = self.client.get(reverse('lawyers:public-list'), {'specializations': 'family'})
+        self.assertEqual([row['specializations'] for row in response.data['results']], [['family']])
+        response = self.client.get(reverse('lawyers:public-list'), {'languages_spoken': 'english'})
+        self.assertEqual([row['specializations'] for row in response.data['results']], [['criminal']])
+
+    def test_unreadable_picture_does_not_break_the_listing(self):
+        profile = create_lawyer('broken', status='approved')
+        LocalStorageBackend().save('users/broken', SimpleUploadedFile('me.png', b'not an image'))
+        profile.user.profile_picture = 'image/upload/v1/users/broken'
+        profile.user.save()
+
+        response = self.client.get(reverse('lawyers:public-list'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.data['results'][0]['user']['profile_picture_urls'])
+
+    def test_storage_errors_are_retried_soon(self):
+        user = User.objects.create_user(username='retry', profile_picture=self.store_picture('users/retry'))
+        picture = User.objects.get(pk=user.pk).profile_picture
+        with mock.patch.object(LocalStorageBackend, 'derivative_url', side_effect=OSError('No space left on device')), \
+                mock.patch.object(cache, 'set', wraps=cache.set) as cache_set:
+            self.assertIsNone(image_derivatives(picture))
+        self.assertEqual(cache_set.call_args.args[2], settings.IMAGE_DERIVATIVE_ERROR_CACHE_TIMEOUT)
+
+        cache.delete(cache_set.call_args.args[0])
+        self.assertEqual(set(image_derivatives(picture)), set(settings.IMAGE_DERIVATIVES))
+
+    def test_new_version_gets_new_derivatives(self):
+        user = User.objects.create_user(username='reupload')
+        user.profile_picture = self.store_picture('users/reupload')
+        user.save()
+        first = image_derivatives(User.objects.get(pk=user.pk).profile_picture)
+
+        user.profile_picture = 'image/upload/v1/users/reupload'
+        user.save()
+        second = image_derivatives(User.objects.get(pk=user.pk).profile_picture)
+
+        self.assertNotEqual(first['card'], second['card'])
+        self.assertIsNone(image_derivatives(None))
+
+
+class LawyerPageTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.profile = create_lawyer('pagelawyer', status='approved')
+        for weekday in range(7):
+            LawyerAvailability.objects.create(
+                lawyer=self.profile.user, weekday=weekday, start_time=time(0, 0), end_time=time(0, 0)
+            )
+        for i in range(12):
+            reviewer = User.objects.create_user(username=f'reviewer{i}')
+            LawyerRating.objects.create(lawyer=self.profile, user=reviewer, rating=i % 5 + 1, review=f'Review {i}')
+
+    def test_page_is_built_within_query_budget_and_cached(self):
+        url = reverse('lawyers:page', args=[self.profile.id])
+
+        # profile + histogram + latest reviews + availability rows + booked appointments,
+        # regardless of how many reviews exist
+        with self.assertNumQueries(5):
+            response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['profile']['id'], self.profile.id)
+        self.assertEqual(response.data['rating_histogram'], {'1': 3, '2': 3, '3': 2, '4': 2, '5': 2})
+        self.assertEqual(len(response.data['latest_reviews']), settings.LAWYER_DETAIL_REVIEW_COUNT)
+        self.assertEqual(response.data['latest_reviews'][0]['review'], 'Review 11')
+        self.assertEqual(len(response.data['next_available_slots']), settings.LAWYER_DETAIL_SLOT_COUNT)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).data, response.data)
+
+    def test_new_rating_invalidates_cached_page(self):
+        url = reverse('lawyers:page', args=[self.profile.id])
+        self.client.get(url)
+
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(username='latecomer'))
+        client.post(reverse('lawyers:rate'), {'lawyer': self.profile.id, 'rating': 5, 'review': 'Latest'})
+
+        response = self.client.get(url)
+        self.assertEqual(response.data['rating_histogram']['5'], 3)
+        self.assertEqual(response.data['latest_reviews'][0]['review'], 'Latest')
+
+    def test_unapproved_lawyer_is_not_found(self):
+        pending = create_lawyer('pendingpage')
+        self.assertEqual(self.client.get(reverse('lawyers:page', args=[pending.id])).status_code, 404)
@@ -2,7 +2,9 @@ from django.urls import path
 from .views import (
     LawyerProfileCreateView, LawyerProfileView, PublicLawyerListView,
     LawyerDetailView, LawyerRatingCreateView, LawyerRatingListView,
-    lawyer_specializations, pending_lawyer_profiles, approve_lawyer_profile
+    lawyer_specializations, pending_lawyer_profiles, approve_lawyer_profile,
+    bulk_moderate_lawyer_profiles, LawyerDocumentUploadView, lawyer_upload_signatures,
+    lawyer_page
 )
 
 app_name = 'lawyers'
@@ -10,11 +12,15 @@ app_name = 'lawyers'
 urlpatterns = [
     path('profile/create/', LawyerProfileCreateView.as_view(), name='create-profile'),
     path('profile/', LawyerProfileView.as_view(), name='profile'),
+    path('profile/uploads/sign/', lawyer_upload_signatures, name='upload-signatures'),
+    path('profile/uploads/confirm/', LawyerDocumentUploadView.as_view(), name='upload-confirm'),
     path('public/', PublicLawyerListView.as_view(), name='public-list'),
     path('<int:pk>/', LawyerDetailView.as_view(), name='detail'),
+    path('<int:pk>/page/', lawyer_page, name='page'),
     path('rate/', LawyerRatingCreateView.as_view(), name='rate'),
     path('<int:lawyer_id>/ratings/', LawyerRatingListView.as_view(), name='ratings'),
     path('specializations/', lawyer_specializations, name='specializations'),
     path('pending/', pending_lawyer_profiles, name='pending'),
+    path('pending/bulk/', bulk_moderate_lawyer_profiles, name='bulk-moderate'),
     path('<int:profile_id>/approve/', approve_lawyer_profile, name='approve'),
 ]
\ No newline at end of file
@@ -3,15 +3,28 @@ from rest_framework import generics, permissions, status, filters, serializers
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
 from django_filters.rest_framework import DjangoFilterBackend
-from django.db.models import Q, Avg
-from django.db import models
+from django.conf import settings
+from django.db.models import Q, Avg, Count
+from django.db import models, transaction
 from django.utils import timezone
+from datetime import timedelta
+from authentication.models import User
+from authentication.authentication import invalidate_user_tokens
+from appointments import availability
+from appointments.availability import next_available_slots
+from .cache import get_lawyer_detail, invalidate_lawyer
+from .filters import PublicLawyerFilter
 from .models import LawyerProfile, LawyerRating
 from .serializers import (
     LawyerProfileSerializer, LawyerProfileCreateSerializer, LawyerRatingSerializer,
-    LawyerRatingCreateSerializer, PublicLawyerSerializer
+    LawyerRatingCreateSerializer, PublicLawyerSerializer, LawyerDocumentUploadSerializer,
+    LawyerReviewSerializer
 )
+from nyayabot_backend.storage import issue_upload
+
+LAWYER_UPLOAD_FIELDS = ('bar_council_certificate', 'identity_proof', 'degree_certificate')
 
 # Create your views here.
 
@@ -36,24 +49,56 @@ class LawyerProfileView(generics.RetrieveUpdateAPIView):
     serializer_class = LawyerProfileSerializer
     permission_classes = [permissions.IsAuthenticated]
     
+    def get_object(self):
+        try:
+            return LawyerProfile.objects.select_related('user').get(user=self.request.user)
+        except LawyerProfile.DoesNotExist:
+            raise NotFound("Lawyer profile not found")
+    
+    def perform_update(self, serializer):
+        profile = serializer.save()
+        invalidate_lawyer(profile.id)
+        availability.invalidate_lawyer(profile.user_id)
+
+class LawyerDocumentUploadView(generics.UpdateAPIView):
+    """Attach confirmed direct uploads to the current lawyer's profile"""
+    serializer_class = LawyerDocumentUploadSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    http_method_names = ['patch']
+    
     def get_object(self):
         try:
             return LawyerProfile.objects.get(user=self.request.user)
         except LawyerProfile.DoesNotExist:
             raise NotFound("Lawyer profile not found")
 
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def lawyer_upload_signatures(request):
+    """Issue short-lived direct-upload signatures for lawyer verification documents"""
+    fields = request.data.get('fields') or list(LAWYER_UPLOAD_FIELDS)
+    if not isinstance(fields, list) or any(field not in LAWYER_UPLOAD_FIELDS for field in fields):
+        return Response({
+            'error': f'fields must be a list drawn from {", ".join(LAWYER_UPLOAD_FIELDS)}'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    return Response({
+        field: issue_upload(request, f'lawyers/{request.user.pk}/{field}', field)
+        for field in fields
+    })
+
 class PublicLawyerListView(generics.ListAPIView):
     """Public listing of approved lawyers"""
     serializer_class = PublicLawyerSerializer
     permission_classes = [permissions.AllowAny]
-    filter_backends = [DjangoFilterBackend, filters.SearchBackend, filters.OrderingFilter]
-    filterset_fields = ['specializations', 'years_of_experience', 'consultation_fee']
+    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    filterset_class = PublicLawyerFilter
     search_fields = ['user__first_name', 'user__last_name', 'law_firm_name', 'bio']
     ordering_fields = ['average_rating', 'total_reviews', 'consultation_fee', 'years_of_experience']
     ordering = ['-average_rating', '-total_reviews']
     
     def get_queryset(self):
-        return LawyerProfile.objects.filter(status='approved')
+        return LawyerProfile.objects.filter(status='approved').select_related('user')
 
 class LawyerDetailView(generics.RetrieveAPIView):
     """Get detailed lawyer information"""
@@ -61,7 +106,38 @@ class LawyerDetailView(generics.RetrieveAPIView):
     permission_classes = [permissions.AllowAny]
     
     def get_queryset(self):
-        return LawyerProfile.objects.filter(status='approved')
+        return LawyerProfile.objects.filter(status='approved').select_related('user')
+
+def build_lawyer_page(profile_id):
+    """Assemble the full lawyer page in a fixed number of queries"""
+    profile = LawyerProfile.objects.filter(id=profile_id, status='approved').select_related('user').first()
+    if profile is None:
+        return None
+    
+    histogram = {str(stars): 0 for stars in range(1, 6)}
+    for row in LawyerRating.objects.filter(lawyer=profile).values('rating').annotate(count=Count('id')).order_by():
+        histogram[str(row['rating'])] = row['count']
+    
+    reviews = LawyerRating.objects.filter(lawyer=profile).select_related('user').order_by('-created_at')
+    
+    return {
+        'profile': PublicLawyerSerializer(profile).data,
+        'rating_histogram': histogram,
+        'latest_reviews': LawyerReviewSerializer(reviews[:settings.LAWYER_DETAIL_REVIEW_COUNT], many=True).data,
+        'next_available_slots': [
+            {'start': slot.isoformat(), 'end': (slot + timedelta(minutes=60)).isoformat()}
+            for slot in next_available_slots(profile.user_id, settings.LAWYER_DETAIL_SLOT_COUNT)
+        ],
+    }
+
+@api_view(['GET'])
+@permission_classes([permissions.AllowAny])
+def lawyer_page(request, pk):
+    """Profile, rating histogram, latest reviews and next slots for one lawyer in a single response"""
+    data = get_lawyer_detail(pk, lambda: build_lawyer_page(pk))
+    if data is None:
+        raise NotFound("Lawyer not found")
+    return Response(data)
 
 class LawyerRatingCreateView(generics.CreateAPIView):
     """Rate a lawyer"""
@@ -87,6 +163,7 @@ class LawyerRatingCreateView(generics.CreateAPIView):
             lawyer.average_rating = round(avg_rating, 2)
             lawyer.total_reviews = ratings.count()
             lawyer.save()
+        invalidate_lawyer(lawyer.id)
 
 class LawyerRatingListView(generics.ListAPIView):
     """Get ratings for a specific lawyer"""
@@ -95,7 +172,7 @@ class LawyerRatingListView(generics.ListAPIView):
     
     def get_queryset(self):
         lawyer_id = self.kwargs.get('lawyer_id')
-        return LawyerRating.objects.filter(lawyer_id=lawyer_id).order_by('-created_at')
+        return LawyerRating.objects.filter(lawyer_id=lawyer_id).select_related('user').order_by('-created_at')
 
 @api_view(['GET'])
 @permission_classes([permissions.AllowAny])
@@ -107,16 +184,106 @@ def lawyer_specializations(request):
     ]
     return Response(specializations)
 
+class ModerationQueuePagination(PageNumberPagination):
+    """Pagination for the admin moderation queue"""
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+MODERATION_BULK_LIMIT = 500
+MODERATION_ACTIONS = ('approve', 'reject')
+
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
 def pending_lawyer_profiles(request):
-    """Get pending lawyer profiles for admin approval"""
+    """Get pending lawyer profiles for admin approval, oldest first"""
+    if request.user.user_type != 'admin':
+        return Response({'error': 'Admin access required'}, status=status.HTTP_403_FORBIDDEN)
+    
+    pending_profiles = LawyerProfile.objects.filter(status='pending').select_related('user').order_by('created_at', 'id')
+    paginator = ModerationQueuePagination()
+    page = paginator.paginate_queryset(pending_profiles, request)
+    serializer = LawyerProfileSerializer(page, many=True)
+    return paginator.get_paginated_response(serializer.data)
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def bulk_moderate_lawyer_profiles(request):
+    """Approve or reject many pending lawyer profiles in one transaction.
+    
+    Expects ``{"items": [{"id": 1, "action": "approve"}, {"id": 2, "action": "reject", "reason": "..."}]}``
+    and returns one result per item, in request order.
+    """
     if request.user.user_type != 'admin':
         return Response({'error': 'Admin access required'}, status=status.HTTP_403_FORBIDDEN)
     
-    pending_profiles = LawyerProfile.objects.filter(status='pending')
-    serializer = LawyerProfileSerializer(pending_profiles, many=True)
-    return Response(serializer.data)
+    items = request.data.get('items')
+    if not isinstance(items, list) or not items:
+        return Response({'error': 'items must be a non-empty list'}, status=status.HTTP_400_BAD_REQUEST)
+    if len(items) > MODERATION_BULK_LIMIT:
+        return Response({'error': f'At most {MODERATION_BULK_LIMIT} items per request'},
+                        status=status.HTTP_400_BAD_REQUEST)
+    
+    results = []
+    decisions = {}
+    for item in items:
+        profile_id = item.get('id') if isinstance(item, dict) else None
+        action = item.get('action') if isinstance(item, dict) else None
+        result = {'id': profile_id, 'action': action}
+        results.append(result)
+        if not isinstance(profile_id, int) or isinstance(profile_id, bool):
+            result.update(status='error', error='Invalid profile id')
+        elif action not in MODERATION_ACTIONS:
+            result.update(status='error', error='Invalid action')
+        elif profile_id in decisions:
+            result.update(status='error', error='Duplicate profile id')
+        else:
+            decisions[profile_id] = (action, item.get('reason', ''), result)
+    
+    with transaction.atomic():
+        profiles = LawyerProfile.objects.select_for_update().select_related('user').filter(id__in=decisions)
+        profiles = {profile.id: profile for profile in profiles}
+        now = timezone.now()
+        changed_profiles = []
+        verified_users = []
+        
+        for profile_id, (action, reason, result) in decisions.items():
+            profile = profiles.get(profile_id)
+            if profile is None:
+                result.update(status='error', error='Lawyer profile not found')
+                continue
+            if profile.status != 'pending':
+                result.update(status='error', error=f'Lawyer profile is already {profile.status}')
+                continue
+            
+            if action == 'approve':
+                profile.status = 'approved'
+                profile.verified_by = request.user
+                profile.verification_date = now
+                profile.user.is_verified = True
+                profile.user.updated_at = now
+                verified_users.append(profile.user)
+            else:
+                profile.status = 'rejected'
+                profile.rejection_reason = reason
+            profile.updated_at = now
+            changed_profiles.append(profile)
+            result['status'] = profile.status
+        
+        LawyerProfile.objects.bulk_update(
+            changed_profiles,
+            ['status', 'verified_by', 'verification_date', 'rejection_reason', 'updated_at']
+        )
+        User.objects.bulk_update(verified_users, ['is_verified', 'updated_at'])
+    
+    invalidate_lawyer(*(profile.id for profile in changed_profiles))
+    invalidate_user_tokens(*(user.id for user in verified_users))
+    
+    return Response({
+        'processed': len(changed_profiles),
+        'failed': len(results) - len(changed_profiles),
+        'results': results
+    })
 
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
@@ -142,6 +309,7 @@ def approve_lawyer_profile(request, profile_id):
             return Response({'error': 'Invalid action'}, status=status.HTTP_400_BAD_REQUEST)
         
         profile.save()
+        invalidate_lawyer(profile.id)
         
         return Response({
             'message': f'Lawyer profile {action}ed successfully',
@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 from pathlib import Path
 from datetime import timedelta
 import os
+import tempfile
 from decouple import config
 import cloudinary
 import cloudinary.uploader
@@ -92,12 +93,47 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            'timeout': 20,  # seconds to wait for the write lock under concurrent bookings
+        },
+        'TEST': {
+            # A file (not shared-cache memory) so concurrent connections wait for locks instead of failing
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
+# Cache (Redis when REDIS_URL is set, per-process memory otherwise)
+REDIS_URL = config('REDIS_URL', default='')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
 # Custom User Model
 AUTH_USER_MODEL = 'authentication.User'
 
+# Password hashing runs on its own pool (see authentication/hashing.py)
+PASSWORD_HASHERS = [
+    'authentication.hashing.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+PASSWORD_HASHING_WORKERS = config('PASSWORD_HASHING_WORKERS', default=max((os.cpu_count() or 1) // 2, 1), cast=int)
+PASSWORD_HASHING_QUEUE = config('PASSWORD_HASHING_QUEUE', default=16, cast=int)  # hashes waiting beyond that get a 503
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -117,7 +153,7 @@ AUTH_PASSWORD_VALIDATORS = [
 # REST Framework Configuration
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'authentication.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -127,6 +163,15 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20,
+    # Proxies in front of the app that append to X-Forwarded-For; with 0 throttles use REMOTE_ADDR,
+    # since the header is whatever the client sent
+    'NUM_PROXIES': config('NUM_PROXIES', default=0, cast=int),
+    # Sliding windows checked before any password is hashed (see authentication/throttling.py)
+    'DEFAULT_THROTTLE_RATES': {
+        'login': '30/minute',
+        'login-username': '10/minute',
+        'registration': '10/hour',
+    },
 }
 
 # CORS Configuration
@@ -170,11 +215,74 @@ cloudinary.config(
     secure=True
 )
 
+# Direct-to-storage uploads (fall back to the local stand-in when Cloudinary is not configured)
+UPLOAD_STORAGE_BACKEND = config(
+    'UPLOAD_STORAGE_BACKEND',
+    default='nyayabot_backend.storage.CloudinaryStorageBackend' if CLOUDINARY_STORAGE['CLOUD_NAME']
+    else 'nyayabot_backend.storage.LocalStorageBackend'
+)
+UPLOAD_SIGNATURE_MAX_AGE = config('UPLOAD_SIGNATURE_MAX_AGE', default=600, cast=int)  # seconds
+UPLOAD_MAX_BYTES = config('UPLOAD_MAX_BYTES', default=10 * 1024 * 1024, cast=int)
+
+# Named image derivatives served in listings instead of full-size originals
+IMAGE_DERIVATIVES = {
+    'thumb': {'width': 96, 'height': 96, 'crop': 'fill'},
+    'card': {'width': 320, 'height': 320, 'crop': 'fill'},
+    'full': {'width': 1280, 'height': 1280, 'crop': 'limit'},
+}
+IMAGE_DERIVATIVE_CACHE_TIMEOUT = 60 * 60 * 24 * 7  # URLs are keyed by image version
+IMAGE_DERIVATIVE_ERROR_CACHE_TIMEOUT = 60  # after a storage error, which may clear up; files that aren't images use the above
+
+# Authentication
+AUTH_TOKEN_CACHE_TIMEOUT = 60  # tokens, users and profiles; deleted early on logout and changes
+
+# Public lawyer directory
+LAWYER_DIRECTORY_CACHE_TIMEOUT = 60 * 5
+LAWYER_DETAIL_REVIEW_COUNT = 5
+LAWYER_DETAIL_SLOT_COUNT = 10
+
+# Appointment scheduling
+APPOINTMENT_SLOT_MINUTES = 15
+AVAILABILITY_CACHE_TIMEOUT = 60 * 60
+FIRST_AVAILABLE_MATRIX_TTL = 60  # seconds between rebuilds of the cross-lawyer search matrix
+FIRST_AVAILABLE_HORIZON_DAYS = 14
+APPOINTMENT_HOLD_MINUTES = 30  # how long a pending request keeps its slot
+APPOINTMENT_REMINDER_LEAD = timedelta(hours=24)
+APPOINTMENT_REMINDER_BATCH_SIZE = 500
+APPOINTMENT_REMINDER_CLAIM_TIMEOUT = timedelta(minutes=10)
+APPOINTMENT_NO_SHOW_AFTER = timedelta(hours=24)  # confirmed appointments still open this long after their start
+APPOINTMENT_SWEEP_BATCH_SIZE = 1000
+CALENDAR_FEED_PAST_DAYS = 90
+CALENDAR_FEED_CHUNK_SIZE = 200  # events per streamed chunk
+
+# Chunked document uploads
+DOCUMENT_UPLOAD_TEMP_DIR = config('DOCUMENT_UPLOAD_TEMP_DIR', default=os.path.join(tempfile.gettempdir(), 'nyayabot-uploads'))
+DOCUMENT_UPLOAD_MAX_BYTES = 100 * 1024 * 1024
+DOCUMENT_UPLOAD_MAX_CHUNK_BYTES = 8 * 1024 * 1024
+DOCUMENT_UPLOAD_ALLOWED_TYPES = ['pdf', 'doc', 'docx', 'png', 'jpg', 'tiff']  # detected from magic bytes
+DOCUMENT_UPLOAD_SESSION_TTL = timedelta(hours=24)  # extended by every chunk
+
+# Document analysis pipeline
+DOCUMENT_ANALYZER = 'documents.analysis.OpenAIAnalyzer'
+DOCUMENT_ANALYSIS_MODEL = config('DOCUMENT_ANALYSIS_MODEL', default='gpt-3.5-turbo-1106')
+DOCUMENT_ANALYSIS_MAX_CHARS = 12000  # of extracted text sent to the model
+DOCUMENT_ANALYSIS_CONCURRENCY = config('DOCUMENT_ANALYSIS_CONCURRENCY', default=2, cast=int)  # worker threads per process
+DOCUMENT_ANALYSIS_EAGER = config('DOCUMENT_ANALYSIS_EAGER', default=False, cast=bool)  # run jobs in the calling thread
+DOCUMENT_ANALYSIS_MAX_ATTEMPTS = 3
+DOCUMENT_ANALYSIS_RETRY_DELAY = timedelta(minutes=1)  # doubled after every failed attempt
+DOCUMENT_ANALYSIS_CLAIM_TIMEOUT = timedelta(minutes=15)
+DOCUMENT_ANALYSIS_WORK_DIR = config('DOCUMENT_ANALYSIS_WORK_DIR', default=os.path.join(tempfile.gettempdir(), 'nyayabot-analysis'))
+DOCUMENT_EXTRACTION_CHECKPOINT_PAGES = 10
+DOCUMENT_SEARCH_PAGE_SIZE = 20
+DOCUMENT_SIMILARITY_THRESHOLD = 0.5  # estimated Jaccard similarity of word shingles
+DOCUMENT_SIMILAR_LIMIT = 10
+
 # OpenAI Configuration
 OPENAI_API_KEY = config('OPENAI_API_KEY', default='')
 
 # Email Configuration
-EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+EMAIL_BACKEND = config('EMAIL_BACKEND', default='django.core.mail.backends.console.EmailBackend')
+DEFAULT_FROM_EMAIL = config('DEFAULT_FROM_EMAIL', default='NyayaBot <no-reply@nyayabot.in>')
 
 # Security Settings
 SECURE_CROSS_ORIGIN_OPENER_POLICY = 'same-origin-allow-popups'
@@ -0,0 +1,357 @@
+"""
+Direct-to-storage upload backends.
+
+Clients ask the API for a short-lived upload signature, send the file
+straight to the storage backend, and then hand the backend's response back
+to the API, which only verifies it and stores the resulting public ID.
+
+The active backend is chosen with the ``UPLOAD_STORAGE_BACKEND`` setting.
+``CloudinaryStorageBackend`` is used in production; ``LocalStorageBackend``
+writes into ``MEDIA_ROOT`` so the flow can be exercised without Cloudinary.
+
+Backends also produce the named image derivatives listed in
+``IMAGE_DERIVATIVES`` (thumb, card, full). Their URLs are cached per image
+version, so a new upload naturally gets fresh derivatives.
+"""
+import abc
+import os
+import shutil
+import time
+import uuid
+
+import cloudinary
+import cloudinary.uploader
+import cloudinary.utils
+import requests
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.db import transaction
+from django.urls import reverse
+from django.utils.crypto import constant_time_compare, salted_hmac
+from django.utils.module_loading import import_string
+from PIL import Image, ImageOps, UnidentifiedImageError
+from rest_framework import permissions, serializers, status
+from rest_framework.decorators import api_view, parser_classes, permission_classes
+from rest_framework.parsers import MultiPartParser
+from rest_framework.response import Response
+
+UPLOAD_TOKEN_SALT = 'nyayabot.storage.upload'
+
+
+class UploadBackend(abc.ABC):
+    """Base class for direct-to-storage upload backends"""
+
+    @abc.abstractmethod
+    def sign_upload(self, request, public_id, resource_type):
+        """Return ``(upload_url, params)`` the client posts the file to"""
+
+    @abc.abstractmethod
+    def verify_upload(self, public_id, version, signature):
+        """Return True if the backend really stored ``public_id`` at ``version``"""
+
+    @abc.abstractmethod
+    def derivative_url(self, public_id, version, name, spec):
+        """Return the URL of derivative ``name`` of an image, or None if it can't be produced"""
+
+    @abc.abstractmethod
+    def store(self, public_id, path, resource_type):
+        """Upload a local file from the server itself and return its version"""
+
+    @abc.abstractmethod
+    def open(self, public_id, version, resource_type, offset=0):
+        """Return a binary file object reading a stored file from byte ``offset``"""
+
+
+class CloudinaryStorageBackend(UploadBackend):
+    """Signed uploads straight to Cloudinary"""
+
+    def sign_upload(self, request, public_id, resource_type):
+        params = {'public_id': public_id, 'timestamp': int(time.time())}
+        config = cloudinary.config()
+        params['signature'] = cloudinary.utils.api_sign_request(params, config.api_secret)
+        params['api_key'] = config.api_key
+        return cloudinary.utils.cloudinary_api_url('upload', resource_type=resource_type), params
+
+    def verify_upload(self, public_id, version, signature):
+        return cloudinary.utils.verify_api_response_signature(public_id, version, signature)
+
+    def derivative_url(self, public_id, version, name, spec):
+        # Transformation URLs are computed locally; Cloudinary renders each one once on first request
+        return cloudinary.CloudinaryImage(public_id, version=version).build_url(
+            width=spec['width'], height=spec['height'], crop=spec['crop'],
+            quality='auto', fetch_format='auto', secure=True
+        )
+
+    def store(self, public_id, path, resource_type):
+        # upload_large sends the file in chunks instead of reading it into memory
+        result = cloudinary.uploader.upload_large(path, public_id=public_id, resource_type=resource_type)
+        return result['version']
+
+    def open(self, public_id, version, resource_type, offset=0):
+        url, _ = cloudinary.utils.cloudinary_url(public_id, version=version, resource_type=resource_type, secure=True)
+        headers = {'Range': f'bytes={offset}-'} if offset else {}
+        response = requests.get(url, headers=headers, stream=True, timeout=30)
+        response.raise_for_status()
+        response.raw.decode_content = True
+        if offset and response.status_code != 206:
+            # The range was ignored; skip to the offset ourselves
+            remaining = offset
+            while remaining:
+                block = response.raw.read(min(remaining, 1024 * 1024))
+                if not block:
+                    break
+                remaining -= len(block)
+        return response.raw
+
+
+class LocalStorageBackend(UploadBackend):
+    """Filesystem stand-in for Cloudinary used in development and tests"""
+
+    def sign_upload(self, request, public_id, resource_type):
+        return request.build_absolute_uri(reverse('local-upload')), {}
+
+    def response_signature(self, public_id, version):
+        return salted_hmac(UPLOAD_TOKEN_SALT, f'{public_id}:{version}').hexdigest()
+
+    def verify_upload(self, public_id, version, signature):
+        return (
+            constant_time_compare(signature, self.response_signature(public_id, version))
+            and os.path.exists(self.path(public_id))
+        )
+
+    def path(self, public_id):
+        return os.path.join(settings.MEDIA_ROOT, 'uploads', public_id)
+
+    def save(self, public_id, uploaded_file):
+        path = self.path(public_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as destination:
+            for chunk in uploaded_file.chunks():
+                destination.write(chunk)
+        version = int(time.time())
+        return version, self.response_signature(public_id, version)
+
+    def store(self, public_id, path, resource_type):
+        destination = self.path(public_id)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        shutil.copyfile(path, destination)
+        return int(time.time())
+
+    def open(self, public_id, version, resource_type, offset=0):
+        source = open(self.path(public_id), 'rb')
+        source.seek(offset)
+        return source
+
+    def derivative_url(self, public_id, version, name, spec):
+        relative_path = f'derivatives/{name}/{public_id}_v{version}.jpg'
+        path = os.path.join(settings.MEDIA_ROOT, relative_path)
+        if not os.path.exists(path):
+            source = self.path(public_id)
+            if not os.path.exists(source):
+                return None
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with Image.open(source) as image:
+                image = ImageOps.exif_transpose(image).convert('RGB')
+                size = (spec['width'], spec['height'])
+                if spec['crop'] == 'fill':
+                    image = ImageOps.fit(image, size, Image.LANCZOS)
+                else:
+                    image.thumbnail(size, Image.LANCZOS)
+                # Write to a temporary name first so concurrent readers never see a partial file
+                temporary_path = f'{path}.{uuid.uuid4().hex}.tmp'
+                image.save(temporary_path, 'JPEG', quality=85, optimize=True)
+                os.replace(temporary_path, path)
+        return settings.MEDIA_URL + relative_path
+
+
+def get_upload_backend():
+    return import_string(settings.UPLOAD_STORAGE_BACKEND)()
+
+
+def image_derivatives(resource):
+    """Return ``{name: url}`` for every configured derivative of a stored image.
+
+    ``resource`` is the value of a ``CloudinaryField``. Results are cached per
+    public ID and version, so derivatives are only built once per upload.
+    Returns None when the stored file isn't an image that can be rendered.
+    """
+    if not resource or not getattr(resource, 'public_id', None):
+        return None
+
+    version = resource.version or 0
+    cache_key = f'image-derivatives:{resource.public_id}:v{version}'
+    urls = cache.get(cache_key)
+    if urls is None:
+        backend = get_upload_backend()
+        timeout = settings.IMAGE_DERIVATIVE_CACHE_TIMEOUT
+        try:
+            urls = {
+                name: backend.derivative_url(resource.public_id, version, name, spec)
+                for name, spec in settings.IMAGE_DERIVATIVES.items()
+            }
+        except (UnidentifiedImageError, Image.DecompressionBombError):
+            # Cached as empty too, so a file that isn't an image isn't reopened on every listing
+            urls = {}
+        except OSError:
+            # A full disk or an unreachable store may clear up, so this is retried shortly
+            urls, timeout = {}, settings.IMAGE_DERIVATIVE_ERROR_CACHE_TIMEOUT
+        cache.set(cache_key, urls, timeout)
+    return urls or None
+
+
+def is_image_upload(uploaded_file):
+    """Whether a file is something the ``image`` resource type may hold: a readable image or a PDF"""
+    uploaded_file.seek(0)
+    try:
+        if uploaded_file.read(5) == b'%PDF-':
+            return True
+        uploaded_file.seek(0)
+        with Image.open(uploaded_file) as image:
+            image.verify()
+        return True
+    except (UnidentifiedImageError, OSError, SyntaxError, ValueError):
+        return False
+    finally:
+        uploaded_file.seek(0)
+
+
+def issue_upload(request, folder, field, resource_type='image'):
+    """Create a signed, short-lived upload slot for ``field`` of the current user"""
+    public_id = f'{folder}/{uuid.uuid4().hex}'
+    token = signing.dumps(
+        {'public_id': public_id, 'user': request.user.pk, 'field': field, 'resource_type': resource_type},
+        salt=UPLOAD_TOKEN_SALT
+    )
+    upload_url, params = get_upload_backend().sign_upload(request, public_id, resource_type)
+    return {
+        'upload_url': upload_url,
+        'params': params,
+        'token': token,
+        'public_id': public_id,
+        'expires_in': settings.UPLOAD_SIGNATURE_MAX_AGE,
+    }
+
+
+def load_upload_token(token, max_age=None):
+    """Decode an upload token, raising ``signing.BadSignature`` when invalid or expired"""
+    return signing.loads(
+        token, salt=UPLOAD_TOKEN_SALT,
+        max_age=settings.UPLOAD_SIGNATURE_MAX_AGE if max_age is None else max_age
+    )
+
+
+def _upload_token_key(payload, use):
+    return f"upload-token:{use}:{payload['public_id']}"
+
+
+def claim_upload_token(payload, use):
+    """Record that the token for ``payload`` was spent on ``use``; False if it already was.
+
+    Tokens stay valid until they expire, so each one is accepted once per use
+    (the upload itself, then its confirmation) for as long as it could be.
+    """
+    return cache.add(_upload_token_key(payload, use), True, settings.UPLOAD_SIGNATURE_MAX_AGE * 2 + 60)
+
+
+def upload_token_used(payload, use):
+    return cache.get(_upload_token_key(payload, use)) is not None
+
+
+class SignedUploadField(serializers.Field):
+    """Accepts a confirmed direct upload and resolves it to a stored resource path.
+
+    The client sends ``{"token": ..., "version": ..., "signature": ...}``, where
+    ``token`` was issued by :func:`issue_upload` and ``version``/``signature``
+    come from the storage backend's upload response. The token is only spent
+    once the serializer saves (see :class:`SignedUploadSerializerMixin`).
+    """
+    default_error_messages = {
+        'invalid': 'Expected an object with token, version and signature.',
+        'expired': 'Upload token is invalid or has expired.',
+        'mismatch': 'Upload token was issued for a different field or user.',
+        'unverified': 'Upload could not be verified with the storage backend.',
+        'used': 'Upload token has already been used.',
+    }
+
+    def __init__(self, upload_field=None, **kwargs):
+        self.upload_field = upload_field
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        if not isinstance(data, dict) or not all(data.get(key) for key in ('token', 'version', 'signature')):
+            self.fail('invalid')
+        if not isinstance(data['token'], str):
+            self.fail('invalid')
+        try:
+            # Confirmation may legitimately arrive a little after the upload window closes
+            payload = load_upload_token(data['token'], max_age=settings.UPLOAD_SIGNATURE_MAX_AGE * 2)
+        except signing.BadSignature:
+            self.fail('expired')
+
+        request = self.context.get('request')
+        expected_field = self.upload_field or self.field_name
+        if payload['field'] != expected_field or request is None or payload['user'] != request.user.pk:
+            self.fail('mismatch')
+        if not get_upload_backend().verify_upload(payload['public_id'], str(data['version']), data['signature']):
+            self.fail('unverified')
+        if upload_token_used(payload, 'confirm'):
+            self.fail('used')
+        self.upload_payload = payload
+        return f"{payload['resource_type']}/upload/v{data['version']}/{payload['public_id']}"
+
+    def to_representation(self, value):
+        return str(value) if value else None
+
+
+class SignedUploadSerializerMixin:
+    """Spends the tokens confirmed by the serializer's ``SignedUploadField``s once the instance is saved.
+
+    A request that fails validation or saving leaves its tokens usable, so the
+    corrected retry goes through.
+    """
+
+    def save(self, **kwargs):
+        with transaction.atomic():
+            instance = super().save(**kwargs)
+            for field in self.fields.values():
+                payload = getattr(field, 'upload_payload', None)
+                if payload and not claim_upload_token(payload, 'confirm'):
+                    # Confirmed concurrently by another request; undo this save
+                    raise serializers.ValidationError({field.field_name: [field.error_messages['used']]})
+        return instance
+
+
+@api_view(['POST'])
+@permission_classes([permissions.AllowAny])
+@parser_classes([MultiPartParser])
+def local_upload(request):
+    """Receive a direct upload for LocalStorageBackend, mimicking Cloudinary's response"""
+    backend = get_upload_backend()
+    if not isinstance(backend, LocalStorageBackend):
+        return Response({'error': 'Local uploads are disabled'}, status=status.HTTP_404_NOT_FOUND)
+
+    try:
+        payload = load_upload_token(request.data.get('token', ''))
+    except signing.BadSignature:
+        return Response({'error': 'Upload token is invalid or has expired'}, status=status.HTTP_403_FORBIDDEN)
+
+    uploaded_file = request.FILES.get('file')
+    if uploaded_file is None:
+        return Response({'error': 'file is required'}, status=status.HTTP_400_BAD_REQUEST)
+    if uploaded_file.size > settings.UPLOAD_MAX_BYTES:
+        return Response({'error': 'File is too large'}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+    if payload['resource_type'] == 'image' and not is_image_upload(uploaded_file):
+        return Response({'error': 'File is not an image or PDF'}, status=status.HTTP_400_BAD_REQUEST)
+
+    if not claim_upload_token(payload, 'upload'):
+        return Response({'error': 'Upload token has already been used'}, status=status.HTTP_403_FORBIDDEN)
+
+    version, signature = backend.save(payload['public_id'], uploaded_file)
+    return Response({
+        'public_id': payload['public_id'],
+        'version': version,
+        'signature': signature,
+        'resource_type': payload['resource_type'],
+        'bytes': uploaded_file.size,
+    }, status=status.HTTP_201_CREATED)
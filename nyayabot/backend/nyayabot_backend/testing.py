@@ -0,0 +1,22 @@
+"""
+Assertions shared by the apps' tests.
+"""
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+class ListQueryCountMixin:
+    """``assertConstantQueries`` for ``TestCase``s of list endpoints"""
+
+    def assertConstantQueries(self, url, add_rows, client=None, data=None):
+        """GET ``url`` after ``add_rows(2)`` and again after ``add_rows(15)``; both must run the same queries"""
+        client = client or self.client
+        counts = []
+        for rows in (2, 15):
+            add_rows(rows)
+            with CaptureQueriesContext(connection) as queries:
+                response = client.get(url, data)
+            self.assertEqual(response.status_code, 200)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1], f'{url}: {counts[0]} queries for a few rows, {counts[1]} for many')
+        return response
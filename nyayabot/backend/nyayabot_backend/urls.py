@@ -21,6 +21,7 @@ from django.conf.urls.static import static
 from rest_framework import permissions
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
+from .storage import local_upload
 
 @api_view(['GET'])
 @permission_classes([permissions.AllowAny])
@@ -47,6 +48,7 @@ urlpatterns = [
     path('api/chat/', include('chat.urls')),
     path('api/documents/', include('documents.urls')),
     path('api/appointments/', include('appointments.urls')),
+    path('api/uploads/local/', local_upload, name='local-upload'),
 ]
 
 # Serve media files in development